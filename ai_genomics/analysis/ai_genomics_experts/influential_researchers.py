@@ -9,6 +9,7 @@ from typing import List
 
 import ai_genomics.getters.openalex as oalex
 from ai_genomics.getters.openalex import get_openalex_ai_genomics_works
+from ai_genomics.utils.author_timeline import top_authors
 
 TARGET_PATH = f"{PROJECT_DIR}/outputs/data/experts"
 
@@ -31,48 +32,6 @@ def high_cited(cit_distr: pd.Series, q: float) -> List[bool]:
     return [citations > threshold for citations in cit_distr]
 
 
-def load_all_oalex(oalex_getter, id_name: str):
-    """Reads, concatenates and returns all OpenAlex data"""
-    return (
-        pd.concat(
-            [
-                oalex_getter(disc, year_list=range(2012, 2022))
-                for disc in ["artificial_intelligence", "genetics"]
-            ]
-        )
-        .drop_duplicates(id_name)
-        .reset_index(drop=True)
-    )
-
-
-def get_top_authors(auths: pd.DataFrame, ids: set, country="all"):
-    """Returns top authors in a dataset"""
-
-    auths_out = (
-        auths.loc[auths["id"].isin(ids)][
-            [
-                "auth_id",
-                "auth_display_name",
-                "auth_orcid",
-                "inst_id",
-                "display_name",
-                "country_code",
-            ]
-        ]
-        .value_counts(ascending=False)
-        .reset_index(name="num_pubs")
-    )
-
-    # Filter by country if needed
-    return (
-        auths_out
-        if country == "all"
-        else (
-            auths_out.loc[auths_out["country_code"] == country].reset_index(drop=True)
-        )
-    )
-
-
 if __name__ == "__main__":
 
     logging.info("Loading data")
@@ -89,47 +48,12 @@ if __name__ == "__main__":
         )
         .reset_index(drop=True)
     )
-    # We implement a convoluted method to ensure we are only recommending
-    # authors who according to the most recent openalex affiliation data are based
-    # in the UK
-
-    # Lookup between Openalex and publication date
-    work_date_lu = (
-        load_all_oalex(oalex.work_metadata, "work_id")
-        .set_index("work_id")["publication_date"]
-        .to_dict()
-    )
-
-    # All openalex authors
-    oalex_author = (
-        load_all_oalex(oalex.work_authorship, "id")
-        .assign(pub_date=lambda df: df["id"].map(work_date_lu))
-        .assign(pub_date=lambda df: pd.to_datetime(df["pub_date"]))
-    )
-
-    instits = oalex.instit_metadata().rename(columns={"id": "inst_id"})
-
-    logging.info("Finding the most recent institution for each author")
-
-    # Last publication date for each author
-    oalex_last_date = oalex_author.groupby("auth_id")["pub_date"].max()
-
-    # Last institution for each author (NB the inner merge)
-    oalex_last_inst = (
-        oalex_author.merge(
-            oalex_last_date.reset_index(name="last_date"),
-            left_on=["auth_id", "pub_date"],
-            right_on=["auth_id", "last_date"],
-            how="inner",
-        )
-        .reset_index(drop=True)
-        .merge(instits, left_on="inst_id", right_on="inst_id")
-    )[["auth_id", "inst_id", "display_name", "country_code"]]
-
-    # This combines author paper data with an author's last institution
-    oalex_author_2 = oalex_author.drop(axis=1, labels=["inst_id"]).merge(
-        oalex_last_inst, left_on="auth_id", right_on="auth_id", how="left"
-    )
+    # We use the author timeline index (built in make_year_summary.py) to
+    # ensure we are only recommending authors who according to the most
+    # recent openalex affiliation data are based in the UK
+    timeline = oalex.author_timeline()
+    author_meta = oalex.author_metadata()
+    instits = oalex.instit_metadata()
 
     # IDS for all "AI genomics papers" and all highly cited "AI genomics" papers
     ai_genom_ids = set(ai_proc["work_id"])
@@ -141,9 +65,9 @@ if __name__ == "__main__":
         [ai_genom_ids, ai_genom_ids_cited],
         ["openalex_uk_authors_most_pubs", "openalex_uk_authors_most_high_cited_pubs"],
     ):
-        tab = get_top_authors(oalex_author_2, _ids, country="GB").head(n=50)[
-            VARS_TO_KEEP
-        ]
+        tab = top_authors(
+            timeline, author_meta, _ids, country="GB", instits=instits
+        ).head(n=50)[VARS_TO_KEEP]
         logging.info(tab.head())
 
         tab.to_csv(f"{TARGET_PATH}/{title}.csv", index=False)
@@ -3,7 +3,6 @@
 import pandas as pd
 import altair as alt
 import logging
-from umap import UMAP
 from sklearn.cluster import KMeans
 from sklearn.metrics import silhouette_score
 from ai_genomics.getters.data_getters import load_s3_data
@@ -11,6 +10,7 @@ from ai_genomics.getters.gtr import get_ai_genomics_project_table
 from ai_genomics import PROJECT_DIR
 from ai_genomics.utils.save_plotting import AltairSaver
 from ai_genomics.utils.plotting import configure_plots
+from ai_genomics.utils.knn_graph import knn_graph, umap_reducer
 
 OUT_PATH = f"{PROJECT_DIR}/outputs/figures"
 
@@ -25,13 +25,17 @@ def get_gtr_vectors():
     return load_s3_data("ai-genomics", "inputs/gtr/processed/gtr_vectors.pickle")
 
 
-def gtr_cluster_analysis(reproduce: bool = True):
+def gtr_cluster_analysis(reproduce: bool = True, precomputed_knn: bool = False):
     """Runs the gtr analysis
     Args:
         reproduce: if we are reproducing JMG's local analysis.
             If we don't reproduce the analyssi then we sample a new set
             of baseline projects and create their vector representations. This
             takes ca. 1 hr.
+        precomputed_knn: if True, the UMAP projection uses a precomputed
+            cosine k-NN graph (see `ai_genomics.utils.knn_graph`) instead of
+            UMAP's default euclidean neighbour search. This changes the
+            projection, so it is off by default.
     """
 
     if reproduce:
@@ -55,9 +59,9 @@ def gtr_cluster_analysis(reproduce: bool = True):
             for var in ["ai_genomics", "ai", "genomics"]
         ]
 
-        from sentence_transformers import SentenceTransformer
+        from ai_genomics.utils.text_embedding import embed
+        from ai_genomics.utils.embedding_cache import EMBEDDING_CACHE_DIR
 
-        model = SentenceTransformer("allenai-specter")
         gtr_sampled = pd.concat(
             [
                 gtr_table.query("ai_genomics==True"),
@@ -72,12 +76,12 @@ def gtr_cluster_analysis(reproduce: bool = True):
                 gtr_sampled["title"].values, gtr_sampled["abstract_text"].values
             )
         ]
-        gtr_vectors = model.encode(gtr_text)
+        gtr_vectors = embed(gtr_text, "allenai-specter", cache_dir=EMBEDDING_CACHE_DIR)
 
     logging.info("Clustering data")
 
-    # Umap projection
-    um = UMAP()
+    # Umap projection (optionally over a precomputed cosine k-NN graph)
+    um = umap_reducer(knn_graph(gtr_vectors, k=15) if precomputed_knn else None)
     um_proj = um.fit_transform(gtr_vectors)
 
     doc_proj_df = (
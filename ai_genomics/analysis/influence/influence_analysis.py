@@ -10,6 +10,7 @@ import spacy
 from spacy.tokenizer import Tokenizer
 
 import ai_genomics.utils.text_modeling as tm
+from ai_genomics.utils.text_cleaning import remove_digits, remove_symbols
 from ai_genomics.getters.data_getters import save_to_s3
 
 # NLP stuff
@@ -38,8 +39,8 @@ def text_processing(
     return pipe(
         text_dict.values(),
         list,
-        lambda corpus: [tm.remove_symbols(d) for d in corpus],
-        lambda corpus: [tm.remove_digits(d) for d in corpus],
+        lambda corpus: [remove_symbols(d) for d in corpus],
+        lambda corpus: [remove_digits(d) for d in corpus],
         lambda corpus: tokenizer.pipe(corpus),
         lambda corpus: [tm.remove_stop_punct(d) for d in corpus],
         lambda corpus: [tm.remove_short_tokens(d) for d in corpus],
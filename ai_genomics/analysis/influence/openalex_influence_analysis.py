@@ -3,18 +3,14 @@
 import logging
 import pandas as pd
 import numpy as np
-import spacy
 from toolz import pipe
 from functools import partial
-from spacy.tokenizer import Tokenizer
+from typing import Dict, List, Union
 
 import ai_genomics.getters.openalex as oal
 import ai_genomics.utils.text_modeling as tm
 from ai_genomics.getters.data_getters import save_to_s3
-
-# NLP stuff
-nlp = spacy.load("en_core_web_sm")
-tokenizer = Tokenizer(nlp.vocab)
+from ai_genomics.utils.reading import MergedMapping
 
 
 def binarise_top(array: np.array, q: float = 0.9):
@@ -23,13 +19,45 @@ def binarise_top(array: np.array, q: float = 0.9):
     return [w > thres for w in array]
 
 
+def token_processing(
+    token_dict: Dict[str, Union[List[str], None]], n_grams: int = 3
+) -> Dict[str, List[str]]:
+    """Text processing pipeline for documents that are already clean token
+    streams (e.g. OpenAlex abstract tokens). This skips the spaCy
+    tokenisation and filtering steps of the GtR `text_processing` pipeline.
+
+    Args:
+        token_dict: Dictionary of clean tokens to process.
+        n_grams: size of n-grams to extract.
+    Returns:
+        Dictionary of processed text.
+    """
+
+    return pipe(
+        token_dict.values(),
+        lambda corpus: [tok if type(tok) == list else [] for tok in corpus],
+        partial(tm.build_ngrams, n=n_grams),
+        lambda tok_output: {
+            _id: tok
+            for _id, tok in zip(token_dict.keys(), tok_output[0])
+            if len(tok) > 0  # Remove empty documents
+        },
+    )
+
+
 NUM_TOPICS = 100
 
 if __name__ == "__main__":
 
     logging.info("Reading data")
     works = oal.get_openalex_ai_genomics_works()
-    abstrs = oal.get_openalex_ai_genomics_abstracts(local=False)
+    # Clean tokens made from the inverted abstracts by make_year_summary
+    abstr_tokens = MergedMapping(
+        [
+            oal.work_abstract_tokens(discipline, range(2012, 2022))
+            for discipline in ["artificial_intelligence", "genetics"]
+        ]
+    )
 
     logging.info("Sampling")
     # Sample all AI genomics and a subset of AI and genomics work
@@ -45,10 +73,12 @@ if __name__ == "__main__":
         .reset_index(drop=True)
     )
 
-    sampled_ids = set(works_sampled["work_id"])
-
     # Extract the sampled IDs
-    abstr_sampled = {k: v for k, v in abstrs.items() if k in sampled_ids}
+    abstr_sampled = {
+        _id: abstr_tokens[_id]
+        for _id in works_sampled["work_id"]
+        if _id in abstr_tokens
+    }
 
     # Get the ids that belong to each category
     ai_gen_id, ai_id, gen_id = [
@@ -58,23 +88,9 @@ if __name__ == "__main__":
 
     logging.info("Text processing and topic modelling")
 
-    # This is the prototype text pipeline. It could be refactored
-    # into spacy pipelines or something
-    abstr_tok = pipe(
-        abstr_sampled.values(),
-        list,
-        lambda corpus: [tm.remove_symbols(d) for d in corpus],
-        lambda corpus: [tm.remove_digits(d) for d in corpus],
-        lambda corpus: tokenizer.pipe(corpus),
-        lambda corpus: [tm.remove_stop_punct(d) for d in corpus],
-        lambda corpus: [tm.remove_short_tokens(d) for d in corpus],
-        partial(tm.build_ngrams, n=3),
-        lambda tok_output: {
-            _id: tok
-            for _id, tok in zip(abstr_sampled.keys(), tok_output[0])
-            if len(tok) > 0  # Remove empty documents
-        },
-    )
+    # The tokens come straight from the inverted abstracts, so the abstracts
+    # are not deinverted and re-tokenised with spaCy
+    abstr_tok = token_processing(abstr_sampled, 3)
 
     # Train topic model
     ai_genom_lda = tm.train_lda(list(abstr_tok.values()), k=NUM_TOPICS, top_remove=50)
@@ -1,9 +1,12 @@
 # Script to generate openalex definitions
 
+import glob
+import hashlib
 import logging
+import os
 from itertools import product, permutations
 from toolz import pipe
-from typing import Dict, Tuple, Union
+from typing import Dict, List, Tuple, Union
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -15,10 +18,19 @@ from ai_genomics.getters.openalex import (
     work_concepts,
     work_abstracts,
     get_concepts_df,
+    get_concept_hierarchy,
 )
 from ai_genomics.getters.papers_w_code import read_pwc_papers
 
 
+# Captures the last path segment of arxiv urls, without a .pdf extension
+ARXIV_ID_PATTERN = r"arxiv.*/([^/]*?)(?:\.pdf)?$"
+ARXIV_CATS_PATH = f"{PROJECT_DIR}/inputs/data/arxiv/arxiv_article_categories.csv"
+# Concepts whose descendants are the genomics concepts when
+# genomics_scope_hierarchy is set
+GENOMICS_ROOT_CONCEPTS = ["Genomics", "Genome"]
+
+
 def get_arxiv_id(ven: str) -> str:
     """Extracts the arxiv id from the venue field in works
 
@@ -46,6 +58,66 @@ def get_arxiv_id(ven: str) -> str:
             return ven.split("/")[-1]
 
 
+def get_arxiv_ids(venues: pd.Series) -> pd.Series:
+    """Vectorised version of `get_arxiv_id` for a series of venue urls
+
+    Args:
+        venues: venue urls in works
+
+    Returns:
+        A series with the Arxiv ids (NaN for non-arxiv venues)
+    """
+
+    return venues.str.extract(ARXIV_ID_PATTERN, expand=False)
+
+
+def make_arxiv_category_mask(
+    ai_cats: List[str], path: str = ARXIV_CATS_PATH
+) -> pd.Series:
+    """Makes a lookup between arxiv articles and a bitmask of the AI
+    categories they belong to (bit n is set if the article is in `ai_cats[n]`).
+    The table is cached next to the categories file for each set of categories
+    and version (modification time and size) of the file, so it is rebuilt
+    when the file changes.
+
+    Args:
+        ai_cats: arxiv categories to flag
+        path: path to the arxiv article categories table
+
+    Returns:
+        A series indexed by arxiv article id with the category bitmask
+    """
+
+    cats_key = hashlib.md5(",".join(ai_cats).encode()).hexdigest()[:8]
+    stat = os.stat(path)
+    file_key = hashlib.md5(f"{stat.st_mtime_ns}_{stat.st_size}".encode()).hexdigest()
+    cache_prefix = f"{os.path.splitext(path)[0]}_mask_{cats_key}"
+    cache_path = f"{cache_prefix}_{file_key[:8]}.parquet"
+
+    if os.path.exists(cache_path):
+        return pd.read_parquet(cache_path)["ai_cat_mask"]
+
+    # Masks of previous versions of the categories file
+    for stale_path in glob.glob(f"{cache_prefix}*.parquet"):
+        os.remove(stale_path)
+
+    cat_bits = {cat: 1 << n for n, cat in enumerate(ai_cats)}
+    mask = (
+        pd.read_csv(path, usecols=["article_id", "category_id"], dtype=str)
+        .drop_duplicates()
+        .assign(
+            ai_cat_mask=lambda df: df["category_id"]
+            .map(cat_bits)
+            .fillna(0)
+            .astype(np.int64)
+        )
+        .groupby("article_id")["ai_cat_mask"]
+        .sum()  # Bits are distinct within an article so the sum is a bitwise or
+    )
+    mask.to_frame().to_parquet(cache_path)
+    return mask
+
+
 def flag_ambiguous(abstract: str) -> bool:
     """Flags ambiguous abstracts
 
@@ -80,16 +152,28 @@ def flag_ambiguous(abstract: str) -> bool:
 def fetch_no_ai() -> set:
     """Get arxiv IT papers that don't fall in AI categories"""
 
-    ai_cats = set(config["ai_cats"])
-    return set(
-        (
-            pd.read_csv(f"{PROJECT_DIR}/inputs/data/arxiv/arxiv_article_categories.csv")
-            .groupby("article_id")["category_id"]
-            .apply(lambda x: (len(set(x) & ai_cats) == 0))
-            .reset_index(drop=False)
-            .query("category_id==True")["article_id"]
-        )
-    )
+    mask = make_arxiv_category_mask(config["ai_cats"])
+    return set(mask.index[mask == 0])
+
+
+def label_arxiv_works(
+    works_meta: pd.DataFrame, ai_conf_ids: set, ai_cat_mask: pd.Series
+) -> pd.DataFrame:
+    """Labels works with arxiv ids published in AI conferences (`arx_ai_conf`)
+    and in arxiv without any AI category (`arx_no_ai`) with array lookups
+
+    Args:
+        works_meta: dataframe of works metadata with an arxiv_id column
+        ai_conf_ids: arxiv ids of papers published in AI conferences
+        ai_cat_mask: lookup between arxiv ids and AI category bitmasks
+
+    Returns:
+        The works metadata with the labels
+    """
+
+    return works_meta.assign(
+        arx_ai_conf=lambda df: df["arxiv_id"].isin(ai_conf_ids)
+    ).assign(arx_no_ai=lambda df: df["arxiv_id"].map(ai_cat_mask).eq(0))
 
 
 def filter_works(works_meta: pd.DataFrame, abstracts: Dict) -> pd.DataFrame:
@@ -102,7 +186,7 @@ def filter_works(works_meta: pd.DataFrame, abstracts: Dict) -> pd.DataFrame:
         .query("has_abstract==True")
         .dropna(axis=0, subset=["venue_url"])
         .reset_index(drop=False)
-        .assign(arxiv_id=lambda df: df["venue_url"].apply(get_arxiv_id))
+        .assign(arxiv_id=lambda df: get_arxiv_ids(df["venue_url"]))
         .assign(
             ambiguous=lambda df: [
                 flag_ambiguous(abstracts[work_id]) for work_id in df["work_id"]
@@ -325,8 +409,8 @@ if __name__ == "__main__":
         lambda df: set(df["arxiv_id"]) - set([np.nan]),
     )
 
-    logging.info("Getting non-AI papers ids")
-    no_ai_arxiv = fetch_no_ai()
+    logging.info("Getting arxiv AI category lookup")
+    arxiv_ai_cat_mask = make_arxiv_category_mask(config["ai_cats"])
 
     logging.info("Getting Openalex data")
 
@@ -338,9 +422,9 @@ if __name__ == "__main__":
 
     works_meta_filtered = filter_works(works_meta, abstracts)
 
-    works_meta_labelled = works_meta_filtered.assign(
-        arx_ai_conf=lambda df: [aid in pwc_ai_ids for aid in df["arxiv_id"]]
-    ).assign(arx_no_ai=lambda df: [aid in no_ai_arxiv for aid in df["arxiv_id"]])
+    works_meta_labelled = label_arxiv_works(
+        works_meta_filtered, pwc_ai_ids, arxiv_ai_cat_mask
+    )
 
     logging.info(works_meta_labelled[["arx_ai_conf", "arx_no_ai"]].sum())
 
@@ -443,9 +527,18 @@ if __name__ == "__main__":
     concept_df = get_concepts_df()
 
     # Genomics concepts table
-    genom_concs_df = concept_df.loc[
-        ["genom" in conc.lower() for conc in concept_df["display_name"].values]
-    ].sort_values("works_count", ascending=True)
+    if config["genomics_scope_hierarchy"]:
+        genomics_ids = set(
+            get_concept_hierarchy().descendants(GENOMICS_ROOT_CONCEPTS)
+        )
+        genom_concs_mask = concept_df["id"].isin(genomics_ids)
+    else:
+        genom_concs_mask = [
+            "genom" in conc.lower() for conc in concept_df["display_name"].values
+        ]
+    genom_concs_df = concept_df.loc[genom_concs_mask].sort_values(
+        "works_count", ascending=True
+    )
 
     # Genomics concepts set
     genomics_concepts = set(genom_concs_df["display_name"])
@@ -1,11 +1,14 @@
 from pandas import read_csv
 from turtle import pd
-from typing import Dict
+from typing import Dict, Optional
 from botocore.exceptions import ClientError
 
 from ai_genomics import PROJECT_DIR
 from ai_genomics import bucket_name
 from ai_genomics.getters.data_getters import load_s3_data, get_s3_dir_files
+from ai_genomics.utils.centroids import CentroidModel
+
+CENTROID_MODEL_DIR = "outputs/models/clusters"
 
 
 def get_doc_cluster_lookup(
@@ -95,3 +98,32 @@ def get_id_cluster_lookup() -> Dict[int, str]:
 def get_doc_cluster_manual_names():
     fname = "outputs/data/cluster/doc_cluster_manual_names.csv"
     return load_s3_data(bucket_name, fname)
+
+
+def centroid_model_path(name: str, version: Optional[str] = None) -> str:
+    """S3 key of a version of a centroid model, or of the file recording its
+    latest version if no version is given
+    """
+    if version is None:
+        return f"{CENTROID_MODEL_DIR}/{name}/latest.json"
+    return f"{CENTROID_MODEL_DIR}/{name}/{version}.npz"
+
+
+def get_centroid_model(name: str, version: Optional[str] = None) -> CentroidModel:
+    """Gets the centroids of a fitted clustering, to assign new documents or
+    entities to its clusters with `.assign(embeddings)`.
+
+    Args:
+        name (str): Model name, e.g. "doc_all_2012_2021" for document
+            clusters (see `doc_cluster.py`) or "entity_groups" for the
+            entity cluster hierarchy (assign with `level="k_500"`).
+        version (str, optional): Model version. Defaults to the latest.
+
+    Returns:
+        CentroidModel: The model.
+    """
+    if version is None:
+        version = load_s3_data(bucket_name, centroid_model_path(name))["version"]
+    return CentroidModel.from_arrays(
+        load_s3_data(bucket_name, centroid_model_path(name, version))
+    )
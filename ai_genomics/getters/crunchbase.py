@@ -9,6 +9,7 @@ from ai_genomics.pipeline.crunchbase_data.make_crunchbase_data import (
 )
 
 from ai_genomics.getters.data_getters import load_s3_data
+from ai_genomics.utils.doc_vectors import from_arrays, to_sparse_frame
 
 
 def get_ai_genomics_crunchbase_org_ids() -> pd.DataFrame:
@@ -54,11 +55,11 @@ def get_crunchbase_ai_genomics_entity_groups(k: int = 500) -> pd.DataFrame:
         k (int, optional): The number of clusters. Defaults to 500.
 
     Returns:
-        pd.DataFrame: A sparse dataframe where the index is company IDs and
-            the columns are vector dimensions (entity cluster IDs).
+        pd.DataFrame: A sparse dataframe with an id column of company IDs and
+            a column per vector dimension (entity cluster IDs).
     """
-    fname = f"inputs/entities/crunchbase_entity_group_vectors_k_{k}.csv"
-    return load_s3_data(bucket_name, fname)
+    fname = f"inputs/entities/crunchbase_entity_group_vectors_k_{k}.npz"
+    return to_sparse_frame(*from_arrays(load_s3_data(bucket_name, fname)))
 
 
 def get_crunchbase_ai_genomics_description_embeddings() -> pd.DataFrame:
@@ -1,7 +1,9 @@
 import pickle
 from fnmatch import fnmatch
+from io import BytesIO
 import boto3
 import json
+import numpy as np
 import pandas as pd
 from ai_genomics import logger
 from typing import Union, List
@@ -56,9 +58,13 @@ def load_s3_data(bucket_name: str, file_name: str) -> Union[pd.DataFrame, str, d
     elif fnmatch(file_name, "*.json"):
         file = obj.get()["Body"].read().decode()
         return json.loads(file)
+    elif fnmatch(file_name, "*.npz"):
+        file = obj.get()["Body"].read()
+        with np.load(BytesIO(file)) as arrays:
+            return dict(arrays)
     else:
         logger.exception(
-            'Function not supported for file type other than "*.json", *.txt", "*.pickle", "*.tsv" and "*.csv"'
+            'Function not supported for file type other than "*.json", *.txt", "*.pickle", "*.tsv", "*.csv" and "*.npz"'
         )
 
 
@@ -83,8 +89,12 @@ def save_to_s3(bucket_name: str, output_var, output_file_dir: str):
         output_var.to_csv("s3://" + bucket_name + "/" + output_file_dir, index=False)
     elif fnmatch(output_file_dir, "*.json"):
         obj.put(Body=json.dumps(output_var))
+    elif fnmatch(output_file_dir, "*.npz"):
+        buffer = BytesIO()
+        np.savez(buffer, **output_var)
+        obj.put(Body=buffer.getvalue())
     else:
         logger.exception(
-            'Function not supported for file type other than "*.json", *.txt", "*.pickle", "*.tsv" and "*.csv"'
+            'Function not supported for file type other than "*.json", *.txt", "*.pickle", "*.tsv", "*.csv" and "*.npz"'
         )
     logger.info(f"Saved to s3://{bucket_name} + {output_file_dir} ...")
@@ -0,0 +1,54 @@
+from ai_genomics import bucket_name
+from ai_genomics.getters.data_getters import load_s3_data
+from ai_genomics.utils.embedding_storage import MAX_COSINE_ERROR, QuantisedEmbeddings
+import pandas as pd
+
+# Full precision embedding tables for each source
+EMBEDDING_FILES = {
+    "oa": "inputs/embedding/oa_ai_genomics_embeddings.csv",
+    "pat": "inputs/embedding/pat_ai_genomics_embeddings.csv",
+    "gtr": "inputs/embedding/gtr_ai_genomics_embeddings.csv",
+    "cb": "inputs/embedding/cb_ai_genomics_embeddings.csv",
+}
+
+
+def quantised_embeddings_path(source: str, dtype: str = "int8") -> str:
+    """S3 key of the reduced precision embeddings of a source"""
+    return EMBEDDING_FILES[source].replace(".csv", f"_{dtype}.npz")
+
+
+def get_embedding_table(source: str) -> pd.DataFrame:
+    """Gets the full precision embeddings of a source (oa, pat, gtr or cb)
+    indexed by document ID, with integer column names
+    """
+    embeddings = load_s3_data(bucket_name, EMBEDDING_FILES[source])
+    embeddings = embeddings.set_index(embeddings.columns[0])
+    embeddings.index.name = "id"
+    return embeddings.rename(columns={c: int(c) for c in embeddings.columns})
+
+
+def get_quantised_embeddings(source: str, dtype: str = "int8") -> QuantisedEmbeddings:
+    """Gets the reduced precision embeddings of a source (oa, pat, gtr or cb)
+    created with `pipeline/description_embed/quantise_embeddings.py`.
+
+    Args:
+        source: data source
+        dtype: "int8" or "float16"
+
+    Returns:
+        The embeddings. Use `.to_frame()` for a df equivalent to the full
+        precision table, or `.loc` / `.cosine` to dequantise lazily.
+
+    Raises:
+        ValueError: if the table's cosine error exceeds `MAX_COSINE_ERROR`
+    """
+    table = QuantisedEmbeddings.from_arrays(
+        load_s3_data(bucket_name, quantised_embeddings_path(source, dtype))
+    )
+    if table.max_cosine_error > MAX_COSINE_ERROR[dtype]:
+        raise ValueError(
+            f"Cosine error {table.max_cosine_error:.2e} of the {source} {dtype} "
+            f"embeddings exceeds {MAX_COSINE_ERROR[dtype]:.2e}: re-run "
+            "quantise_embeddings.py"
+        )
+    return table
@@ -18,6 +18,19 @@ def get_entity_cluster_lookup(k: int = 500) -> Dict[str, int]:
     return load_s3_data(bucket_name, fname)
 
 
+def get_entity_cluster_hierarchy() -> Dict[str, Dict[str, int]]:
+    """Gets the parent of each DBpedia entity cluster at the next coarser
+        level of the entity cluster hierarchy.
+
+    Returns:
+        Dict[str, Dict[str, int]]: A lookup where keys are levels (e.g.
+            "k_500") and values are lookups between the level's cluster IDs
+            and their parent cluster ID at the next coarser level (e.g. k_200)
+    """
+    fname = "inputs/entities/entity_groups_hierarchy.json"
+    return load_s3_data(bucket_name, fname)
+
+
 def get_entity_cluster_name_lookup(k: int = 500) -> Dict[str, str]:
     """Gets a lookup between DBpedia entity cluster IDs and their
         cluster name.
@@ -1,5 +1,6 @@
 from ai_genomics import PROJECT_DIR, bucket_name as BUCKET_NAME, logger
 from ai_genomics.getters.data_getters import load_s3_data
+from ai_genomics.utils.doc_vectors import from_arrays, to_sparse_frame
 from ai_genomics.pipeline.gtr.make_gtr_projects import GTR_OUTPUTS_DIR, GTR_PROJ_NAME
 from typing import Mapping, Union
 import pandas as pd
@@ -76,11 +77,11 @@ def get_gtr_ai_genomics_project_entity_groups(k: int = 500) -> pd.DataFrame:
         k (int, optional): The number of clusters. Defaults to 500.
 
     Returns:
-        pd.DataFrame: A sparse dataframe where the index is project IDs and
-            the columns are vector dimensions (entity cluster IDs).
+        pd.DataFrame: A sparse dataframe with an id column of project IDs and
+            a column per vector dimension (entity cluster IDs).
     """
-    fname = f"inputs/entities/gtr_entity_group_vectors_k_{k}.csv"
-    return load_s3_data(BUCKET_NAME, fname)
+    fname = f"inputs/entities/gtr_entity_group_vectors_k_{k}.npz"
+    return to_sparse_frame(*from_arrays(load_s3_data(BUCKET_NAME, fname)))
 
 
 def get_gtr_ai_genomics_project_embeddings() -> pd.DataFrame:
@@ -0,0 +1,16 @@
+from typing import Dict
+
+from ai_genomics import bucket_name
+from ai_genomics.getters.data_getters import load_s3_data
+
+CANONICAL_IDS_PATH = "outputs/near_duplicates/canonical_ids.json"
+
+
+def get_canonical_ids() -> Dict[str, str]:
+    """Gets a lookup between the IDs of near-duplicate documents (across
+    OpenAlex, patents, GtR and Crunchbase) and the canonical ID of their
+    duplicate cluster, created with
+    `pipeline/near_duplicates/find_near_duplicates.py`. Documents without
+    duplicates are not included.
+    """
+    return load_s3_data(bucket_name, CANONICAL_IDS_PATH)
@@ -1,12 +1,16 @@
+import glob
+import hashlib
 import json
+import os
 
 import pandas as pd
 from typing import List, Dict, Any, Mapping, Union
-from functools import reduce
 from toolz import pipe
 
-from ai_genomics.utils.reading import read_json
+from ai_genomics.utils.reading import read_json, MergedMapping
+from ai_genomics.utils.concept_hierarchy import ConceptHierarchy
 from ai_genomics.getters.data_getters import load_s3_data
+from ai_genomics.utils.doc_vectors import from_arrays, to_sparse_frame
 from ai_genomics import PROJECT_DIR, logger, bucket_name
 
 OALEX_PATH = f"{PROJECT_DIR}/inputs/data/openalex"
@@ -62,6 +66,32 @@ def get_concepts_df() -> pd.DataFrame:
     )
 
 
+def get_concept_hierarchy() -> ConceptHierarchy:
+    """Reads the OpenAlex concept hierarchy index (transitive closure of
+    concept ancestors). It is created from `concepts.json` and saved the
+    first time this is called for each version (modification time and size)
+    of `concepts.json`, so it is rebuilt when the concepts change.
+    """
+
+    concepts_path = f"{PROJECT_DIR}/inputs/openalex/concepts.json"
+    stat = os.stat(concepts_path)
+    file_key = hashlib.md5(f"{stat.st_mtime_ns}_{stat.st_size}".encode()).hexdigest()
+    prefix = f"{PROJECT_DIR}/inputs/openalex/concept_hierarchy"
+    path = f"{prefix}_{file_key[:8]}"
+
+    if os.path.exists(f"{path}.npz"):
+        return ConceptHierarchy.load(path)
+    else:
+        # Indices of previous versions of the concepts file
+        for stale_path in glob.glob(f"{prefix}*.npz") + glob.glob(f"{prefix}*.json"):
+            os.remove(stale_path)
+
+        logger.info("Making concept hierarchy index")
+        hierarchy = ConceptHierarchy.from_concepts(read_json(concepts_path))
+        hierarchy.save(path)
+        return hierarchy
+
+
 def work_metadata(discipline: str, year_list: list) -> pd.DataFrame:
     """Reads metadata about openalex works
 
@@ -128,15 +158,49 @@ def instit_metadata() -> pd.DataFrame:
     return pd.read_csv(f"{OALEX_PATH}/oalex_institutions_meta.csv")
 
 
-def work_abstracts(discipline: str, years: List) -> Dict:
-    """Reads the abstracts for a list of years"""
+def author_timeline() -> pd.DataFrame:
+    """Reads the author timeline index (one row per author, work and
+    institution sorted by author and publication date). It is created by
+    `make_year_summary.py`, see `ai_genomics.utils.author_timeline` for queries
+    """
+
+    return pd.read_parquet(f"{OALEX_PATH}/author_timeline.parquet")
+
+
+def author_metadata() -> pd.DataFrame:
+    """Reads author names and orcids for authors in the author timeline"""
+
+    return pd.read_parquet(f"{OALEX_PATH}/author_metadata.parquet")
+
+
+def work_abstracts(discipline: str, years: List) -> Mapping[str, Union[str, None]]:
+    """Reads the abstracts for a list of years
 
-    return reduce(
-        lambda a, b: dict(a, **b),
+    Returns:
+        A read-only mapping between work ids and abstracts that merges the
+        yearly abstracts lazily (without copying them into a single dict)
+    """
+
+    return MergedMapping(
         [
             read_json(f"{OALEX_PATH}/abstracts_{discipline}_{year}.json")
             for year in years
-        ],
+        ]
+    )
+
+
+def work_abstract_tokens(
+    discipline: str, years: List
+) -> Mapping[str, Union[List[str], None]]:
+    """Reads the clean abstract tokens (extracted from the inverted
+    abstracts) for a list of years, merged lazily as in `work_abstracts`
+    """
+
+    return MergedMapping(
+        [
+            read_json(f"{OALEX_PATH}/abstract_tokens_{discipline}_{year}.json")
+            for year in years
+        ]
     )
 
 
@@ -252,11 +316,11 @@ def get_openalex_ai_genomics_works_entity_groups(k: int = 500) -> pd.DataFrame:
         k (int, optional): The number of clusters. Defaults to 500.
 
     Returns:
-        pd.DataFrame: A sparse dataframe where the index is work IDs and
-            the columns are vector dimensions (entity cluster IDs).
+        pd.DataFrame: A sparse dataframe with an id column of work IDs and
+            a column per vector dimension (entity cluster IDs).
     """
-    fname = f"inputs/entities/openalex_entity_group_vectors_k_{k}.csv"
-    return load_s3_data(bucket_name, fname)
+    fname = f"inputs/entities/openalex_entity_group_vectors_k_{k}.npz"
+    return to_sparse_frame(*from_arrays(load_s3_data(bucket_name, fname)))
 
 
 def get_openalex_ai_genomics_works_embeddings() -> pd.DataFrame:
@@ -1,72 +1,150 @@
-from dataclasses import dataclass
-import datetime
+import glob
 import gzip
-import json
-from toolz import pipe
+import hashlib
+import logging
+import os
+from typing import Dict, Iterator, List, Optional
 
+import ijson
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from pandas import DataFrame
+from toolz import partition_all
 
 from ai_genomics import PROJECT_DIR
 
 DATA_PATH = f"{PROJECT_DIR}/inputs/data/papers_with_code"
+PWC_FILE = "papers-with-abstracts.json.gz"
+PWC_CACHE = "papers-with-abstracts"
+
+# Fields we keep from each paper and their types in the parquet cache. Other
+# fields of the pwc file (e.g. abstract, authors, url_abs, url_pdf and the
+# full `methods` dicts) are not cached
+PWC_SCHEMA = pa.schema(
+    [
+        ("paper_url", pa.string()),
+        ("arxiv_id", pa.string()),
+        ("title", pa.string()),
+        ("proceeding", pa.string()),
+        ("tasks", pa.list_(pa.string())),
+        ("date", pa.timestamp("ms")),
+        ("year", pa.int16()),
+        ("methods_name", pa.list_(pa.string())),
+    ]
+)
+
+
+def _none_if_empty(value):
+    """Replaces empty strings and lists with None"""
+
+    return value if (value is not None) and (len(value) > 0) else None
+
+
+def project_paper(paper: Dict) -> Dict:
+    """Keeps the fields of a pwc paper we use, replacing empty values with
+    None and keeping only the names of the methods
+    """
+
+    return {
+        "paper_url": _none_if_empty(paper.get("paper_url")),
+        "arxiv_id": _none_if_empty(paper.get("arxiv_id")),
+        "title": _none_if_empty(paper.get("title")),
+        "proceeding": _none_if_empty(paper.get("proceeding")),
+        "tasks": _none_if_empty(paper.get("tasks")),
+        "date": _none_if_empty(paper.get("date")),
+        "methods_name": _none_if_empty(
+            [meth["name"] for meth in paper.get("methods") or []]
+        ),
+    }
+
+
+def stream_papers(file_name: str = PWC_FILE) -> Iterator[Dict]:
+    """Reads, decompresses and parses a pwc file one paper at a time,
+    projecting only the fields we use
+    """
 
-
-def make_year(datetime: datetime.datetime) -> int:
-    """Extracts year from a datetime.datetime object"""
-
-    return int(datetime.year) if pd.isnull(datetime) is False else np.nan
-
-
-def read_parse(file_name: str) -> dict:
-    """Reads, decompresses and parses a pwc file"""
     with gzip.open(f"{DATA_PATH}/{file_name}", "rb") as f:
-        file_content = f.read()
+        for paper in ijson.items(f, "item"):
+            yield project_paper(paper)
 
-    return json.loads(file_content)
 
+def make_papers_table(papers: List[Dict]) -> pa.Table:
+    """Creates a typed arrow table from a batch of projected papers"""
 
-def parse_date_string(date_string: str, _format: str = "%Y-%m-%d") -> datetime.datetime:
-    """Parses a date string"""
+    df = DataFrame(papers, columns=[f for f in PWC_SCHEMA.names if f != "year"])
+    dates = pd.to_datetime(df["date"], format="%Y-%m-%d", errors="coerce")
 
-    return (
-        datetime.datetime.strptime(date_string, _format)
-        if pd.isnull(date_string) is False
-        else np.nan
+    return pa.Table.from_pandas(
+        df.assign(date=dates, year=dates.dt.year.astype("Int16"))[PWC_SCHEMA.names],
+        schema=PWC_SCHEMA,
+        preserve_index=False,
     )
 
 
-def make_empty_list_na(df: DataFrame, variables: list):
-    """Remove empty lists with np.nans in a dataframe"""
-
-    df_ = df.copy()
-    for v in variables:
-
-        df_[v] = df[v].apply(lambda x: x if len(x) > 0 else np.nan)
-
-    return df_
-
-
-def read_pwc_papers() -> DataFrame:
-    """Get papers table"""
-    # Read and parse the data
-    return (
-        pipe(
-            "papers-with-abstracts.json.gz",
-            read_parse,
-            DataFrame,
-            lambda df: make_empty_list_na(df, ["tasks", "methods"]),
-        )
-        .replace({None: np.nan, "": np.nan})
-        .assign(date=lambda df: df["date"].apply(parse_date_string))
-        .assign(year=lambda df: df["date"].apply(make_year))
-        .assign(
-            methods_name=lambda df: [
-                [meth["name"] for meth in meth_list]
-                if type(meth_list) is list
-                else np.nan
-                for meth_list in df["methods"]
-            ]
-        )
-    )
+def pwc_cache_name(file_name: str = PWC_FILE, cache_name: str = PWC_CACHE) -> str:
+    """Name of the parquet cache for the current version (modification time
+    and size) of a pwc file, so a re-fetched file gets a new cache
+    """
+
+    stat = os.stat(f"{DATA_PATH}/{file_name}")
+    file_key = hashlib.md5(f"{stat.st_mtime_ns}_{stat.st_size}".encode()).hexdigest()
+    return f"{cache_name}_{file_key[:8]}.parquet"
+
+
+def make_pwc_cache(
+    file_name: str = PWC_FILE,
+    cache_name: Optional[str] = None,
+    batch_size: int = 100_000,
+):
+    """Streams the pwc papers into a parquet cache in batches, so the
+    full json is never held in memory. The cache is written to a temporary
+    file that only replaces `cache_name` (by default, `pwc_cache_name`) once
+    complete, so an interrupted run does not leave a truncated cache behind.
+    """
+
+    cache_name = cache_name or pwc_cache_name(file_name)
+
+    logging.info(f"Making papers with code cache {cache_name}")
+    tmp_path = f"{DATA_PATH}/{cache_name}.tmp"
+    try:
+        with pq.ParquetWriter(tmp_path, PWC_SCHEMA) as writer:
+            for batch in partition_all(batch_size, stream_papers(file_name)):
+                writer.write_table(make_papers_table(list(batch)))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, f"{DATA_PATH}/{cache_name}")
+
+
+def read_pwc_papers(columns: Optional[List[str]] = None) -> DataFrame:
+    """Get papers table
+
+    The first call for each version of `papers-with-abstracts.json.gz`
+    streams it into a typed parquet cache (removing caches of previous
+    versions). Later calls memory-map the cache.
+
+    Only the fields in `PWC_SCHEMA` are kept: paper_url, arxiv_id, title,
+    proceeding, tasks, date, year and methods_name. Other fields of the pwc
+    file (e.g. abstract, authors and the full `methods` dicts) are not
+    returned.
+
+    Args:
+        columns: columns to read (defaults to all of them)
+
+    Returns:
+        A df with one row per paper. Missing values are NaN and `tasks` and
+        `methods_name` contain arrays of strings
+    """
+
+    cache_name = pwc_cache_name()
+    if not os.path.exists(f"{DATA_PATH}/{cache_name}"):
+        for stale_path in glob.glob(f"{DATA_PATH}/{PWC_CACHE}*.parquet"):
+            os.remove(stale_path)
+        make_pwc_cache(cache_name=cache_name)
+
+    return pd.read_parquet(
+        f"{DATA_PATH}/{cache_name}", columns=columns, memory_map=True
+    ).replace({None: np.nan})
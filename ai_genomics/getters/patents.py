@@ -1,5 +1,6 @@
 from ai_genomics import bucket_name
 from ai_genomics.getters.data_getters import load_s3_data
+from ai_genomics.utils.doc_vectors import from_arrays, to_sparse_frame
 import pandas as pd
 from typing import Mapping, Union
 
@@ -93,11 +94,11 @@ def get_patent_ai_genomics_entity_groups(k: int = 500) -> pd.DataFrame:
         k (int, optional): The number of clusters. Defaults to 500.
 
     Returns:
-        pd.DataFrame: A sparse dataframe where the index is patent IDs and
-            the columns are vector dimensions (entity cluster IDs).
+        pd.DataFrame: A sparse dataframe with an id column of patent IDs and
+            a column per vector dimension (entity cluster IDs).
     """
-    fname = f"inputs/entities/patent_entity_group_vectors_k_{k}.csv"
-    return load_s3_data(bucket_name, fname)
+    fname = f"inputs/entities/patent_entity_group_vectors_k_{k}.npz"
+    return to_sparse_frame(*from_arrays(load_s3_data(bucket_name, fname)))
 
 
 def get_patent_ai_genomics_abstract_embeddings() -> pd.DataFrame:
@@ -0,0 +1,63 @@
+"""Builds an HNSW index over the embeddings of OpenAlex works, patents, GtR
+projects and Crunchbase companies, adding one source at a time, and reports
+its recall and latency against exact search.
+"""
+import click
+import os
+import pandas as pd
+
+from ai_genomics import logger
+from ai_genomics.getters.embeddings import EMBEDDING_FILES, get_embedding_table
+from ai_genomics.utils.ann_index import ANN_INDEX_PATH, AnnIndex, benchmark
+
+
+@click.command()
+@click.option(
+    "--sources",
+    default=",".join(EMBEDDING_FILES),
+    show_default=True,
+    help="Comma separated sources to add to the index.",
+)
+@click.option(
+    "--update",
+    is_flag=True,
+    default=False,
+    help="Add new documents to the existing index instead of rebuilding it.",
+)
+@click.option(
+    "--n-queries",
+    default=1_000,
+    show_default=True,
+    help="Number of documents used to benchmark the index.",
+)
+def run(sources, update, n_queries):
+    os.makedirs(ANN_INDEX_PATH.parent, exist_ok=True)
+
+    ann = None
+    if update and os.path.exists(f"{ANN_INDEX_PATH}.bin"):
+        ann = AnnIndex.load(ANN_INDEX_PATH)
+
+    embeddings = []
+    for source in sources.split(","):
+        logger.info(f"Adding {source} embeddings to the index")
+        source_embeddings = get_embedding_table(source)
+        if ann is None:
+            ann = AnnIndex(
+                dim=source_embeddings.shape[1], max_elements=len(source_embeddings)
+            )
+        ann.add(source_embeddings.index, source_embeddings.values)
+        embeddings.append(source_embeddings)
+
+    ann.save(ANN_INDEX_PATH)
+    logger.info(f"Saved index with {len(ann)} documents to {ANN_INDEX_PATH}")
+
+    # Benchmarking needs the embeddings of every indexed document, in index
+    # order, so it is skipped when only some sources were added to an index
+    added = pd.concat(embeddings).pipe(lambda df: df[~df.index.duplicated()])
+    added.index = added.index.astype(str)
+    if set(ann.ids) <= set(added.index):
+        logger.info(f"\n{benchmark(ann, added.loc[ann.ids].values, n_queries)}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,39 @@
+"""Builds the exact cosine k-NN graph of the embeddings of OpenAlex works,
+patents, GtR projects and Crunchbase companies and saves it (with the
+document id of each row) for reuse by reducers and clusterers.
+"""
+import click
+import json
+import os
+import pandas as pd
+
+from ai_genomics import PROJECT_DIR, logger
+from ai_genomics.getters.embeddings import EMBEDDING_FILES, get_embedding_table
+from ai_genomics.utils.knn_graph import knn_graph, save_knn_graph
+
+KNN_DIR = PROJECT_DIR / "inputs/ann_index"
+
+
+@click.command()
+@click.option("--k", default=15, show_default=True, help="Number of neighbours.")
+@click.option(
+    "--block-size",
+    default=4_096,
+    show_default=True,
+    help="Rows per similarity tile (bounds memory per thread).",
+)
+def run(k, block_size):
+    os.makedirs(KNN_DIR, exist_ok=True)
+
+    embeddings = pd.concat([get_embedding_table(source) for source in EMBEDDING_FILES])
+    embeddings = embeddings[~embeddings.index.duplicated()]
+
+    graph = knn_graph(embeddings.values, k=k, block_size=block_size)
+    save_knn_graph(graph, KNN_DIR / f"knn_k_{k}.npz")
+    with open(KNN_DIR / f"knn_k_{k}_ids.json", "w") as f:
+        json.dump(list(embeddings.index.astype(str)), f)
+    logger.info(f"Saved {k}-NN graph of {len(embeddings)} documents to {KNN_DIR}")
+
+
+if __name__ == "__main__":
+    run()
@@ -2,39 +2,29 @@
 import logging
 import os
 from toolz import pipe
-from functools import partial
-from typing import Dict
 
-import fasttext
-import numpy as np
 import pandas as pd
 
 from ai_genomics import PROJECT_DIR
 from ai_genomics.getters.openalex import work_abstracts
+from ai_genomics.utils.language import LanguageDetector, LID_CACHE_PATH
 
 OALEX_PATH = f"{PROJECT_DIR}/inputs/data/openalex"
+N_WORKERS = max(os.cpu_count() // 2, 1)
 
-model = fasttext.load_model(f"{PROJECT_DIR}/inputs/models/lid.176.ftz")
 
+def predict_language(titles: pd.Series, detector: LanguageDetector) -> pd.DataFrame:
+    """Uses a batched fasttext language detector to predict the language
+    of a series of titles
+    """
 
-def predict_language(text: str, model: fasttext.FastText._FastText) -> Dict:
-    """Uses a fasttext model to predict the language"""
-
-    if type(text) != str:
-        return {"predicted_language": np.nan, "language_probability": np.nan}
-    else:
-        return pipe(
-            text.lower(),
-            partial(model.predict, k=1),
-            lambda preds: {
-                "predicted_language": preds[0][0].split("__")[-1],
-                "language_probability": float(preds[1]),
-            },
-        )
+    return detector.predict(titles).reset_index(drop=True)
 
 
 if __name__ == "__main__":
 
+    detector = LanguageDetector(cache_path=LID_CACHE_PATH, n_workers=N_WORKERS)
+
     for year in range(2007, 2022):
 
         logging.info(year)
@@ -52,15 +42,7 @@ if __name__ == "__main__":
                         f"{OALEX_PATH}/works_{discipline}_{year}.csv",
                         pd.read_csv,
                         lambda df: pd.concat(
-                            [
-                                df,
-                                pd.DataFrame(
-                                    df["display_name"]
-                                    .str.replace("\n", "")
-                                    .apply(lambda title: predict_language(title, model))
-                                    .tolist()
-                                ),
-                            ],
+                            [df, predict_language(df["display_name"], detector)],
                             axis=1,
                         ),
                     )
@@ -79,3 +61,6 @@ if __name__ == "__main__":
                         index=False,
                     )
                 )
+
+                # Persist predictions so reruns and other sources reuse them
+                detector.save_cache()
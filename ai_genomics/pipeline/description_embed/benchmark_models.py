@@ -0,0 +1,177 @@
+"""Benchmarks candidate embedding models and backends on samples of our
+texts (entity names and document descriptions).
+
+For each model and backend, a fresh worker process loads the model and
+embeds every sample, reporting load time, encoding throughput and peak
+memory. As a cheap quality proxy, the 10 nearest neighbours of each text
+within its sample are compared with those under the reference model.
+"""
+import click
+import json
+import multiprocessing as mp
+import random
+import resource
+import time
+from itertools import chain
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+from numpy.typing import NDArray
+from tabulate import tabulate
+
+from ai_genomics import PROJECT_DIR, logger
+from ai_genomics.getters.openalex import get_openalex_ai_genomics_entities
+from ai_genomics.utils.ann_index import exact_top_k
+from ai_genomics.utils.entities import strip_scores
+
+OUT_PATH = PROJECT_DIR / "outputs/benchmarks"
+N_NEIGHBOURS = 10
+
+
+def sample_entity_names(n: int, seed: int = 42) -> List[str]:
+    """Samples unique DBpedia entity names from OpenAlex works"""
+    entities = strip_scores(get_openalex_ai_genomics_entities())
+    entities = sorted(set(chain(*entities.values())))
+    random.seed(seed)
+    return random.sample(entities, min(n, len(entities)))
+
+
+def sample_descriptions(path: str, n: int, seed: int = 42) -> List[str]:
+    """Samples texts from a json lookup between document IDs and texts (as
+    used by `embed.py`)
+    """
+    with open(path, "r") as f:
+        texts = [t for t in json.load(f).values() if isinstance(t, str)]
+    random.seed(seed)
+    return random.sample(texts, min(n, len(texts)))
+
+
+def _run_model(
+    model: str, backend: str, samples: Dict[str, List[str]]
+) -> Tuple[Dict, Dict[str, NDArray]]:
+    """Loads a model and embeds the samples in the current (worker) process"""
+    start = time.perf_counter()
+    if backend == "onnx":
+        from ai_genomics.utils.onnx_embedding import OnnxEncoder
+
+        encoder = OnnxEncoder(model).encode
+    else:
+        from sentence_transformers import SentenceTransformer
+        from ai_genomics.utils.text_embedding import encode_bucketed
+
+        st_model = SentenceTransformer(model, device="cpu")
+
+        def encoder(texts):
+            return encode_bucketed(st_model, texts)
+
+    load_time = time.perf_counter() - start
+
+    embeddings, n_texts = dict(), 0
+    start = time.perf_counter()
+    for name, texts in samples.items():
+        embeddings[name] = encoder(texts)
+        n_texts += len(texts)
+    encode_time = time.perf_counter() - start
+
+    stats = {
+        "model": model,
+        "backend": backend,
+        "dim": next(iter(embeddings.values())).shape[1],
+        "load_s": load_time,
+        "texts_per_s": n_texts / encode_time,
+        # ru_maxrss is in kilobytes on linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3,
+    }
+    return stats, embeddings
+
+
+def neighbour_overlap(embeddings: NDArray, reference: NDArray, k: int) -> float:
+    """Mean share of the k nearest neighbours of each text (excluding
+    itself) that are the same under two models
+    """
+    k = min(k, len(embeddings) - 1)
+    ours = exact_top_k(embeddings, embeddings, k + 1)[:, 1:]
+    theirs = exact_top_k(reference, reference, k + 1)[:, 1:]
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(ours, theirs)]))
+
+
+@click.command()
+@click.option(
+    "--models",
+    default="all-MiniLM-L6-v2,allenai-specter",
+    show_default=True,
+    help="Comma separated sentence transformer models.",
+)
+@click.option(
+    "--backends",
+    default="torch,onnx",
+    show_default=True,
+    help="Comma separated backends (torch, onnx).",
+)
+@click.option(
+    "--reference-model",
+    default="allenai-specter",
+    show_default=True,
+    help="Model (with the torch backend) that neighbours are compared with.",
+)
+@click.option(
+    "--texts",
+    multiple=True,
+    help="Json lookups between document IDs and texts (e.g. oa.json, pat.json).",
+)
+@click.option(
+    "--entities/--no-entities",
+    default=True,
+    help="Include a sample of OpenAlex entity names.",
+)
+@click.option("--sample-size", default=2_000, show_default=True)
+def run(models, backends, reference_model, texts, entities, sample_size):
+    samples = {
+        Path(path).stem: sample_descriptions(path, sample_size) for path in texts
+    }
+    if entities:
+        samples["entities"] = sample_entity_names(sample_size)
+
+    runs = [(reference_model, "torch")] + [
+        (model, backend)
+        for model in models.split(",")
+        for backend in backends.split(",")
+        if (model, backend) != (reference_model, "torch")
+    ]
+
+    results, reference = [], None
+    for model, backend in runs:
+        logger.info(f"Benchmarking {model} ({backend})")
+        if backend == "onnx":
+            from ai_genomics.utils.onnx_embedding import export_onnx
+
+            # Exported here so the worker's load time and peak memory only
+            # cover loading the exported graph
+            export_onnx(model)
+        # A fresh process per run so load time and peak memory are not
+        # affected by previous models
+        with mp.get_context("spawn").Pool(1) as pool:
+            stats, embeddings = pool.apply(_run_model, (model, backend, samples))
+        reference = embeddings if reference is None else reference
+
+        for name in samples:
+            stats[f"overlap@{N_NEIGHBOURS}_{name}"] = neighbour_overlap(
+                embeddings[name], reference[name], N_NEIGHBOURS
+            )
+        results.append(stats)
+
+    results = pd.DataFrame(results).sort_values("texts_per_s", ascending=False)
+    OUT_PATH.mkdir(parents=True, exist_ok=True)
+    results.to_csv(OUT_PATH / "embedding_models.csv", index=False)
+    table = tabulate(
+        results, headers="keys", tablefmt="github", floatfmt=".3g", showindex=False
+    )
+    with open(OUT_PATH / "embedding_models.md", "w") as f:
+        f.write(table + "\n")
+    logger.info(f"Benchmark results:\n{table}")
+
+
+if __name__ == "__main__":
+    run()
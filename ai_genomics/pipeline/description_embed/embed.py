@@ -4,19 +4,20 @@ import logging
 import numpy as np
 import pandas as pd
 import os
-from sentence_transformers import SentenceTransformer
-from toolz import partition_all
 from torch import cuda
 
+from ai_genomics import PROJECT_DIR, get_yaml_config
+from ai_genomics.getters.near_duplicates import get_canonical_ids
+from ai_genomics.utils.near_duplicates import canonical_positions
+from ai_genomics.utils.text_embedding import (
+    DEFAULT_CPU_WORKERS,
+    embed_to_memmap,
+    expand_memmap,
+)
 
 logger = logging.getLogger(__name__)
 
-
-def embed(texts, model_name, chunk_size=10_000):
-    model = SentenceTransformer(model_name)
-    text_chunks = partition_all(chunk_size, texts)
-    embedding_chunks = [model.encode(tc) for tc in text_chunks]
-    return np.concatenate(embedding_chunks)
+CONFIG = get_yaml_config(PROJECT_DIR / "ai_genomics/config/embed_descriptions.yaml")
 
 
 @click.option(
@@ -26,12 +27,72 @@ def embed(texts, model_name, chunk_size=10_000):
 @click.option(
     "--model-name",
     prompt="Name of sentence transformer to use.",
-    default="allenai-specter",
+    default=CONFIG["model_name"],
+)
+@click.option(
+    "--cache-dir",
+    default=None,
+    help="Directory of a persistent embedding cache. Only texts missing from the cache are embedded.",
+)
+@click.option(
+    "--n-workers",
+    default=None,
+    type=int,
+    help="Number of CPU worker processes. Defaults to 1 with a GPU and to 4 (or the number of cores if lower) without one. Each worker loads its own copy of the model.",
+)
+@click.option(
+    "--backend",
+    default=CONFIG["backend"],
+    type=click.Choice(["torch", "onnx"]),
+    help="Inference backend. onnx runs an int8 quantised export of the model.",
+)
+@click.option(
+    "--max-seq-length",
+    default=None,
+    type=int,
+    help="If set, texts are truncated to this number of tokens.",
+)
+@click.option(
+    "--chunk-size",
+    default=10_000,
+    help="Number of texts embedded (and held in memory) at a time.",
+)
+@click.option(
+    "--csv/--no-csv",
+    default=True,
+    help="Also save the embeddings as a csv indexed by document ID.",
+)
+@click.option(
+    "--skip-near-duplicates",
+    is_flag=True,
+    default=False,
+    help="Only embed one document of each group of near-duplicates in a file (see pipeline/near_duplicates). The other documents get the embedding of their canonical document.",
 )
 @click.command()
-def run(directory, model_name):
+def run(
+    directory,
+    model_name,
+    cache_dir,
+    n_workers,
+    backend,
+    max_seq_length,
+    chunk_size,
+    csv,
+    skip_near_duplicates,
+):
 
-    files = os.listdir(directory)
+    if n_workers is None:
+        n_workers = (
+            1 if cuda.is_available() else min(DEFAULT_CPU_WORKERS, os.cpu_count())
+        )
+    if not cuda.is_available():
+        logger.info(f"CUDA not available, embedding on CPU with {n_workers} workers")
+
+    canonical = get_canonical_ids() if skip_near_duplicates else dict()
+
+    # Only the json lookups (not previous outputs) are embedded
+    files = [f for f in os.listdir(directory) if f.endswith(".json")]
+    files = [f for f in files if not f.endswith("_embedding_ids.json")]
 
     for file in files:
         path = f"{directory}/{file}"
@@ -39,23 +100,58 @@ def run(directory, model_name):
         with open(path, "r") as f:
             data = json.load(f)
 
+        if len(data) == 0:
+            logger.info(f"Skipping {file}: no texts to embed")
+            continue
+
+        ids, texts = list(data.keys()), list(data.values())
+        fout = file.split(".")[0]
+        npy_path = f"{directory}/{fout}_embeddings.npy"
+        unique_path = f"{directory}/{fout}_unique_embeddings.npy"
+
+        # Near-duplicates whose canonical document is in the same file reuse
+        # its embedding
+        unique, rows = np.arange(len(ids)), None
+        if skip_near_duplicates:
+            unique, rows = np.unique(
+                canonical_positions(ids, canonical), return_inverse=True
+            )
+            logger.info(
+                f"Reusing canonical embeddings for {len(ids) - len(unique)} "
+                f"near-duplicates in {file}"
+            )
+
         logger.info(f"Embedding {file}")
-        embeddings = embed(
-            list(data.values()),
+        embeddings = embed_to_memmap(
+            [texts[n] for n in unique],
             model_name,
+            npy_path if rows is None else unique_path,
+            chunk_size=chunk_size,
+            cache_dir=cache_dir,
+            backend=backend,
+            max_seq_length=max_seq_length,
+            n_workers=n_workers,
         )
+        if rows is not None:
+            embeddings = expand_memmap(embeddings, rows, npy_path, chunk_size)
+            os.remove(unique_path)
+        with open(f"{directory}/{fout}_embedding_ids.json", "w") as f:
+            json.dump(ids, f)
 
-        fout = file.split(".")[0]
-        df = pd.DataFrame(
-            index=data.keys(),
-            data=embeddings,
-        )
-        df.to_csv(f"{directory}/{fout}_embeddings.csv")
+        if csv:
+            # Written chunk_size rows at a time so the memmap is never
+            # loaded into memory in full
+            for start in range(0, len(ids), chunk_size):
+                pd.DataFrame(
+                    index=ids[start : start + chunk_size],
+                    data=embeddings[start : start + chunk_size],
+                ).to_csv(
+                    f"{directory}/{fout}_embeddings.csv",
+                    mode="w" if start == 0 else "a",
+                    header=start == 0,
+                )
 
 
 if __name__ == "__main__":
 
-    if not cuda.is_available():
-        raise EnvironmentError("CUDA is not available")
-
     run()
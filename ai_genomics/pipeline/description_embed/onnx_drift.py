@@ -0,0 +1,44 @@
+import click
+import json
+import logging
+import random
+
+from ai_genomics.utils.onnx_embedding import cosine_drift, onnx_model_path
+
+logger = logging.getLogger(__name__)
+
+
+@click.option(
+    "--texts",
+    prompt="Json lookup between document IDs and texts.",
+)
+@click.option(
+    "--model-name",
+    prompt="Name of sentence transformer to use.",
+    default="allenai-specter",
+)
+@click.option(
+    "--sample-size",
+    default=1_000,
+    help="Number of texts to compare.",
+)
+@click.command()
+def run(texts, model_name, sample_size):
+    """Exports a model to int8 ONNX (if needed) and reports the cosine
+    similarity between its embeddings and the fp32 ones for a sample of texts
+    """
+
+    with open(texts, "r") as f:
+        data = list(json.load(f).values())
+
+    random.seed(42)
+    sample = random.sample(data, min(sample_size, len(data)))
+
+    drift = cosine_drift(sample, model_name)
+    with open(onnx_model_path(model_name) / "drift.json", "w") as f:
+        json.dump(drift.to_dict(), f)
+
+
+if __name__ == "__main__":
+
+    run()
@@ -0,0 +1,32 @@
+"""Converts the full precision embedding tables of each source into float16
+and int8 tables (see `ai_genomics.utils.embedding_storage`). Rows whose
+cosine error would exceed the bound are stored in float32, so one outlier
+does not abort the job or loosen the bound of the table.
+"""
+from ai_genomics import bucket_name, logger
+from ai_genomics.getters.data_getters import save_to_s3
+from ai_genomics.getters.embeddings import (
+    EMBEDDING_FILES,
+    get_embedding_table,
+    quantised_embeddings_path,
+)
+from ai_genomics.utils.embedding_storage import QuantisedEmbeddings
+
+DTYPES = ["float16", "int8"]
+
+
+if __name__ == "__main__":
+
+    for source in EMBEDDING_FILES:
+        embeddings = get_embedding_table(source)
+
+        for dtype in DTYPES:
+            table = QuantisedEmbeddings.from_frame(embeddings, dtype=dtype)
+            logger.info(
+                f"{source} {dtype}: {table.codes.nbytes / 1e6:.0f}MB, "
+                f"max cosine error {table.max_cosine_error:.2e}, "
+                f"{len(table.fallback_rows)} rows stored in float32"
+            )
+            save_to_s3(
+                bucket_name, table.to_arrays(), quantised_embeddings_path(source, dtype)
+            )
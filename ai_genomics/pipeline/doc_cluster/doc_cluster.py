@@ -6,9 +6,10 @@ import pandas as pd
 from sklearn.cluster import KMeans
 from typing import Dict, Sequence, List
 
-from ai_genomics import PROJECT_DIR, logger, bucket_name
+from ai_genomics import PROJECT_DIR, logger, bucket_name, get_yaml_config
 from ai_genomics.utils import id_to_source
 from ai_genomics.getters.data_getters import save_to_s3
+from ai_genomics.getters.embeddings import get_quantised_embeddings
 from ai_genomics.utils.gtr import parse_project_dates
 from ai_genomics.getters.openalex import (
     get_openalex_ai_genomics_works_embeddings,
@@ -24,6 +25,13 @@ from ai_genomics.getters.gtr import (
     get_gtr_ai_genomics_project_embeddings,
     get_gtr_ai_genomics_project_entity_groups,
 )
+from ai_genomics.getters.clusters import get_centroid_model
+from ai_genomics.utils.centroids import CentroidModel, save_centroid_model
+from ai_genomics.utils.streaming_kmeans import (
+    EmbeddingBatches,
+    minibatch_kmeans,
+    predict_labels,
+)
 
 
 LANG = "en"
@@ -31,6 +39,9 @@ K_MACRO_ENTITIES = 100
 AI_MACRO_ENTITY_COLS = ["11", "30", "64"]
 N_CLUSTERS = 20
 RANDOM_STATE = 42
+EMBED_CONFIG = get_yaml_config(
+    PROJECT_DIR / "ai_genomics/config/embed_descriptions.yaml"
+)
 
 
 def subset_oa_recent_in_scope(
@@ -84,6 +95,21 @@ def subset_gtr_recent_in_scope(
     )
 
 
+def check_centroid_model(model: CentroidModel, name: str, expected: Dict):
+    """Raises a ValueError if a centroid model's metadata does not match the
+    expected values (e.g. it was fitted on other embeddings or documents)
+    """
+    mismatches = [
+        f"{key}: {model.metadata.get(key)} (expected {value})"
+        for key, value in expected.items()
+        if model.metadata.get(key) != value
+    ]
+    if len(mismatches) > 0:
+        raise ValueError(
+            f"Centroid model {name} does not match this run: " + ", ".join(mismatches)
+        )
+
+
 def ai_macro_entity_ids(
     macro_entities: pd.DataFrame,
     ai_cols: List[str],
@@ -127,6 +153,50 @@ def make_cluster_to_id_lookup(
     return doc_clusters
 
 
+def load_dense_embeddings(
+    oa_ids: Sequence[str], pat_ids: Sequence[str], gtr_ids: Sequence[str]
+) -> pd.DataFrame:
+    """Loads the full precision embeddings of the selected documents into a
+    single df indexed by document id
+    """
+    oa_embeddings = normalize_embedding_cols(
+        get_openalex_ai_genomics_works_embeddings()
+    )
+    pat_embeddings = normalize_embedding_cols(
+        get_patent_ai_genomics_abstract_embeddings()
+    )
+    gtr_embeddings = (
+        get_gtr_ai_genomics_project_embeddings()
+        .rename(columns={"project_id": "id"})
+        .set_index("id")
+    )
+    gtr_embeddings = gtr_embeddings.rename(
+        columns={c: int(c) for c in gtr_embeddings.columns}
+    )
+    return pd.concat(
+        [
+            oa_embeddings.loc[oa_ids],
+            pat_embeddings.loc[pat_ids],
+            gtr_embeddings.loc[gtr_ids],
+        ]
+    )
+
+
+def check_centroid_model(model: CentroidModel, name: str, expected: Dict):
+    """Raises a ValueError if a centroid model's metadata does not match the
+    expected values (e.g. it was fitted on other embeddings or documents)
+    """
+    mismatches = [
+        f"{key}: {model.metadata.get(key)} (expected {value})"
+        for key, value in expected.items()
+        if model.metadata.get(key) != value
+    ]
+    if len(mismatches) > 0:
+        raise ValueError(
+            f"Centroid model {name} does not match this run: " + ", ".join(mismatches)
+        )
+
+
 def ai_macro_entity_ids(macro_entities: pd.DataFrame, ai_cols: List[int]) -> NDArray:
     return (
         macro_entities.set_index("id")[ai_cols]
@@ -158,22 +228,47 @@ def ai_macro_entity_ids(macro_entities: pd.DataFrame, ai_cols: List[int]) -> NDA
     help="Latest year to use.",
     type=int,
 )
-def run(ai, min_year, max_year):
-    logger.info("Fetching embeddings")
-    oa_embeddings = normalize_embedding_cols(
-        get_openalex_ai_genomics_works_embeddings()
-    )
-    pat_embeddings = normalize_embedding_cols(
-        get_patent_ai_genomics_abstract_embeddings()
-    )
-    gtr_embeddings = (
-        get_gtr_ai_genomics_project_embeddings()
-        .rename(columns={"project_id": "id"})
-        .set_index("id")
-    )
-    gtr_embeddings = gtr_embeddings.rename(
-        columns={c: int(c) for c in gtr_embeddings.columns}
-    )
+@click.option(
+    "--minibatch",
+    is_flag=True,
+    default=False,
+    help="Stream int8 embeddings in batches into mini-batch K-means.",
+)
+@click.option(
+    "--batch-size",
+    show_default=True,
+    default=10_000,
+    help="Rows per batch in mini-batch mode.",
+)
+@click.option(
+    "--n-init",
+    show_default=True,
+    default=4,
+    help="Number of K-means restarts fitted in parallel in mini-batch mode.",
+)
+@click.option(
+    "--assign-from",
+    default=None,
+    help=(
+        "Name of a saved centroid model (e.g. doc_all_2012_2021). Documents "
+        "are assigned to its clusters instead of refitting."
+    ),
+)
+def run(ai, min_year, max_year, minibatch, batch_size, n_init, assign_from):
+    subset = "ai" if ai else "all"
+    model_name = f"doc_{subset}_{min_year}_{max_year}"
+    # Documents can only be assigned to a model fitted on the same kind of
+    # embeddings and documents
+    fit_metadata = {
+        "embeddings": "int8" if minibatch else "float32",
+        "ai_only": ai,
+        "model": EMBED_CONFIG["model_name"],
+    }
+    model = None
+    if assign_from is not None:
+        logger.info(f"Loading centroid model {assign_from}")
+        model = get_centroid_model(assign_from)
+        check_centroid_model(model, assign_from, fit_metadata)
 
     logger.info("Fetching documents")
     oa_works = pd.read_parquet(
@@ -225,25 +320,53 @@ def run(ai, min_year, max_year):
         gtr_ai_ids = ai_macro_entity_ids(gtr_macro_entities, AI_MACRO_ENTITY_COLS)
         gtr_ids = list(set(gtr_ids).intersection(set(gtr_ai_ids)))
 
-    embeddings = pd.concat(
-        [
-            oa_embeddings.loc[oa_ids],
-            pat_embeddings.loc[pat_ids],
-            gtr_embeddings.loc[gtr_ids],
-        ]
-    )
-
-    logger.info(f"Clustering embeddings with shape {embeddings.shape}")
-    km = KMeans(n_clusters=N_CLUSTERS, random_state=RANDOM_STATE)
-    km.fit(embeddings)
-    cluster_labels = [int(l) for l in km.labels_]
+    if minibatch:
+        logger.info("Fetching int8 embeddings")
+        tables = [get_quantised_embeddings(source) for source in ["oa", "pat", "gtr"]]
+        batches = EmbeddingBatches(
+            [(table.ids, table) for table in tables],
+            keep=set(oa_ids) | set(pat_ids) | set(gtr_ids),
+            batch_size=batch_size,
+        )
+        ids = batches.ids
+        if model is None:
+            km = minibatch_kmeans(
+                batches, N_CLUSTERS, n_init=n_init, random_state=RANDOM_STATE
+            )
+            cluster_labels = predict_labels(km, batches)
+        else:
+            cluster_labels = [int(l) for b in batches for l in model.assign(b)]
+    else:
+        logger.info("Fetching embeddings")
+        embeddings = load_dense_embeddings(oa_ids, pat_ids, gtr_ids)
+        ids = embeddings.index.values
+
+        if model is None:
+            logger.info(f"Clustering embeddings with shape {embeddings.shape}")
+            km = KMeans(n_clusters=N_CLUSTERS, random_state=RANDOM_STATE)
+            km.fit(embeddings)
+            cluster_labels = [int(l) for l in km.labels_]
+        else:
+            cluster_labels = [int(l) for l in model.assign(embeddings.values)]
+
+    if model is None:
+        logger.info(f"Saving centroid model {model_name}")
+        model = CentroidModel.from_kmeans(
+            km,
+            metadata={
+                **fit_metadata,
+                "n_documents": len(ids),
+                "min_year": min_year,
+                "max_year": max_year,
+            },
+        )
+        save_centroid_model(model, model_name)
 
     cluster_lookup = make_cluster_to_id_lookup(
-        embeddings.index.values,
+        ids,
         cluster_labels,
     )
 
-    subset = "ai" if ai else "all"
     save_to_s3(
         bucket_name,
         cluster_lookup,
@@ -1,16 +1,23 @@
 from itertools import chain
 import numpy as np
 import pandas as pd
+from numpy.typing import NDArray
+from scipy.cluster.hierarchy import fcluster, linkage
 from sklearn.cluster import KMeans
 
-from typing import Any, Dict, Mapping, Sequence
+from pathlib import Path
+from typing import Dict, Mapping, Optional, Sequence, Tuple, Union
 
+from ai_genomics.utils.centroids import CentroidModel
+from ai_genomics.utils.doc_vectors import doc_entity_matrix, entity_cluster_indicator
 from ai_genomics.utils.text_embedding import embed
 
 
 def embed_entities(
     entities: Mapping[str, Sequence[str]],
     model: str,
+    cache_dir: Optional[Union[str, Path]] = None,
+    backend: str = "torch",
 ) -> pd.DataFrame:
     """_summary_
 
@@ -18,36 +25,170 @@ def embed_entities(
         entities (Mapping[str, Mapping[str, Union[str, str]]]): Entities
             (without scores) for a set of documents.
         model (str): Name of a sentence transformer model.
+        cache_dir (str, Path, optional): Directory of a persistent embedding
+            cache. If specified, only entities that have not been embedded
+            before are encoded.
+        backend (str): "torch" or "onnx" (int8 quantised inference on CPU).
 
     Returns:
         pd.DataFrame: Dataframe where rows are entities and columns are
             embedding values.
     """
     entities_unique = list(set(chain(*entities.values())))
-    embeddings = embed(entities_unique, model)
+    embeddings = embed(entities_unique, model, cache_dir=cache_dir, backend=backend)
 
     return pd.DataFrame(embeddings, index=entities_unique)
 
 
-def create_entity_embedding_clusters(
+def fit_entity_hierarchy(
     entity_embeddings: pd.DataFrame,
-    cluster_params: Mapping[str, Any],
-) -> Dict[str, int]:
-    """Clusters entity embeddings using K means and returns a lookup between
-    entities and their cluster ID.
+    n_fine_clusters: int,
+    method: str = "ward",
+    random_state: int = 42,
+) -> Tuple[Dict[str, int], NDArray]:
+    """Fits a cluster hierarchy over entity embeddings: entities are clustered
+    into fine clusters with K means, then the fine cluster centroids are
+    merged with agglomerative clustering.
 
     Args:
         entity_embeddings (pd.DataFrame): Embeddings for a set of entities.
-        cluster_params (Mapping[str, Any]): A dictionary or other mapping of
-            kwargs to pass into the clusterer.
+        n_fine_clusters (int): Number of fine clusters (the largest number of
+            clusters the hierarchy can be cut into).
+        method (str): Linkage method used to merge centroids.
+        random_state (int): Random seed for K means.
 
     Returns:
-        Dict[str, int]: A lookup between entities and their cluster IDs.
+        Dict[str, int]: A lookup between entities and their fine cluster IDs.
+        NDArray: The linkage matrix of the fine cluster centroids.
     """
-    km = KMeans(**cluster_params)
+    km = KMeans(n_clusters=n_fine_clusters, random_state=random_state)
     km.fit(entity_embeddings)
+    fine_lookup = dict(zip(entity_embeddings.index, [int(l) for l in km.labels_]))
+    return fine_lookup, linkage(km.cluster_centers_, method=method)
 
-    return dict(zip(entity_embeddings.index, [int(l) for l in km.labels_]))
+
+def cut_entity_hierarchy(
+    fine_lookup: Mapping[str, int],
+    centroid_linkage: NDArray,
+    levels: Mapping[str, int],
+) -> Tuple[Dict[str, Dict[str, int]], Dict[str, Dict[int, int]]]:
+    """Cuts an entity cluster hierarchy (see `fit_entity_hierarchy`) into
+    nested levels. Every cluster at a level is contained in a single cluster
+    at each coarser level, and new levels only need another cut.
+
+    Args:
+        fine_lookup (Mapping[str, int]): A lookup between entities and their
+            fine cluster IDs.
+        centroid_linkage (NDArray): The linkage matrix of the fine cluster
+            centroids.
+        levels (Mapping[str, int]): Level names (e.g. "k_100") and their
+            number of clusters.
+
+    Returns:
+        Dict[str, Dict[str, int]]: A lookup between entities and their
+            cluster ID for each level.
+        Dict[str, Dict[int, int]]: For each level (except the coarsest), a
+            lookup between its cluster IDs and their parent cluster ID at
+            the next coarser level.
+    """
+    names = sorted(levels, key=levels.get)
+    cuts = np.stack(
+        [
+            fcluster(centroid_linkage, levels[name], criterion="maxclust") - 1
+            for name in names
+        ],
+        axis=1,
+    )
+
+    lookups = {
+        name: {ent: int(cuts[fine, n]) for ent, fine in fine_lookup.items()}
+        for n, name in enumerate(names)
+    }
+    parents = {
+        child: {int(c): int(p) for c, p in zip(cuts[:, n + 1], cuts[:, n])}
+        for n, child in enumerate(names[1:])
+    }
+    return lookups, parents
+
+
+def entity_centroid_model(
+    entity_embeddings: pd.DataFrame,
+    fine_lookup: Mapping[str, int],
+    cluster_lookups: Mapping[str, Mapping[str, int]],
+    metadata: Optional[Dict] = None,
+) -> CentroidModel:
+    """Creates a centroid model of an entity cluster hierarchy, to assign new
+    entities to the existing clusters at any level.
+
+    Args:
+        entity_embeddings (pd.DataFrame): Embeddings for a set of entities.
+        fine_lookup (Mapping[str, int]): A lookup between entities and their
+            fine cluster IDs.
+        cluster_lookups (Mapping[str, Mapping[str, int]]): A lookup between
+            entities and their cluster ID for each level (see
+            `cut_entity_hierarchy`).
+        metadata (Dict, optional): Information about the fit.
+
+    Returns:
+        CentroidModel: The mean embedding of each fine cluster, and the
+            cluster it belongs to at each level.
+    """
+    fine = entity_embeddings.index.map(fine_lookup)
+    centroids = entity_embeddings.groupby(fine.values).mean().sort_index()
+
+    level_labels = dict()
+    for level, lookup in cluster_lookups.items():
+        labels = np.zeros(len(centroids), dtype=np.int64)
+        for ent, fine_cluster in fine_lookup.items():
+            labels[fine_cluster] = lookup[ent]
+        level_labels[level] = labels
+
+    return CentroidModel(centroids.values, level_labels, metadata=metadata)
+
+
+def assign_entity_clusters(
+    entity_embeddings: pd.DataFrame,
+    model: CentroidModel,
+    levels: Mapping[str, int],
+) -> Tuple[Dict[str, Dict[str, int]], Dict[str, Dict[int, int]]]:
+    """Assigns entities to the clusters of a saved entity centroid model (see
+    `entity_centroid_model`) instead of refitting the hierarchy, so cluster
+    IDs stay the same when the set of entities changes.
+
+    Args:
+        entity_embeddings (pd.DataFrame): Embeddings for a set of entities.
+        model (CentroidModel): Centroid model of an entity cluster hierarchy.
+        levels (Mapping[str, int]): Level names (e.g. "k_100") and their
+            number of clusters.
+
+    Returns:
+        Dict[str, Dict[str, int]]: A lookup between entities and their
+            cluster ID for each level.
+        Dict[str, Dict[int, int]]: For each level (except the coarsest), a
+            lookup between its cluster IDs and their parent cluster ID at
+            the next coarser level (as in `cut_entity_hierarchy`).
+    """
+    missing = [level for level in levels if level not in model.level_labels]
+    if len(missing) > 0:
+        raise ValueError(f"Levels not in the centroid model: {missing}")
+
+    fine = model.assign(entity_embeddings.values)
+    lookups = {
+        level: dict(
+            zip(entity_embeddings.index, model.level_labels[level][fine].tolist())
+        )
+        for level in levels
+    }
+
+    names = sorted(levels, key=levels.get)
+    parents = {
+        child: {
+            int(c): int(p)
+            for c, p in zip(model.level_labels[child], model.level_labels[parent])
+        }
+        for parent, child in zip(names[:-1], names[1:])
+    }
+    return lookups, parents
 
 
 def create_doc_vectors(
@@ -69,20 +210,14 @@ def create_doc_vectors(
             entities and their cluster.
 
     Returns:
-        pd.DataFrame: The document vectors.
+        pd.DataFrame: The document vectors as a sparse dataframe.
     """
+    vocabulary = list(entity_to_clusters_lookup)
+    doc_entities, ids = doc_entity_matrix(entities, vocabulary)
+    doc_vectors = doc_entities @ entity_cluster_indicator(
+        vocabulary, entity_to_clusters_lookup
+    )
 
-    d = max(entity_to_clusters_lookup.values()) + 1
-
-    doc_vectors = []
-    for ents in entities.values():
-        entity_groups = [
-            entity_to_clusters_lookup[e]
-            for e in ents
-            if entity_to_clusters_lookup.get(e) is not None
-        ]
-        doc_vectors.append(np.bincount(entity_groups, minlength=d))
-
-    doc_vectors = pd.DataFrame(np.array(doc_vectors), index=entities.keys())
+    doc_vectors = pd.DataFrame.sparse.from_spmatrix(doc_vectors, index=ids)
     doc_vectors.index.name = "id"
     return doc_vectors
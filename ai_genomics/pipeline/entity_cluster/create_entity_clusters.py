@@ -1,6 +1,11 @@
+import click
+import hashlib
 import json
-from sklearn import cluster
+import numpy as np
+import pandas as pd
+from numpy.typing import NDArray
 from toolz.dicttoolz import merge
+from typing import Dict, Optional, Tuple
 
 from ai_genomics import PROJECT_DIR, get_yaml_config, logger, bucket_name
 from ai_genomics.utils.reading import make_path_if_not_exist
@@ -22,21 +27,64 @@ from ai_genomics.getters.crunchbase import (
 )
 from ai_genomics.pipeline.entity_cluster import (
     embed_entities,
-    create_entity_embedding_clusters,
-    create_doc_vectors,
+    fit_entity_hierarchy,
+    cut_entity_hierarchy,
+    entity_centroid_model,
+    assign_entity_clusters,
 )
 from ai_genomics.utils.entities import (
     filter_entities,
     strip_scores,
 )
+from ai_genomics.getters.clusters import get_centroid_model
+from ai_genomics.utils.centroids import save_centroid_model
+from ai_genomics.utils.embedding_cache import EMBEDDING_CACHE_DIR
+from ai_genomics.utils.doc_vectors import (
+    doc_entity_matrix,
+    entity_cluster_indicator,
+    to_arrays,
+)
 
 
 CONFIG = get_yaml_config(PROJECT_DIR / "ai_genomics/config/entity_cluster.yaml")
 OUT_DIR = PROJECT_DIR / "inputs/entities/"
-
-
-if __name__ == "__main__":
-
+TREE_PATH = OUT_DIR / "entity_groups_tree.json"
+
+
+def embeddings_hash(embeddings: pd.DataFrame) -> str:
+    """Hash of a table of entity embeddings (independent of its row order), so
+    a change of entities, embedding model or backend invalidates the tree
+    """
+    embeddings = embeddings.sort_index()
+    digest = hashlib.sha1("\n".join(embeddings.index).encode("utf-8"))
+    digest.update(np.ascontiguousarray(embeddings.values, dtype=np.float32).tobytes())
+    return digest.hexdigest()
+
+
+def load_entity_tree(key: Dict) -> Optional[Tuple[Dict[str, int], NDArray]]:
+    """Loads a previously fitted entity cluster hierarchy if it was fitted with
+    the same key (embeddings hash, number of fine clusters and linkage)
+    """
+    if not TREE_PATH.exists():
+        return None
+    with open(TREE_PATH, "r") as f:
+        tree = json.load(f)
+    if tree.get("key") != key:
+        return None
+    return tree["fine"], np.array(tree["linkage"])
+
+
+@click.command()
+@click.option(
+    "--assign-from",
+    default=None,
+    help=(
+        "Name of a saved entity centroid model (e.g. entity_groups). Entities "
+        "are assigned to its clusters instead of refitting the hierarchy, so "
+        "cluster IDs stay the same when the entities change."
+    ),
+)
+def run(assign_from):
     logger.info("Fetching and merging entities.")
 
     gtr_ids = list(get_ai_genomics_project_table().query("ai_genomics == True")["id"])
@@ -68,16 +116,70 @@ if __name__ == "__main__":
     embeddings = embed_entities(
         entities,
         **CONFIG["embed"],
+        cache_dir=EMBEDDING_CACHE_DIR,
     )
 
     make_path_if_not_exist(OUT_DIR)
-    for k, params in CONFIG["cluster"].items():
-        logger.info(f"Clustering {k} entities.")
-        cluster_lookup = create_entity_embedding_clusters(
-            embeddings,
-            params,
+    levels = {k: params["n_clusters"] for k, params in CONFIG["cluster"].items()}
+    n_fine_clusters = CONFIG["hierarchy"]["n_fine_clusters"] or max(levels.values())
+
+    if assign_from is not None:
+        logger.info(f"Assigning entities to centroid model {assign_from}")
+        model = get_centroid_model(assign_from)
+        if model.metadata.get("model") != CONFIG["embed"]["model"]:
+            raise ValueError(
+                f"Centroid model {assign_from} was fitted on "
+                f"{model.metadata.get('model')} embeddings, not "
+                f"{CONFIG['embed']['model']}"
+            )
+        cluster_lookups, parents = assign_entity_clusters(embeddings, model, levels)
+    else:
+        # The hierarchy is only refitted if the embeddings (entities or model)
+        # change, so new levels (up to n_fine_clusters) only need another cut
+        tree_key = {
+            "embeddings": embeddings_hash(embeddings),
+            "n_fine_clusters": n_fine_clusters,
+            "linkage": CONFIG["hierarchy"]["linkage"],
+        }
+        tree = load_entity_tree(tree_key)
+        if tree is None:
+            logger.info(f"Fitting hierarchy with {n_fine_clusters} fine clusters.")
+            tree = fit_entity_hierarchy(
+                embeddings, n_fine_clusters, method=CONFIG["hierarchy"]["linkage"]
+            )
+            with open(TREE_PATH, "w") as f:
+                json.dump(
+                    {"key": tree_key, "fine": tree[0], "linkage": tree[1].tolist()}, f
+                )
+        cluster_lookups, parents = cut_entity_hierarchy(*tree, levels)
+
+        # Centroids of the hierarchy, to assign new entities to existing clusters
+        save_centroid_model(
+            entity_centroid_model(
+                embeddings,
+                tree[0],
+                cluster_lookups,
+                metadata={"model": CONFIG["embed"]["model"], "levels": levels},
+            ),
+            "entity_groups",
         )
 
+    save_to_s3(bucket_name, parents, "inputs/entities/entity_groups_hierarchy.json")
+    with open(OUT_DIR / "entity_groups_hierarchy.json", "w") as f:
+        json.dump(parents, f)
+
+    # Count the entities of each document once per source. The vectors of
+    # each level are a sparse product with its entity -> cluster indicator
+    vocabulary = list(embeddings.index)
+    entity_list = [oa_entities, patent_entities, gtr_entities, cb_entities]
+    dataset_names = ["openalex", "patent", "gtr", "crunchbase"]
+    doc_entities = {
+        name: doc_entity_matrix(strip_scores(ents), vocabulary)
+        for ents, name in zip(entity_list, dataset_names)
+    }
+
+    for k, cluster_lookup in cluster_lookups.items():
+        logger.info(f"Saving {k} entity clusters.")
         save_to_s3(
             bucket_name, cluster_lookup, f"inputs/entities/entity_groups_{k}.json"
         )
@@ -85,16 +187,17 @@ if __name__ == "__main__":
         with open(OUT_DIR / f"entity_groups_{k}.json", "w") as f:
             json.dump(cluster_lookup, f)
 
-        entity_list = [oa_entities, patent_entities, gtr_entities, cb_entities]
-        dataset_names = ["openalex", "patent", "gtr", "crunchbase"]
-
-        for ents, name in zip(entity_list, dataset_names):
-            ents = strip_scores(ents)
-            doc_vecs = create_doc_vectors(ents, cluster_lookup)
-            doc_vecs.to_csv(OUT_DIR / f"{name}_entity_group_vectors_{k}.csv")
+        indicator = entity_cluster_indicator(vocabulary, cluster_lookup)
+        for name, (matrix, ids) in doc_entities.items():
+            doc_vecs = to_arrays(matrix @ indicator, ids)
+            np.savez(OUT_DIR / f"{name}_entity_group_vectors_{k}.npz", **doc_vecs)
 
             save_to_s3(
                 bucket_name,
-                doc_vecs.reset_index(),
-                f"inputs/entities/{name}_entity_group_vectors_{k}.csv",
+                doc_vecs,
+                f"inputs/entities/{name}_entity_group_vectors_{k}.npz",
             )
+
+
+if __name__ == "__main__":
+    run()
@@ -6,13 +6,13 @@ It also saves out the propagated cluster labels and reduced entity embeddings to
 python ai_genomics/pipeline/entity_cluster/create_entity_clusters_over_time.py
 """
 import pandas as pd
-from typing import Dict, List
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 import itertools
 import numpy as np
 import pandas as pd
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix, csr_matrix
 from sklearn.cluster import KMeans
-from sklearn.metrics import silhouette_score
-import ast
 from collections import defaultdict
 
 from ai_genomics import bucket_name, logger, get_yaml_config, PROJECT_DIR
@@ -27,9 +27,11 @@ from ai_genomics.getters.gtr import get_gtr_entities
 from ai_genomics.getters.openalex import get_openalex_ai_genomics_entities
 from ai_genomics.getters.entities import get_entity_cluster_lookup
 
-from ai_genomics.utils.text import jaccard_similarity
+from ai_genomics.utils.cluster_selection import N_INIT, select_k_parallel
 from ai_genomics.utils.entities import generate_embed_lookup
 from ai_genomics.utils.filtering import filter_data
+from ai_genomics.utils.embedding_cache import EMBEDDING_CACHE_DIR
+from ai_genomics.utils.reduction import REDUCER_CACHE_DIR
 from ai_genomics.utils.entities import (
     filter_entities,
     strip_scores,
@@ -42,9 +44,13 @@ def timestamp_entities(
     list_of_dfs: List[pd.DataFrame],
     list_of_ents: List[dict],
     start_date: str = "2010-01-01",
-) -> Dict[int, List[str]]:
+    first_seen: bool = False,
+) -> Union[Dict[int, List[str]], Dict[str, int]]:
     """Generates a dictionary where the key is the year and the value
     is a list of entities extracted up to and including that year. 
+
+    Documents are sorted by date once and swept through in a single pass,
+    adding the entities of each year's new documents to a running set.
     
     Args:
         list_of_dfs (List[pd.DataFrame]): List of filtered dataframes
@@ -53,35 +59,64 @@ def timestamp_entities(
             patents, crunchbase, openalex and gtr
         start_date (str): A YYYY-MM-DD string indicating the start date 
             to timeslice from. 
+        first_seen (bool): If True, returns the first year each entity
+            appears in instead.
     
     Returns:
         A dictionary where the key is the year and the value 
         is a list of entities across datasets that appeared 
-        up to that year. 
+        up to that year. If first_seen, a dictionary where the key
+        is an entity and the value is the first year it appeared in.
     """
-    periods = 2022 - ast.literal_eval(start_date.split("-")[0])
-    date_range = pd.date_range(start=start_date, periods=periods, freq="A")
+    years = range(pd.Timestamp(start_date).year, 2022)
+    # documents dated before the end of each year
+    year_ends = [pd.Timestamp(year=year, month=12, day=31) for year in years]
+
+    docs = (
+        pd.concat(
+            [
+                pd.DataFrame(
+                    {"date": pd.to_datetime(df["date"]), "id": df["id"], "source": n}
+                )
+                for n, df in enumerate(list_of_dfs)
+            ]
+        )
+        .dropna(subset=["date"])
+        .sort_values("date", kind="stable")
+    )
+    ends = docs["date"].searchsorted(year_ends, side="left")
+    sources, ids = docs["source"].values, docs["id"].values
 
-    ents_per_date = dict()
-    for min_date in date_range:
-        all_ents = []
-        for df, ents in zip(list_of_dfs, list_of_ents):
-            df_ids = list(df[df.date < min_date].id)
-            ents_subset = {
-                id_: [i for i in ents.get(id_)] for id_ in df_ids if ents.get(id_)
-            }
-            all_ents.extend(list(itertools.chain(*ents_subset.values())))
-        ents_per_date[min_date.year] = list(set(all_ents))
+    # dict keys keep entities in the order they were first seen
+    entity_years, ents_per_date, start = dict(), dict(), 0
+    for year, end in zip(years, ends):
+        for source, id_ in zip(sources[start:end], ids[start:end]):
+            for ent in list_of_ents[source].get(id_) or []:
+                entity_years.setdefault(ent, year)
+        ents_per_date[year] = list(entity_years)
+        start = end
 
-    return ents_per_date
+    return entity_years if first_seen else ents_per_date
 
 
 def get_best_k(
-    reduced_entities: Dict[str, np.array], ents_per_date: Dict[str, List[str]]
+    reduced_entities: Dict[str, np.array],
+    ents_per_date: Dict[str, List[str]],
+    ks: Sequence[int] = range(10, 100, 5),
+    sample_size: int = 2_000,
+    n_bootstrap: int = 20,
+    patience: Optional[int] = 3,
+    n_workers: Optional[int] = None,
 ) -> List[int]:
     """Identifies the optimal number of clusters per timeslice 
         based on the maximum mean silouette score for k 
-        between 10-70 at 5 intervals.
+        between 10-95 at 5 intervals.
+
+    Timeslices are processed in parallel. Within a timeslice, k-means fits
+        are warm-started from the centroids of the previous k, silhouette
+        scores are estimated on bootstrap samples of the entities and the
+        sweep stops once the score plateaus (see
+        `ai_genomics.utils.cluster_selection.select_k`).
     
     Args:
         reduced_entities (Dict[str, np.array]): A dictionary where the 
@@ -89,29 +124,135 @@ def get_best_k(
         ents_per_date (List[dict]): A dictionary where the key is the 
             year and the value is a list of entities across datasets 
             that appeared up to that year.
+        ks (Sequence[int]): Candidate numbers of clusters.
+        sample_size (int): Number of entities per silhouette sample.
+        n_bootstrap (int): Number of silhouette samples.
+        patience (int): Number of ks without improvement before stopping
+            early (None to try every k).
+        n_workers (int): Number of processes (defaults to the number of cores).
 
     Returns:            
         list of optimal ks per timeslice.
     """
+    ent_embeds = [
+        np.array([reduced_entities.get(ent) for ent in ents])
+        for ents in ents_per_date.values()
+    ]
+    results = select_k_parallel(
+        ent_embeds,
+        n_workers=n_workers,
+        ks=ks,
+        sample_size=sample_size,
+        n_bootstrap=n_bootstrap,
+        patience=patience,
+    )
+
     best_ks = []
-    for ents in ents_per_date.values():
-        results = []
-        ent_embeds = [reduced_entities.get(ent) for ent in ents]
-        for n in range(10, 100, 5):
-            km = KMeans(n_clusters=n)
-            clust = km.fit_predict(ent_embeds)
-            score = silhouette_score(ent_embeds, clust)
-            results.append([n, score])
-        max_score = max([i[1] for i in results])
-        best_ks.extend([i[0] for i in results if i[1] == max_score])
+    for year, (best_k, scores) in zip(ents_per_date, results):
+        if best_k is None:
+            best_k = min(scores)
+            logger.warning(
+                f"{year}: no silhouette estimate for any k, "
+                f"falling back to the smallest k {best_k}"
+            )
+        score, low, high = scores[best_k]
+        logger.info(
+            f"{year}: best k {best_k} of {len(scores)} tried, "
+            f"silhouette {score:.3f} (95% CI {low:.3f}-{high:.3f})"
+        )
+        best_ks.append(best_k)
 
     return best_ks
 
 
+def cluster_membership(
+    timeslice: Dict[str, List[str]], entity_index: Dict[str, int]
+) -> csr_matrix:
+    """Clusters x entities indicator matrix of a timeslice, adding unseen
+    entities to the entity index
+    """
+    rows, cols = [], []
+    for n, ents in enumerate(timeslice.values()):
+        for ent in set(ents):
+            rows.append(n)
+            cols.append(entity_index.setdefault(ent, len(entity_index)))
+    return csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, cols)),
+        shape=(len(timeslice), len(entity_index)),
+    )
+
+
+def cluster_jaccard(
+    timeslice_x: Dict[str, List[str]], timeslice_y: Dict[str, List[str]]
+) -> coo_matrix:
+    """Jaccard similarity between the entity lists of every pair of clusters
+        at t-1 and t that share at least one entity. Overlaps are computed
+        with one sparse product of cluster membership matrices.
+
+    Returns:
+        A sparse clusters at t-1 x clusters at t matrix of jaccard
+            similarities, in the order of the timeslices' keys.
+    """
+    entity_index = dict()
+    members_x = cluster_membership(timeslice_x, entity_index)
+    members_y = cluster_membership(timeslice_y, entity_index)
+    members_x.resize(members_x.shape[0], len(entity_index))
+
+    overlap = (members_x @ members_y.T).tocoo()
+    sizes_x = np.asarray(members_x.sum(axis=1)).ravel()
+    sizes_y = np.asarray(members_y.sum(axis=1)).ravel()
+    union = sizes_x[overlap.row] + sizes_y[overlap.col] - overlap.data
+    return coo_matrix(
+        (overlap.data / union, (overlap.row, overlap.col)), shape=overlap.shape
+    )
+
+
+def match_clusters(
+    similarity: coo_matrix, min_score: float, method: str = "optimal"
+) -> List[Tuple[int, int]]:
+    """Matches clusters at t-1 to clusters at t one-to-one, only using pairs
+        with a similarity above a threshold.
+
+    Args:
+        similarity (coo_matrix): Sparse similarity matrix between clusters.
+        min_score (float): Pairs must have a higher similarity to be matched.
+        method (str): "optimal" to maximise the total similarity of matched
+            pairs, or "greedy" to match the most similar pairs first.
+
+    Returns:
+        List of (row, column) pairs of matched clusters.
+    """
+    keep = similarity.data > min_score
+    rows, cols = similarity.row[keep], similarity.col[keep]
+    scores = similarity.data[keep]
+
+    if method == "greedy":
+        matches, used_x, used_y = [], set(), set()
+        for n in np.argsort(-scores, kind="stable"):
+            if rows[n] not in used_x and cols[n] not in used_y:
+                matches.append((int(rows[n]), int(cols[n])))
+                used_x.add(rows[n])
+                used_y.add(cols[n])
+        return matches
+
+    # Only clusters with a candidate pair take part in the assignment
+    cand_x, row_pos = np.unique(rows, return_inverse=True)
+    cand_y, col_pos = np.unique(cols, return_inverse=True)
+    weights = np.zeros((len(cand_x), len(cand_y)))
+    weights[row_pos, col_pos] = scores
+    matched_x, matched_y = linear_sum_assignment(weights, maximize=True)
+    return [
+        (int(cand_x[i]), int(cand_y[j]))
+        for i, j in zip(matched_x, matched_y)
+        if weights[i, j] > 0
+    ]
+
+
 def propagate_labels(
     timeslice_x: Dict[str, List[str]],
     timeslice_y: Dict[str, List[str]],
     min_jaccard_score: float = 0.5,
+    method: str = "optimal",
 ) -> Dict[int, List[str]]:
     """Propogates cluster labels from t-1 to t based on maximum 
         jaccard similarity above a threshold between entity lists.    
@@ -125,44 +266,21 @@ def propagate_labels(
         entities belonging to a given cluster number. 
     min_jaccard_score (float): The minimum jaccard score required
         to propagate cluster labels from t-1 to t. 
+    method (str): "optimal" to match clusters maximising their total
+        jaccard similarity, or "greedy" to match the most similar first.
     
     timeslice_y cluster numbers are changed in place based on similarty
         score thresholds. 
     """
-    # generate cartesian product of cluster lists at t-1 and t
-    cluster_perms = list(itertools.product(timeslice_x, timeslice_y))
-
-    # calculate the jaccard simiarity between entity lists at t-1 and t
-    perm_dists = []
-    for cluster_x, cluster_y in cluster_perms:
-        # get entity lists at each timeslice oer cluster number
-        timeslice_x_ents, timeslice_y_ents = (
-            timeslice_x.get(cluster_x),
-            timeslice_y.get(cluster_y),
-        )
-        dists = jaccard_similarity(timeslice_x_ents, timeslice_y_ents)
-        # if the similarity is not 0 AND above the minimum threshold
-        if (dists != 0) & (dists > min_jaccard_score):
-            perm_dists.append((cluster_x, cluster_y, dists))
-    # sort the list of cluster numbers at t-1, cluster numbers at t and their
-    # jaccard similarty scores
-    sorted_perm_dists = sorted(perm_dists, key=lambda x: (x[0], x[2]), reverse=True)
-    # remove clusters that are close the multiple clusters by picking the
-    # combination with the highest jaccard similarty score
-    sorted_perm_dists_clusts = list(
-        dict([(i[0], i[1]) for i in sorted_perm_dists]).items()
+    labels_x, labels_y = list(timeslice_x), list(timeslice_y)
+    matches = match_clusters(
+        cluster_jaccard(timeslice_x, timeslice_y), min_jaccard_score, method
     )
 
-    # recursively update cluster labels at t with cluster labels
-    # from t-1 based on the sorted list
-    while len(sorted_perm_dists_clusts) > 0:
-        most_similar_clusts = sorted_perm_dists_clusts[0]
-        timeslice_y[sorted_perm_dists_clusts[0][0]] = timeslice_y.get(
-            sorted_perm_dists_clusts[0][1]
-        )
-        # and pop key with old name!
-        timeslice_y.pop(sorted_perm_dists_clusts[0][1], None)
-        sorted_perm_dists_clusts.remove(most_similar_clusts)
+    # pop every matched cluster before renaming, so a new label can't
+    # overwrite a cluster that has not been renamed yet
+    renamed = {labels_x[x]: timeslice_y.pop(labels_y[y]) for x, y in matches}
+    timeslice_y.update(renamed)
 
 
 if __name__ == "__main__":
@@ -232,7 +350,13 @@ if __name__ == "__main__":
     # embed and reduce ents and generate lookup
     all_ents = list(set(list(itertools.chain(*list(ents_per_date.values())))))
     ent_embeds_lookup = generate_embed_lookup(
-        entities=all_ents, model=CONFIG["embed"]["model"], reduce_embedding=True
+        entities=all_ents,
+        model=CONFIG["embed"]["model"],
+        backend=CONFIG["embed"]["backend"],
+        reduce_embedding=True,
+        pre_components=CONFIG["reduce"]["pre_components"],
+        reducer_cache_dir=REDUCER_CACHE_DIR,
+        cache_dir=EMBEDDING_CACHE_DIR,
     )
     save_to_s3(
         bucket_name,
@@ -241,8 +365,16 @@ if __name__ == "__main__":
     )
     logger.info("embedded and saved reduced entities.")
     # identify optimal k at every timeslice
+    select_k_config = CONFIG["select_k"]
     best_ks = get_best_k(
-        reduced_entities=ent_embeds_lookup, ents_per_date=ents_per_date
+        reduced_entities=ent_embeds_lookup,
+        ents_per_date=ents_per_date,
+        ks=range(
+            select_k_config["min_k"], select_k_config["max_k"], select_k_config["step"]
+        ),
+        sample_size=select_k_config["sample_size"],
+        n_bootstrap=select_k_config["n_bootstrap"],
+        patience=select_k_config["patience"],
     )
     logger.info("got best k per timesliced entities.")
 
@@ -250,7 +382,7 @@ if __name__ == "__main__":
     ents_per_date_clusts = dict()
     for best_k, (year, ents) in zip(best_ks, ents_per_date.items()):
         ent_embeds = [ent_embeds_lookup.get(ent) for ent in ents]
-        km = KMeans(n_clusters=best_k).fit(ent_embeds)
+        km = KMeans(n_clusters=best_k, n_init=N_INIT).fit(ent_embeds)
         clust = km.predict(ent_embeds)
         clust_dict = {f"{c}_{year}": [] for c in clust}
         for i, c in enumerate(clust):
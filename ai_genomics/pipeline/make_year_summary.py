@@ -8,6 +8,7 @@ from functools import partial
 from toolz import pipe
 
 from ai_genomics.utils import openalex
+from ai_genomics.utils.author_timeline import TIMELINE_YEARS, make_author_timeline
 from ai_genomics import PROJECT_DIR
 from ai_genomics.getters.openalex import get_openalex_instits
 
@@ -24,6 +25,7 @@ def fetch_save_year(concept_name: str, year: int, make_df: bool = True):
     """
     if os.path.exists(f"{OALEX_PATH}/works_{concept_name}_{year}.csv"):
         logging.info(f"{concept_name}_{year} already exists")
+        backfill_abstract_tokens(concept_name, year)
         return
 
     oalex_works = openalex.fetch_openalex(concept_name, year)
@@ -74,6 +76,30 @@ def fetch_save_year(concept_name: str, year: int, make_df: bool = True):
     with open(f"{OALEX_PATH}/abstracts_{concept_name}_{year}.json", "w") as outfile:
         json.dump(openalex.make_deinverted_abstracts(oalex_works), outfile)
 
+    # Clean abstract tokens (for topic modelling)
+    with open(
+        f"{OALEX_PATH}/abstract_tokens_{concept_name}_{year}.json", "w"
+    ) as outfile:
+        json.dump(openalex.make_abstract_tokens(oalex_works), outfile)
+
+
+def backfill_abstract_tokens(concept_name: str, year: int):
+    """Saves the clean abstract tokens of a year fetched before they were
+    saved, from its deinverted abstracts
+    Args:
+        concept_name: The name of the concept
+        year: the year
+    """
+    tokens_path = f"{OALEX_PATH}/abstract_tokens_{concept_name}_{year}.json"
+    if os.path.exists(tokens_path):
+        return
+
+    logging.info(f"Backfilling abstract tokens for {concept_name}_{year}")
+    with open(f"{OALEX_PATH}/abstracts_{concept_name}_{year}.json", "r") as infile:
+        abstracts = json.load(infile)
+    with open(tokens_path, "w") as outfile:
+        json.dump(openalex.abstract_tokens_from_abstracts(abstracts), outfile)
+
 
 if __name__ == "__main__":
 
@@ -87,3 +113,8 @@ if __name__ == "__main__":
     for year in range(2007, 2022):
         for concept_name in ["artificial_intelligence", "genetics"]:
             fetch_save_year(concept_name, year, make_df=True)
+
+    logging.info("Making author timeline")
+    timeline, author_meta = make_author_timeline(years=TIMELINE_YEARS)
+    timeline.to_parquet(f"{OALEX_PATH}/author_timeline.parquet", index=False)
+    author_meta.to_parquet(f"{OALEX_PATH}/author_metadata.parquet", index=False)
@@ -0,0 +1,84 @@
+"""Finds near-duplicate documents across OpenAlex works, patents, GtR
+projects and Crunchbase companies with MinHash / LSH over their abstracts
+(and optionally SimHash over their embeddings), and saves a lookup between
+each duplicate document ID and its canonical ID to S3.
+"""
+import click
+import pandas as pd
+
+from ai_genomics import bucket_name, logger
+from ai_genomics.getters.crunchbase import get_ai_genomics_crunchbase_orgs
+from ai_genomics.getters.data_getters import save_to_s3
+from ai_genomics.getters.embeddings import get_embedding_table
+from ai_genomics.getters.gtr import get_ai_genomics_project_table
+from ai_genomics.getters.near_duplicates import CANONICAL_IDS_PATH
+from ai_genomics.getters.openalex import get_openalex_ai_genomics_abstracts
+from ai_genomics.getters.patents import get_ai_genomics_patents
+from ai_genomics.utils.near_duplicates import find_near_duplicates
+
+
+def get_texts() -> pd.Series:
+    """Abstracts of all sources indexed by document ID"""
+    patents = get_ai_genomics_patents()
+    gtr = get_ai_genomics_project_table(local=False)
+    cb = get_ai_genomics_crunchbase_orgs(local=False)
+    texts = pd.concat(
+        [
+            pd.Series(get_openalex_ai_genomics_abstracts(local=False)),
+            patents.set_index("publication_number")["abstract_text"],
+            gtr.set_index("id")["abstract_text"],
+            cb.set_index("id")["description_combined"],
+        ]
+    ).dropna()
+    texts.index = texts.index.astype(str)
+    return texts[~texts.index.duplicated()]
+
+
+@click.command()
+@click.option(
+    "--threshold",
+    default=0.8,
+    show_default=True,
+    help="Minimum estimated Jaccard similarity of the abstracts' shingles.",
+)
+@click.option(
+    "--embeddings/--no-embeddings",
+    default=False,
+    help="Also find duplicates with SimHash over the document embeddings.",
+)
+@click.option(
+    "--cosine-threshold",
+    default=0.97,
+    show_default=True,
+    help="Minimum cosine similarity of embedding duplicates.",
+)
+def run(threshold, embeddings, cosine_threshold):
+    texts = get_texts()
+    vectors = None
+    if embeddings:
+        tables = pd.concat(
+            [get_embedding_table(source) for source in ["oa", "pat", "gtr", "cb"]]
+        )
+        tables.index = tables.index.astype(str)
+        tables = tables[~tables.index.duplicated()]
+        texts = texts[texts.index.isin(tables.index)]
+        vectors = tables.loc[texts.index].values
+
+    logger.info(f"Finding near-duplicates among {len(texts)} documents")
+    canonical = find_near_duplicates(
+        list(texts.index),
+        list(texts.values),
+        threshold=threshold,
+        embeddings=vectors,
+        cosine_threshold=cosine_threshold,
+    )
+    n_canonical = len(set(canonical.values()))
+    logger.info(
+        f"Found {len(canonical) - n_canonical} redundant documents "
+        f"in {n_canonical} duplicate clusters"
+    )
+    save_to_s3(bucket_name, canonical, CANONICAL_IDS_PATH)
+
+
+if __name__ == "__main__":
+    run()
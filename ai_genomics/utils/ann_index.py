@@ -0,0 +1,230 @@
+"""Approximate nearest neighbour search over document embeddings.
+
+`AnnIndex` wraps an HNSW graph (hnswlib) built on CPU over the embeddings of
+any of our sources. Documents can be added incrementally, the index is saved
+to disk with its document ids, and queries return the top-k document ids
+with their source (see `ai_genomics.utils.id_to_source`):
+
+    index = AnnIndex(dim=768)
+    index.add(oa_embeddings.index, oa_embeddings.values)
+    index.add(pat_embeddings.index, pat_embeddings.values)
+    index.save(ANN_INDEX_PATH)
+    neighbours = AnnIndex.load(ANN_INDEX_PATH).query(query_embeddings, k=10)
+
+`benchmark` compares the index with exact search.
+"""
+import json
+import time
+from typing import Dict, Optional, Sequence
+
+import hnswlib
+import numpy as np
+import pandas as pd
+from numpy.typing import NDArray
+
+from ai_genomics import PROJECT_DIR
+from ai_genomics.utils import id_to_source
+
+ANN_INDEX_PATH = PROJECT_DIR / "inputs/ann_index/documents"
+
+
+class AnnIndex:
+    """
+    HNSW index of document embeddings with cosine similarity.
+
+    Attributes
+    --------
+    dim: embedding dimension
+    ids: document ids, in the order they were added (index labels)
+    index: the hnswlib index
+
+    Methods
+    --------
+    add(ids, embeddings): adds new documents, growing the index if needed
+    query(embeddings, k): top-k most similar documents for each query
+    save(path) / load(path): persists the index
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        max_elements: int = 100_000,
+        ef_construction: int = 200,
+        M: int = 32,
+        ef: int = 100,
+    ):
+        self.dim = dim
+        self.ids = []
+        self.positions: Dict[str, int] = dict()
+        self.index = hnswlib.Index(space="cosine", dim=dim)
+        self.index.init_index(
+            max_elements=max_elements, ef_construction=ef_construction, M=M
+        )
+        self.index.set_ef(ef)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, ids: Sequence[str], embeddings: NDArray, n_threads: int = -1):
+        """Adds documents to the index. Documents that are already in the
+        index are skipped.
+
+        Args:
+            ids: document ids
+            embeddings: document embeddings (one row per id)
+            n_threads: number of threads used to build the graph (-1 uses
+                all cores)
+        """
+        ids = [str(_id) for _id in ids]
+        new = [n for n, _id in enumerate(ids) if _id not in self.positions]
+        if len(new) == 0:
+            return
+
+        capacity = self.index.get_max_elements()
+        if len(self) + len(new) > capacity:
+            self.index.resize_index(max(len(self) + len(new), 2 * capacity))
+
+        labels = np.arange(len(self), len(self) + len(new))
+        self.index.add_items(
+            np.asarray(embeddings, dtype=np.float32)[new], labels, num_threads=n_threads
+        )
+        for label, n in zip(labels, new):
+            self.positions[ids[n]] = int(label)
+            self.ids.append(ids[n])
+
+    def query_labels(self, embeddings: NDArray, k: int = 10):
+        """Top-k labels and cosine similarities for each query"""
+        labels, distances = self.index.knn_query(
+            np.atleast_2d(np.asarray(embeddings, dtype=np.float32)), k=min(k, len(self))
+        )
+        return labels, 1 - distances
+
+    def query(
+        self,
+        embeddings: NDArray,
+        k: int = 10,
+        query_ids: Optional[Sequence[str]] = None,
+    ) -> pd.DataFrame:
+        """Finds the most similar documents to a set of query embeddings
+
+        Args:
+            embeddings: query embeddings (a vector or one row per query)
+            k: number of neighbours per query
+            query_ids: optional ids of the queries (defaults to their
+                position)
+
+        Returns:
+            A long df with query, rank, id, source and similarity columns
+        """
+        labels, sims = self.query_labels(embeddings, k)
+        query_ids = range(len(labels)) if query_ids is None else query_ids
+        query_ids = np.asarray(query_ids, dtype=object)
+        ids = np.asarray(self.ids, dtype=object)[labels.ravel()]
+
+        return pd.DataFrame(
+            {
+                "query": np.repeat(query_ids, labels.shape[1]),
+                "rank": np.tile(np.arange(labels.shape[1]), len(labels)),
+                "id": ids,
+                "source": [id_to_source(_id) for _id in ids],
+                "similarity": sims.ravel(),
+            }
+        )
+
+    def save(self, path=ANN_INDEX_PATH):
+        """Saves the graph (`{path}.bin`) and document ids (`{path}.json`)"""
+        self.index.save_index(f"{path}.bin")
+        with open(f"{path}.json", "w") as outfile:
+            json.dump({"dim": self.dim, "ids": self.ids}, outfile)
+
+    @classmethod
+    def load(cls, path=ANN_INDEX_PATH, ef: int = 100) -> "AnnIndex":
+        """Loads an index saved with `save`. New documents can be added to
+        the loaded index.
+        """
+        with open(f"{path}.json", "r") as infile:
+            meta = json.load(infile)
+
+        ann = cls.__new__(cls)
+        ann.dim = meta["dim"]
+        ann.ids = meta["ids"]
+        ann.positions = {_id: n for n, _id in enumerate(ann.ids)}
+        ann.index = hnswlib.Index(space="cosine", dim=ann.dim)
+        ann.index.load_index(f"{path}.bin", max_elements=len(ann.ids))
+        ann.index.set_ef(ef)
+        return ann
+
+
+def exact_top_k(
+    queries: NDArray, embeddings: NDArray, k: int = 10, chunk_size: int = 256
+) -> NDArray:
+    """Exact top-k cosine neighbours (row positions) of each query, computed
+    for `chunk_size` queries at a time
+    """
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    tops = []
+    for start in range(0, len(queries), chunk_size):
+        sims = queries[start : start + chunk_size] @ embeddings.T
+        top = np.argpartition(-sims, kth=k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(sims, top, axis=1), axis=1)
+        tops.append(np.take_along_axis(top, order, axis=1))
+    return np.concatenate(tops)
+
+
+def benchmark(
+    ann: AnnIndex,
+    embeddings: NDArray,
+    n_queries: int = 1_000,
+    k: int = 10,
+    efs: Sequence[int] = (10, 50, 100, 200),
+    random_state: int = 42,
+) -> pd.DataFrame:
+    """Measures recall@k and query latency of an index against exact search,
+    querying with a sample of the indexed documents
+
+    Args:
+        ann: the index
+        embeddings: embeddings of the indexed documents, in the order they
+            were added to the index
+        n_queries: number of documents used as queries
+        k: number of neighbours
+        efs: HNSW search breadths to test (higher is slower and more exact)
+        random_state: seed for sampling queries
+
+    Returns:
+        A df with the recall and latency (ms per query) of exact search and
+        of the index for each ef
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    rng = np.random.default_rng(random_state)
+    sample = rng.choice(len(embeddings), min(n_queries, len(embeddings)), replace=False)
+    queries = embeddings[sample]
+
+    start = time.perf_counter()
+    exact = exact_top_k(queries, embeddings, k)
+    results = [
+        {
+            "method": "exact",
+            "ef": None,
+            "recall": 1.0,
+            "latency_ms": 1e3 * (time.perf_counter() - start) / len(queries),
+        }
+    ]
+
+    default_ef = ann.index.ef
+    for ef in efs:
+        ann.index.set_ef(max(ef, k))
+        start = time.perf_counter()
+        labels, _ = ann.query_labels(queries, k)
+        latency = 1e3 * (time.perf_counter() - start) / len(queries)
+        recall = np.mean(
+            [len(set(found) & set(true)) / k for found, true in zip(labels, exact)]
+        )
+        results.append(
+            {"method": "hnsw", "ef": ef, "recall": recall, "latency_ms": latency}
+        )
+    ann.index.set_ef(default_ef)
+
+    return pd.DataFrame(results)
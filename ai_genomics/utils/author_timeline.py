@@ -0,0 +1,207 @@
+"""Author - affiliation timeline index for OpenAlex authors.
+
+The timeline has one row per (author, work, institution) with the publication
+date and the institution country, sorted by author and date. It is built once
+from the yearly authorship and work metadata tables (see
+`make_author_timeline`) and supports vectorised queries such as the latest
+affiliation of every author, the authors currently based in a country or the
+top authors by number of publications in a set of works.
+"""
+import logging
+from typing import Iterable, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ai_genomics.getters.openalex import OALEX_PATH, instit_metadata
+
+TIMELINE_VARS = ["auth_id", "work_id", "pub_date", "inst_id", "country_code"]
+AUTHOR_META_VARS = ["auth_id", "auth_display_name", "auth_orcid"]
+# Publication years of the analysis window
+TIMELINE_YEARS = range(2012, 2022)
+
+
+def _year_timeline(discipline: str, year: int) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Timeline rows and author metadata for a discipline and year"""
+
+    dates = (
+        pd.read_csv(
+            f"{OALEX_PATH}/works_{discipline}_{year}.csv",
+            usecols=["work_id", "publication_date"],
+        )
+        .drop_duplicates("work_id")
+        .set_index("work_id")["publication_date"]
+        .pipe(pd.to_datetime, errors="coerce")
+    )
+    auths = pd.read_csv(
+        f"{OALEX_PATH}/authorships_{discipline}_{year}.csv",
+        usecols=["id", *AUTHOR_META_VARS, "inst_id"],
+    ).rename(columns={"id": "work_id"})
+
+    return (
+        auths[["auth_id", "work_id", "inst_id"]].assign(
+            pub_date=lambda df: df["work_id"].map(dates)
+        ),
+        auths[AUTHOR_META_VARS].drop_duplicates("auth_id"),
+    )
+
+
+def make_author_timeline(
+    disciplines: Iterable[str] = ("artificial_intelligence", "genetics"),
+    years: Iterable[int] = TIMELINE_YEARS,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Builds the author timeline one year at a time, so we never hold the
+    full authorship tables and a work to date lookup at the same time.
+
+    Args:
+        disciplines: OpenAlex disciplines to include
+        years: publication years to include
+
+    Returns:
+        The timeline sorted by author and date (works without a publication
+        date go first so the last row of each author is their latest
+        publication) and a table with author metadata
+    """
+
+    timelines, author_meta = [], []
+    for discipline in disciplines:
+        for year in years:
+            logging.info(f"Adding {discipline} {year} to author timeline")
+            timeline, meta = _year_timeline(discipline, year)
+            timelines.append(timeline)
+            author_meta.append(meta)
+
+    countries = instit_metadata().set_index("id")["country_code"]
+
+    timeline = (
+        pd.concat(timelines)
+        .drop_duplicates(["auth_id", "work_id", "inst_id"])
+        .assign(country_code=lambda df: df["inst_id"].map(countries))
+        .sort_values(["auth_id", "pub_date"], na_position="first", kind="stable")
+        .reset_index(drop=True)[TIMELINE_VARS]
+        .astype({var: "category" for var in ["auth_id", "inst_id", "country_code"]})
+    )
+    author_meta = (
+        pd.concat(author_meta).drop_duplicates("auth_id").reset_index(drop=True)
+    )
+
+    return timeline, author_meta
+
+
+def _author_bounds(timeline: pd.DataFrame) -> Tuple[np.array, np.array]:
+    """Returns the first and last row position of each author in the
+    (sorted) timeline
+    """
+
+    codes = timeline["auth_id"].cat.codes.values
+    if len(codes) == 0:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int)
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    ends = np.r_[starts[1:], len(codes)] - 1
+
+    return starts, ends
+
+
+def latest_affiliations(timeline: pd.DataFrame) -> pd.DataFrame:
+    """Finds the institutions of each author on the date of their
+    latest publication (authors can have more than one)
+
+    Args:
+        timeline: author timeline
+
+    Returns:
+        A df with auth_id, pub_date, inst_id and country_code
+    """
+
+    starts, ends = _author_bounds(timeline)
+    dates = timeline["pub_date"].values
+    last_date_per_row = np.repeat(dates[ends], ends - starts + 1)
+
+    return (
+        timeline.loc[dates == last_date_per_row]
+        .drop(axis=1, labels=["work_id"])
+        .drop_duplicates(["auth_id", "inst_id"])
+        .reset_index(drop=True)
+    )
+
+
+def latest_affiliation(timeline: pd.DataFrame) -> pd.DataFrame:
+    """Single most recent affiliation for each author (the last row of
+    each author in the timeline)
+    """
+
+    _, ends = _author_bounds(timeline)
+
+    return timeline.iloc[ends].drop(axis=1, labels=["work_id"]).reset_index(drop=True)
+
+
+def authors_in_country(timeline: pd.DataFrame, country: str) -> np.array:
+    """Returns the ids of authors with an institution in a country on the
+    date of their latest publication
+    """
+
+    return (
+        latest_affiliations(timeline)
+        .query("country_code == @country")["auth_id"]
+        .astype(str)
+        .unique()
+    )
+
+
+def top_authors(
+    timeline: pd.DataFrame,
+    author_meta: pd.DataFrame,
+    ids: Iterable[str],
+    country: str = "all",
+    instits: pd.DataFrame = None,
+) -> pd.DataFrame:
+    """Returns the authors with most publications in a set of works, with
+    their latest affiliation
+
+    Args:
+        timeline: author timeline
+        author_meta: author metadata
+        ids: work ids to count publications in
+        country: if not "all", only keep authors with an institution in this
+            country on the date of their latest publication
+        instits: institution metadata. If None, it is read with
+            `instit_metadata`
+
+    Returns:
+        A df with author ids, names and orcids, their latest institution id,
+        name and country and their number of publications (each work is
+        counted once per author), sorted by number of publications. Authors
+        with more than one institution on the date of their latest
+        publication have one row per institution. Authors without a dated
+        publication are not included
+    """
+
+    instits = instit_metadata() if instits is None else instits
+
+    num_pubs = (
+        timeline.loc[timeline["work_id"].isin(set(ids)), ["auth_id", "work_id"]]
+        .drop_duplicates()["auth_id"]
+        .value_counts()
+        .pipe(lambda counts: counts[counts > 0])
+        .rename("num_pubs")
+        .rename_axis("auth_id")
+        .reset_index()
+        .astype({"auth_id": str})
+    )
+
+    latest = latest_affiliations(timeline)
+    if country != "all":
+        latest = latest.query("country_code == @country")
+    latest = latest.astype({"auth_id": str, "inst_id": object, "country_code": object})
+
+    return (
+        num_pubs.merge(latest[["auth_id", "inst_id", "country_code"]], on="auth_id")
+        .merge(author_meta, on="auth_id", how="left")
+        .merge(
+            instits[["id", "display_name"]].rename(columns={"id": "inst_id"}),
+            on="inst_id",
+            how="left",
+        )
+        .sort_values("num_pubs", ascending=False)
+        .reset_index(drop=True)
+    )
@@ -0,0 +1,149 @@
+"""Persisted cluster centroids for assigning new documents or entities.
+
+A `CentroidModel` stores the centroids of a fitted clustering (and, for
+hierarchical entity clusters, the cluster each centroid belongs to at every
+level) as a versioned artefact. `assign` labels new rows by their nearest
+centroid in batches, so new papers can be added to existing clusters
+without refitting and existing cluster IDs stay stable:
+
+    save_centroid_model(CentroidModel.from_kmeans(km), "doc_all_2012_2021")
+    model = get_centroid_model("doc_all_2012_2021")  # latest version
+    labels = model.assign(new_embeddings)
+"""
+import json
+from datetime import datetime
+from typing import Dict, Mapping, Optional
+
+import numpy as np
+from numpy.typing import NDArray
+
+from ai_genomics import bucket_name
+
+
+class CentroidModel:
+    """
+    Cluster centroids with optional preprocessing and hierarchy levels.
+
+    Attributes
+    --------
+    centroids: one centroid per row
+    level_labels: for each level (e.g. "k_500"), the cluster ID of each
+        centroid at that level
+    normalise: whether rows (and centroids) are L2 normalised before
+        assignment
+    metadata: information about the fit (e.g. embedding model, parameters)
+    version: version of the artefact (creation timestamp)
+
+    Methods
+    --------
+    from_kmeans(km): creates a model from a fitted (MiniBatch)KMeans
+    assign(embeddings, level): nearest centroid labels of new rows
+    from_arrays(arrays) / to_arrays(): converts from / to a dict of arrays
+        that can be saved as .npz
+    """
+
+    def __init__(
+        self,
+        centroids: NDArray,
+        level_labels: Optional[Mapping[str, NDArray]] = None,
+        normalise: bool = False,
+        metadata: Optional[Dict] = None,
+        version: Optional[str] = None,
+    ):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.level_labels = {
+            level: np.asarray(labels, dtype=np.int64)
+            for level, labels in (level_labels or dict()).items()
+        }
+        self.normalise = normalise
+        self.metadata = metadata or dict()
+        self.version = version or datetime.now().strftime("%Y%m%d%H%M%S")
+        if normalise:
+            self.centroids = _l2_normalise(self.centroids)
+
+    def __len__(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def from_kmeans(cls, km, **kwargs) -> "CentroidModel":
+        """Creates a model from a fitted KMeans or MiniBatchKMeans. kwargs
+        are passed to `CentroidModel`.
+        """
+        return cls(km.cluster_centers_, **kwargs)
+
+    def assign(
+        self,
+        embeddings: NDArray,
+        level: Optional[str] = None,
+        batch_size: int = 10_000,
+    ) -> NDArray:
+        """Labels rows with their nearest centroid (by euclidean distance,
+        as in K means), computed `batch_size` rows at a time
+
+        Args:
+            embeddings: array with one row per document or entity
+            level: hierarchy level of the labels. Defaults to the centroids'
+                own cluster IDs
+            batch_size: number of rows per batch
+
+        Returns:
+            The cluster ID of each row
+        """
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        centroid_norms = (self.centroids**2).sum(axis=1)
+
+        labels = []
+        for start in range(0, len(embeddings), batch_size):
+            batch = embeddings[start : start + batch_size]
+            if self.normalise:
+                batch = _l2_normalise(batch)
+            # ||x||^2 is the same for every centroid, so it is left out
+            dists = centroid_norms - 2 * batch @ self.centroids.T
+            labels.append(np.argmin(dists, axis=1))
+        labels = np.concatenate(labels) if labels else np.empty(0, dtype=np.int64)
+
+        return labels if level is None else self.level_labels[level][labels]
+
+    def to_arrays(self) -> Dict[str, NDArray]:
+        """Arrays to save the model (e.g. as .npz with `save_to_s3`)"""
+        arrays = {
+            "centroids": self.centroids,
+            "normalise": np.array(self.normalise),
+            "metadata": np.array(json.dumps(self.metadata)),
+            "version": np.array(self.version),
+        }
+        for level, labels in self.level_labels.items():
+            arrays[f"level_{level}"] = labels
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: Mapping[str, NDArray]) -> "CentroidModel":
+        """Creates a model from arrays saved with `to_arrays`"""
+        return cls(
+            arrays["centroids"],
+            level_labels={
+                key[len("level_") :]: labels
+                for key, labels in arrays.items()
+                if key.startswith("level_")
+            },
+            normalise=bool(arrays["normalise"]),
+            metadata=json.loads(str(arrays["metadata"])),
+            version=str(arrays["version"]),
+        )
+
+
+def _l2_normalise(x: NDArray) -> NDArray:
+    """L2 normalises the rows of an array"""
+    return x / np.clip(np.linalg.norm(x, axis=1, keepdims=True), 1e-12, None)
+
+
+def save_centroid_model(model: CentroidModel, name: str):
+    """Saves a new version of a centroid model to S3 and marks it as the
+    latest (see `ai_genomics.getters.clusters.get_centroid_model`)
+    """
+    # Imported here as the getters import `CentroidModel`
+    from ai_genomics.getters.clusters import centroid_model_path
+    from ai_genomics.getters.data_getters import save_to_s3
+
+    save_to_s3(bucket_name, model.to_arrays(), centroid_model_path(name, model.version))
+    save_to_s3(bucket_name, {"version": model.version}, centroid_model_path(name))
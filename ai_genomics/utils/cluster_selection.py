@@ -0,0 +1,175 @@
+"""Selecting the number of K-means clusters.
+
+`select_k` sweeps k in increasing order. Each fit is warm-started from the
+centroids of the previous k plus new k-means++ centroids (a single init,
+the restarts are left to the final clustering), and scored with a
+silhouette estimated on random samples of the data, which gives a
+confidence interval of the score and avoids the O(n^2) cost of the exact
+silhouette. The sweep stops early once the score has plateaued.
+`select_k_parallel` runs independent sweeps (e.g. one per timeslice) over a
+process pool.
+"""
+import multiprocessing as mp
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+from scipy import stats
+from sklearn.cluster import KMeans
+from sklearn.metrics import pairwise_distances_argmin_min, silhouette_score
+
+# K-means restarts for the final clustering at the selected k
+N_INIT = 10
+
+
+def sampled_silhouette(
+    X: NDArray,
+    labels: NDArray,
+    sample_size: int = 2_000,
+    n_bootstrap: int = 20,
+    random_state: int = 42,
+) -> Tuple[float, float, float]:
+    """Estimates the mean silhouette score from random samples of the data
+
+    Args:
+        X: data
+        labels: cluster labels of each row
+        sample_size: rows per sample (the exact score is computed if the data
+            is smaller)
+        n_bootstrap: number of samples
+        random_state: random seed
+
+    Returns:
+        The mean estimate and the bounds of its 95% confidence interval
+        (mean ± t * sd / sqrt(n) over the n samples, NaN if fewer than two
+        samples have more than one cluster). The mean is NaN if no sample
+        has more than one cluster
+    """
+    if len(X) <= sample_size:
+        if len(np.unique(labels)) < 2:
+            return np.nan, np.nan, np.nan
+        score = silhouette_score(X, labels)
+        return score, score, score
+
+    rng = np.random.default_rng(random_state)
+    scores = []
+    for _ in range(n_bootstrap):
+        sample = rng.choice(len(X), sample_size, replace=False)
+        if len(np.unique(labels[sample])) > 1:
+            scores.append(silhouette_score(X[sample], labels[sample]))
+    if len(scores) == 0:
+        return np.nan, np.nan, np.nan
+    mean = float(np.mean(scores))
+    if len(scores) == 1:
+        return mean, np.nan, np.nan
+    half_width = stats.t.ppf(0.975, len(scores) - 1) * stats.sem(scores)
+    return mean, float(mean - half_width), float(mean + half_width)
+
+
+def warm_start_centres(
+    X: NDArray, centres: NDArray, n_clusters: int, random_state: int = 42
+) -> NDArray:
+    """Extends a set of centroids to n_clusters, adding new ones with
+    k-means++ sampling (proportional to the squared distance to the nearest
+    existing centroid)
+    """
+    rng = np.random.default_rng(random_state)
+    centres = list(centres)
+    closest = pairwise_distances_argmin_min(X, np.asarray(centres))[1] ** 2
+    while len(centres) < n_clusters:
+        probs = closest / closest.sum() if closest.sum() > 0 else None
+        new = X[rng.choice(len(X), p=probs)]
+        centres.append(new)
+        closest = np.minimum(closest, ((X - new) ** 2).sum(axis=1))
+    return np.asarray(centres)
+
+
+def select_k(
+    X: NDArray,
+    ks: Sequence[int] = range(10, 100, 5),
+    sample_size: int = 2_000,
+    n_bootstrap: int = 20,
+    patience: Optional[int] = 3,
+    tol: float = 1e-3,
+    random_state: int = 42,
+) -> Tuple[int, Dict[int, Tuple[float, float, float]]]:
+    """Finds the number of clusters with the highest (sampled) silhouette
+
+    Args:
+        X: data
+        ks: candidate numbers of clusters, swept in increasing order
+        sample_size: rows per silhouette sample
+        n_bootstrap: number of silhouette samples
+        patience: stop after this many consecutive ks without an improvement
+            of more than `tol` on the best score (None to sweep every k)
+        tol: minimum improvement of the score
+        random_state: random seed
+
+    Returns:
+        The best k (None if no k has a silhouette estimate), and the
+        silhouette estimate with its confidence interval for each k that
+        was fitted
+    """
+    X = np.asarray(X, dtype=np.float32)
+    ks = sorted(k for k in ks if k < len(X))
+    if len(ks) == 0:
+        raise ValueError(f"Too few rows ({len(X)}) for any candidate k")
+    scores, centres, best_k, waited = dict(), None, None, 0
+
+    for k in ks:
+        km = _fit_kmeans(X, k, centres, random_state)
+        labels = km.labels_
+        centres = km.cluster_centers_
+        scores[k] = sampled_silhouette(
+            X, labels, sample_size, n_bootstrap, random_state
+        )
+
+        if np.isnan(scores[k][0]):
+            waited += 1
+        elif (
+            best_k is None
+            or np.isnan(scores[best_k][0])
+            or scores[k][0] > scores[best_k][0] + tol
+        ):
+            best_k, waited = k, 0
+        elif scores[k][0] > scores[best_k][0]:
+            best_k, waited = k, waited + 1
+        else:
+            waited += 1
+        if patience is not None and waited >= patience:
+            break
+
+    return best_k, scores
+
+
+def _fit_kmeans(
+    X: NDArray, n_clusters: int, centres: Optional[NDArray], random_state: int
+) -> KMeans:
+    """Fits K-means once, warm-started from `centres` if given (k-means++
+    otherwise)
+    """
+    init = (
+        "k-means++"
+        if centres is None
+        else warm_start_centres(X, centres, n_clusters, random_state)
+    )
+    return KMeans(
+        n_clusters=n_clusters, init=init, n_init=1, random_state=random_state
+    ).fit(X)
+
+
+def select_k_parallel(
+    datasets: Sequence[NDArray], n_workers: Optional[int] = None, **kwargs
+) -> List[Tuple[int, Dict[int, Tuple[float, float, float]]]]:
+    """Runs `select_k` on several datasets over a process pool. kwargs are
+    passed to `select_k`.
+    """
+    with mp.get_context("spawn").Pool(n_workers) as pool:
+        return pool.starmap(
+            _select_k_kwargs, [(X, kwargs) for X in datasets], chunksize=1
+        )
+
+
+def _select_k_kwargs(X: NDArray, kwargs: Dict):
+    """`select_k` with keyword arguments (for `Pool.starmap`)"""
+    return select_k(X, **kwargs)
@@ -0,0 +1,184 @@
+"""Concept hierarchy index for OpenAlex concepts.
+
+OpenAlex concepts form a DAG (each concept lists its ancestors). The
+`ConceptHierarchy` stores the transitive closure of that DAG as a sparse
+boolean matrix so that ancestor / descendant expansion, and finding all works
+tagged with any descendant of a set of concepts, are sparse products rather
+than repeated string searches and merges.
+"""
+import json
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix, identity, load_npz, save_npz
+
+MAX_CLOSURE_STEPS = 10
+
+
+def _closure(edges: csr_matrix) -> csr_matrix:
+    """Transitive (and reflexive) closure of a boolean adjacency matrix"""
+
+    reach = (identity(edges.shape[0], format="csr", dtype=bool) + edges).astype(bool)
+    for _ in range(MAX_CLOSURE_STEPS):
+        extended = (reach @ reach).astype(bool)
+        if extended.nnz == reach.nnz:
+            break
+        reach = extended
+    return reach
+
+
+class ConceptHierarchy:
+    """
+    Transitive closure of the OpenAlex concept DAG.
+
+    Attributes
+    --------
+    concept_ids: list of OpenAlex concept ids (matrix rows / columns)
+    names: lookup between concept ids and display names (display names are
+        not unique)
+    closure: sparse boolean matrix where closure[i, j] is True if concept j
+        is concept i or one of its ancestors
+
+    Methods
+    --------
+    from_concepts(concepts): builds the hierarchy from OpenAlex concepts
+    save(path) / load(path): persists the index
+    ancestors(concepts): ids of the ancestors of a list of concepts
+    descendants(concepts): ids of the descendants of a list of concepts
+    work_concept_matrix(work_concepts, min_score): works x concepts matrix
+    works_with_descendants(concepts, work_concepts, min_score): works tagged
+        with any of the concepts or their descendants above a score
+    """
+
+    def __init__(
+        self, concept_ids: List[str], names: Dict[str, str], closure: csr_matrix
+    ):
+        self.concept_ids = list(concept_ids)
+        self.names = names
+        self.closure = closure.tocsr()
+        self.index = {_id: n for n, _id in enumerate(self.concept_ids)}
+        self.name_index = defaultdict(list)
+        for _id, name in names.items():
+            if _id in self.index:
+                self.name_index[name].append(self.index[_id])
+
+    @classmethod
+    def from_concepts(cls, concepts: List[Dict]) -> "ConceptHierarchy":
+        """Builds the hierarchy from a list of OpenAlex concepts
+        (see `ai_genomics.getters.openalex.get_openalex_concepts`)
+        """
+        concept_ids = [conc["id"] for conc in concepts]
+        index = {_id: n for n, _id in enumerate(concept_ids)}
+
+        rows, cols = [], []
+        for n, conc in enumerate(concepts):
+            for anc in conc.get("ancestors") or []:
+                if anc["id"] in index:
+                    rows.append(n)
+                    cols.append(index[anc["id"]])
+
+        edges = csr_matrix(
+            (np.ones(len(rows), dtype=bool), (rows, cols)),
+            shape=(len(concept_ids), len(concept_ids)),
+        )
+
+        return cls(
+            concept_ids,
+            {conc["id"]: conc["display_name"] for conc in concepts},
+            _closure(edges),
+        )
+
+    def save(self, path: str):
+        """Saves the closure matrix (`{path}.npz`) and ids and names
+        (`{path}.json`)
+        """
+        save_npz(f"{path}.npz", self.closure)
+        with open(f"{path}.json", "w") as outfile:
+            json.dump({"concept_ids": self.concept_ids, "names": self.names}, outfile)
+
+    @classmethod
+    def load(cls, path: str) -> "ConceptHierarchy":
+        """Loads a hierarchy saved with `save`"""
+        with open(f"{path}.json", "r") as infile:
+            meta = json.load(infile)
+        return cls(meta["concept_ids"], meta["names"], load_npz(f"{path}.npz"))
+
+    def _positions(self, concepts: Iterable[str]) -> List[int]:
+        """Matrix positions of concepts given as ids or display names. A
+        display name shared by several concepts refers to all of them.
+
+        Raises:
+            ValueError: if a concept is not in the hierarchy
+        """
+        concepts = list(concepts)
+        missing = [
+            c for c in concepts if (c not in self.index) & (c not in self.name_index)
+        ]
+        if len(missing) > 0:
+            raise ValueError(f"Concepts not in the hierarchy: {missing}")
+        return [
+            pos
+            for conc in concepts
+            for pos in (
+                [self.index[conc]] if conc in self.index else self.name_index[conc]
+            )
+        ]
+
+    def ancestors(self, concepts: Iterable[str]) -> List[str]:
+        """Ids of the concepts and all their ancestors"""
+        cols = self.closure[self._positions(concepts)].indices
+        return [self.concept_ids[n] for n in np.unique(cols)]
+
+    def descendants(self, concepts: Iterable[str]) -> List[str]:
+        """Ids of the concepts and all their descendants"""
+        rows = self.closure[:, self._positions(concepts)].tocoo().row
+        return [self.concept_ids[n] for n in np.unique(rows)]
+
+    def work_concept_matrix(
+        self, work_concepts: pd.DataFrame, min_score: float = 0
+    ) -> Tuple[csr_matrix, List[str]]:
+        """Creates a sparse boolean works x concepts matrix
+
+        Args:
+            work_concepts: df with doc_id, id (concept id) and score columns,
+                as returned by `ai_genomics.getters.openalex.work_concepts`
+            min_score: minimum score for a work to be tagged with a concept
+
+        Returns:
+            The matrix and the work ids (rows)
+        """
+        selected = work_concepts.loc[
+            (work_concepts["score"] > min_score)
+            & work_concepts["id"].isin(self.index.keys())
+        ]
+        work_ids, rows = np.unique(selected["doc_id"].values, return_inverse=True)
+        cols = selected["id"].map(self.index).values
+
+        matrix = csr_matrix(
+            (np.ones(len(rows), dtype=bool), (rows, cols)),
+            shape=(len(work_ids), len(self.concept_ids)),
+        )
+        return matrix, list(work_ids)
+
+    def works_with_descendants(
+        self,
+        concepts: Iterable[str],
+        work_concepts: pd.DataFrame,
+        min_score: float = 0,
+    ) -> List[str]:
+        """Finds works tagged with any of the concepts or their descendants
+        above a score, with a single sparse product
+
+        Args:
+            concepts: concept ids or display names
+            work_concepts: df with doc_id, id and score columns
+            min_score: minimum score for a work to be tagged with a concept
+
+        Returns:
+            The ids of the works
+        """
+        matrix, work_ids = self.work_concept_matrix(work_concepts, min_score)
+        hits = matrix @ self.closure[:, self._positions(concepts)]
+        return [work_ids[n] for n in np.unique(hits.tocoo().row)]
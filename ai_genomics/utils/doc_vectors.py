@@ -0,0 +1,93 @@
+"""Sparse document x entity (cluster) count vectors.
+
+A document x entity count matrix is built once per source with
+`doc_entity_matrix`. The document vectors of any entity cluster level are
+then a single sparse product with that level's entity x cluster indicator
+matrix (`entity_cluster_indicator`). Matrices are saved as `.npz` arrays
+together with their document ids (`to_arrays` / `from_arrays`), and loaded
+by getters as sparse dataframes with an `id` column and string column names
+(`to_sparse_frame`), like the dense csv tables they replace.
+"""
+from typing import Dict, List, Mapping, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from numpy.typing import NDArray
+from scipy.sparse import csr_matrix
+
+
+def doc_entity_matrix(
+    entities: Mapping[str, Sequence[str]], vocabulary: Sequence[str]
+) -> Tuple[csr_matrix, List[str]]:
+    """Counts the entities of each document
+
+    Args:
+        entities: entities (without scores) for a set of documents
+        vocabulary: entities that are counted (columns of the matrix)
+
+    Returns:
+        A documents x vocabulary sparse count matrix, and the document ids
+        of its rows
+    """
+    columns = {ent: n for n, ent in enumerate(vocabulary)}
+    indptr, indices = [0], []
+    for ents in entities.values():
+        indices.extend(columns[e] for e in ents if e in columns)
+        indptr.append(len(indices))
+
+    matrix = csr_matrix(
+        (np.ones(len(indices), dtype=np.int32), indices, indptr),
+        shape=(len(entities), len(vocabulary)),
+    )
+    # Sums repeated entities within a document
+    matrix.sum_duplicates()
+    return matrix, list(entities.keys())
+
+
+def entity_cluster_indicator(
+    vocabulary: Sequence[str], entity_to_clusters_lookup: Mapping[str, int]
+) -> csr_matrix:
+    """Entities x clusters indicator matrix of an entity cluster lookup
+    (entities without a cluster have an empty row)
+    """
+    n_clusters = max(entity_to_clusters_lookup.values()) + 1
+    rows = [n for n, ent in enumerate(vocabulary) if ent in entity_to_clusters_lookup]
+    cols = [entity_to_clusters_lookup[vocabulary[n]] for n in rows]
+    return csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, cols)),
+        shape=(len(vocabulary), n_clusters),
+    )
+
+
+def to_arrays(matrix: csr_matrix, ids: Sequence[str]) -> Dict[str, NDArray]:
+    """Arrays to save a sparse matrix and its row ids (e.g. as .npz with
+    `save_to_s3`)
+    """
+    matrix = csr_matrix(matrix)
+    return {
+        "data": matrix.data,
+        "indices": matrix.indices,
+        "indptr": matrix.indptr,
+        "shape": np.array(matrix.shape),
+        "ids": np.asarray(ids, dtype=str),
+    }
+
+
+def from_arrays(arrays: Mapping[str, NDArray]) -> Tuple[csr_matrix, NDArray]:
+    """Sparse matrix and row ids from arrays saved with `to_arrays`"""
+    matrix = csr_matrix(
+        (arrays["data"], arrays["indices"], arrays["indptr"]),
+        shape=tuple(arrays["shape"]),
+    )
+    return matrix, arrays["ids"]
+
+
+def to_sparse_frame(matrix: csr_matrix, ids: Sequence[str]) -> pd.DataFrame:
+    """Sparse dataframe with an `id` column and a string column name per
+    matrix column ("0", "1", ...)
+    """
+    frame = pd.DataFrame.sparse.from_spmatrix(
+        matrix, columns=[str(c) for c in range(matrix.shape[1])]
+    )
+    frame.insert(0, "id", ids)
+    return frame
@@ -0,0 +1,141 @@
+"""Content-addressed cache of text embeddings.
+
+Embeddings are keyed on (model, hash of the normalised text) and stored in
+append-only shards: each call that embeds new texts writes one `.npy` shard
+with the vectors and one `.json` file with the text hashes of its rows.
+Shards are memory-mapped when the cache is opened, so only the rows that are
+requested are read from disk. Encoders only need to embed cache misses:
+
+    cache = EmbeddingCache("all-MiniLM-L6-v2")
+    embeddings = cache.embed(texts, encoder)
+"""
+import hashlib
+import json
+import os
+import unicodedata
+from pathlib import Path
+from typing import Callable, Dict, List, Sequence, Tuple, Union
+
+import numpy as np
+from numpy.typing import NDArray
+
+from ai_genomics import PROJECT_DIR, logger
+
+EMBEDDING_CACHE_DIR = PROJECT_DIR / "inputs/embedding_cache"
+
+
+def normalise_text(text: str) -> str:
+    """Normalises unicode and whitespace so that trivially different
+    versions of a text share an embedding
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def text_hash(text: str) -> str:
+    """Hashes a normalised text"""
+    return hashlib.sha1(normalise_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding cache for a single model.
+
+    Attributes
+    --------
+    model: name of the model the embeddings were created with
+    path: directory with the cache shards for the model
+    index: lookup between text hashes and (shard, row) positions
+
+    Methods
+    --------
+    get(hashes): returns the embeddings for a sequence of cached hashes
+    add(hashes, embeddings): persists new embeddings as a new shard
+    embed(texts, encoder): returns embeddings for texts, only encoding
+        (and caching) the texts that are not in the cache
+    """
+
+    def __init__(self, model: str, cache_dir: Union[str, Path] = EMBEDDING_CACHE_DIR):
+        self.model = model
+        self.path = Path(cache_dir) / model.replace("/", "__")
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.shards: Dict[int, NDArray] = dict()
+        self.index: Dict[str, Tuple[int, int]] = dict()
+        self._load()
+
+    def _load(self):
+        """Memory-maps existing shards and builds the hash index"""
+        for index_file in sorted(self.path.glob("shard_*.json")):
+            shard = int(index_file.stem.split("_")[-1])
+            with open(index_file, "r") as infile:
+                hashes = json.load(infile)
+            self.shards[shard] = self._open_shard(shard)
+            self.index.update((h, (shard, row)) for row, h in enumerate(hashes))
+
+    def _open_shard(self, shard: int) -> NDArray:
+        """Memory-maps the embeddings in a shard"""
+        return np.load(self.path / f"shard_{shard}.npy", mmap_mode="r")
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, _hash: str) -> bool:
+        return _hash in self.index
+
+    def get(self, hashes: Sequence[str]) -> NDArray:
+        """Returns the cached embeddings for a sequence of text hashes
+
+        Args:
+            hashes: text hashes (all must be in the cache)
+
+        Returns:
+            An array with one row per hash
+        """
+        shard_ids, rows = np.array([self.index[h] for h in hashes]).reshape(-1, 2).T
+        dims = [(shard.shape[1], shard.dtype) for shard in self.shards.values()]
+        dim, dtype = dims[0] if len(dims) > 0 else (0, np.float32)
+        out = np.empty((len(hashes), dim), dtype=dtype)
+
+        for shard in np.unique(shard_ids):
+            positions = np.flatnonzero(shard_ids == shard)
+            out[positions] = self.shards[shard][rows[positions]]
+        return out
+
+    def add(self, hashes: Sequence[str], embeddings: NDArray):
+        """Persists embeddings for new text hashes as a new shard. The index
+        file is written last so incomplete shards are never loaded.
+        """
+        shard = max(self.shards, default=-1) + 1
+        np.save(self.path / f"shard_{shard}.npy", np.asarray(embeddings))
+
+        tmp_index = self.path / f"shard_{shard}.json.tmp"
+        with open(tmp_index, "w") as outfile:
+            json.dump(list(hashes), outfile)
+        os.replace(tmp_index, self.path / f"shard_{shard}.json")
+
+        self.shards[shard] = self._open_shard(shard)
+        self.index.update((h, (shard, row)) for row, h in enumerate(hashes))
+
+    def embed(
+        self, texts: Sequence[str], encoder: Callable[[List[str]], NDArray]
+    ) -> NDArray:
+        """Embeds texts, only calling the encoder for texts that are not
+        already cached (and only once for duplicated texts)
+
+        Args:
+            texts: texts to embed
+            encoder: function that embeds a list of texts
+
+        Returns:
+            An array with one embedding per text, in the same order
+        """
+        hashes = [text_hash(text) for text in texts]
+        missing = {h: text for h, text in zip(hashes, texts) if h not in self.index}
+
+        logger.info(
+            f"Embedding cache for {self.model}: {len(missing)} of "
+            f"{len(texts)} texts need embedding"
+        )
+        if len(missing) > 0:
+            self.add(list(missing.keys()), encoder(list(missing.values())))
+
+        return self.get(hashes)
@@ -0,0 +1,240 @@
+"""Reduced precision storage for document embeddings.
+
+`QuantisedEmbeddings` stores an embedding table as float16, or as int8 with
+one scale per row (each row is divided by max(|row|) / 127 and rounded).
+Rows are only dequantised when they are requested, and cosine similarities
+against a query can be computed directly on the quantised codes:
+
+    table = QuantisedEmbeddings.from_frame(embeddings, dtype="int8")
+    save_to_s3(bucket_name, table.to_arrays(), "path/to/embeddings_int8.npz")
+    table = QuantisedEmbeddings.from_arrays(load_s3_data(bucket_name, ...))
+    sims = table.cosine(query)
+
+When a table is quantised, the cosine similarity between every original row
+and its dequantised version is checked against a bound. Rows that exceed it
+(e.g. with an outlier dimension that dominates the int8 scale) are stored
+again in float32 and used instead of their codes, so every stored row is
+within the bound, and loaders know the worst-case cosine error of the table.
+"""
+from typing import Dict, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from numpy.typing import NDArray
+
+# Default maximum cosine error (1 - cosine similarity between a row and its
+# dequantised version) accepted for each storage type
+MAX_COSINE_ERROR = {"float16": 1e-5, "int8": 1e-3}
+INT8_MAX = 127
+
+
+def quantise(embeddings: NDArray, dtype: str = "int8") -> Dict[str, NDArray]:
+    """Quantises an embedding array
+
+    Args:
+        embeddings: array of embeddings (one row per document)
+        dtype: "float16" or "int8" (with one scale per row)
+
+    Returns:
+        The quantised codes and (for int8) the scale of each row
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if dtype == "float16":
+        return {"codes": embeddings.astype(np.float16)}
+    elif dtype == "int8":
+        scales = np.abs(embeddings).max(axis=1) / INT8_MAX
+        scales[scales == 0] = 1
+        codes = np.rint(embeddings / scales[:, None]).astype(np.int8)
+        return {"codes": codes, "scales": scales.astype(np.float32)}
+    raise ValueError(f"Unsupported storage type {dtype}")
+
+
+def cosine_error(original: NDArray, dequantised: NDArray) -> NDArray:
+    """1 - cosine similarity between each row of two arrays"""
+    dot = (original * dequantised).sum(axis=1)
+    norms = np.linalg.norm(original, axis=1) * np.linalg.norm(dequantised, axis=1)
+    return 1 - dot / np.clip(norms, 1e-12, None)
+
+
+class QuantisedEmbeddings:
+    """
+    Embedding table stored as float16 or per-row scaled int8.
+
+    Attributes
+    --------
+    ids: document ids (one per row)
+    codes: quantised embeddings
+    scales: scale of each row (int8 only)
+    norms: norm of each dequantised row
+    max_cosine_error: worst-case cosine error of the stored rows
+    fallback_rows: positions of the rows stored in float32 (sorted)
+    fallback: float32 embeddings of the fallback rows
+
+    Methods
+    --------
+    from_frame(embeddings, dtype, max_cosine_error): quantises a df of
+        embeddings indexed by document id
+    from_arrays(arrays) / to_arrays(): converts from / to a dict of arrays
+        that can be saved as .npz
+    dequantise(rows): float32 embeddings of a set of rows
+    loc(ids): float32 embeddings of a set of documents as a df
+    cosine(query): cosine similarity between queries and all rows
+    to_frame(): the full float32 table as a df
+    """
+
+    def __init__(
+        self,
+        ids: Sequence[str],
+        codes: NDArray,
+        scales: Optional[NDArray] = None,
+        max_cosine_error: float = 0.0,
+        fallback_rows: Optional[NDArray] = None,
+        fallback: Optional[NDArray] = None,
+    ):
+        self.ids = np.asarray(ids)
+        self.codes = codes
+        self.scales = scales
+        self.max_cosine_error = float(max_cosine_error)
+        self.fallback_rows = np.asarray(
+            [] if fallback_rows is None else fallback_rows, dtype=np.int64
+        )
+        self.fallback = (
+            np.empty((0, codes.shape[1]), dtype=np.float32)
+            if fallback is None
+            else np.asarray(fallback, dtype=np.float32)
+        )
+        self.dtype = "int8" if scales is not None else "float16"
+        self.index = pd.Index(self.ids)
+        self.norms = self._norms()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _norms(self, chunk_size: int = 100_000) -> NDArray:
+        """Norms of the dequantised rows, computed in chunks"""
+        return np.concatenate(
+            [
+                np.linalg.norm(self.dequantise(slice(i, i + chunk_size)), axis=1)
+                for i in range(0, len(self), chunk_size)
+            ]
+            or [np.empty(0, dtype=np.float32)]
+        )
+
+    @classmethod
+    def from_frame(
+        cls,
+        embeddings: pd.DataFrame,
+        dtype: str = "int8",
+        max_cosine_error: Optional[float] = None,
+    ) -> "QuantisedEmbeddings":
+        """Quantises a table of embeddings, checking the cosine error. Rows
+        whose error exceeds the bound are stored in float32 instead.
+
+        Args:
+            embeddings: df of embeddings indexed by document id
+            dtype: "float16" or "int8"
+            max_cosine_error: maximum accepted cosine error for any row.
+                Defaults to `MAX_COSINE_ERROR[dtype]`
+
+        Returns:
+            The quantised table
+        """
+        max_cosine_error = (
+            MAX_COSINE_ERROR[dtype] if max_cosine_error is None else max_cosine_error
+        )
+        values = embeddings.to_numpy(dtype=np.float32)
+        quantised = quantise(values, dtype)
+        errors = cosine_error(values, cls(embeddings.index, **quantised).dequantise())
+        fallback_rows = np.flatnonzero(errors > max_cosine_error)
+
+        return cls(
+            embeddings.index.astype(str),
+            **quantised,
+            max_cosine_error=float(np.delete(errors, fallback_rows).max(initial=0)),
+            fallback_rows=fallback_rows,
+            fallback=values[fallback_rows],
+        )
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, NDArray]) -> "QuantisedEmbeddings":
+        """Creates a table from arrays saved with `to_arrays`"""
+        return cls(
+            arrays["ids"],
+            arrays["codes"],
+            arrays["scales"] if "scales" in arrays else None,
+            float(arrays["max_cosine_error"]),
+            arrays.get("fallback_rows"),
+            arrays.get("fallback"),
+        )
+
+    def to_arrays(self) -> Dict[str, NDArray]:
+        """Arrays to save the table (e.g. as .npz with `save_to_s3`)"""
+        arrays = {
+            "ids": self.ids.astype(str),
+            "codes": self.codes,
+            "max_cosine_error": np.array(self.max_cosine_error),
+            "fallback_rows": self.fallback_rows,
+            "fallback": self.fallback,
+        }
+        if self.scales is not None:
+            arrays["scales"] = self.scales
+        return arrays
+
+    def dequantise(self, rows: Union[slice, Sequence[int], NDArray] = slice(None)):
+        """Returns float32 embeddings for a set of rows (all by default)"""
+        values = self.codes[rows].astype(np.float32)
+        if self.scales is not None:
+            values *= self.scales[rows][:, None]
+        if len(self.fallback_rows) > 0:
+            found, positions = self._find_fallback(np.arange(len(self))[rows])
+            values[found] = self.fallback[positions]
+        return values
+
+    def _find_fallback(self, rows: NDArray) -> Tuple[NDArray, NDArray]:
+        """Which of a set of rows are fallback rows, and their positions in
+        `fallback`
+        """
+        positions = np.searchsorted(self.fallback_rows, rows)
+        positions = np.minimum(positions, len(self.fallback_rows) - 1)
+        found = self.fallback_rows[positions] == rows
+        return found, positions[found]
+
+    def loc(self, ids: Sequence[str]) -> pd.DataFrame:
+        """Returns float32 embeddings for a set of document ids"""
+        rows = self.index.get_indexer(ids)
+        if (rows < 0).any():
+            raise KeyError("Some ids are not in the embedding table")
+        return pd.DataFrame(self.dequantise(rows), index=self.ids[rows])
+
+    def cosine(self, query: NDArray, chunk_size: int = 100_000) -> NDArray:
+        """Cosine similarity between queries and every row, computed on the
+        quantised codes (dequantising one chunk of rows at a time)
+
+        Args:
+            query: a query vector or an array with one query per row
+            chunk_size: number of rows processed at a time
+
+        Returns:
+            An array with shape (number of queries, number of rows)
+        """
+        query = np.atleast_2d(np.asarray(query, dtype=np.float32))
+        norms = np.linalg.norm(query, axis=1, keepdims=True)
+        query = query / np.clip(norms, 1e-12, None)
+
+        sims = np.empty((len(query), len(self)), dtype=np.float32)
+        for start in range(0, len(self), chunk_size):
+            rows = slice(start, start + chunk_size)
+            dot = query @ self.codes[rows].astype(np.float32).T
+            if self.scales is not None:
+                dot *= self.scales[rows]
+            if len(self.fallback_rows) > 0:
+                found, positions = self._find_fallback(
+                    np.arange(start, min(start + chunk_size, len(self)))
+                )
+                dot[:, found] = query @ self.fallback[positions].T
+            sims[:, rows] = dot / np.clip(self.norms[rows], 1e-12, None)
+        return sims
+
+    def to_frame(self) -> pd.DataFrame:
+        """Dequantises the full table into a df indexed by document id"""
+        return pd.DataFrame(self.dequantise(), index=pd.Index(self.ids, name="id"))
@@ -3,6 +3,7 @@ from collections import Counter
 from itertools import chain
 import numpy as np
 
+from pathlib import Path
 from typing import Mapping, Optional, Union, List, Dict
 from ai_genomics.utils.text_embedding import embed, reduce
 
@@ -14,14 +15,27 @@ def strip_scores(entities):
 
 
 def generate_embed_lookup(
-    entities: List[str], model: str, reduce_embedding=False
+    entities: List[str],
+    model: str,
+    reduce_embedding=False,
+    cache_dir: Optional[Union[str, Path]] = None,
+    backend: str = "torch",
+    pre_components: Optional[int] = None,
+    reducer_cache_dir: Optional[Union[str, Path]] = None,
 ) -> Dict[str, np.array]:
     """Generates an embedding lookup where the key is the entity
-    and the value is the embedding. 
+    and the value is the embedding. If `cache_dir` is specified,
+    embeddings are read from and saved to a persistent embedding cache.
+    `backend` is passed to `ai_genomics.utils.text_embedding.embed` and
+    `pre_components` and `reducer_cache_dir` (a persistent cache of fitted
+    reducers) to `ai_genomics.utils.text_embedding.reduce`.
     """
-    embeds = embed(entities, model=model)
+    embeds = embed(entities, model=model, cache_dir=cache_dir, backend=backend)
     if reduce_embedding:
-        return dict(zip(entities, reduce(embeds)))
+        reduced = reduce(
+            embeds, pre_components=pre_components, cache_dir=reducer_cache_dir
+        )
+        return dict(zip(entities, reduced))
     return dict(zip(entities, embeds))
 
 
@@ -0,0 +1,211 @@
+"""Exact k nearest neighbour graphs over document embeddings.
+
+`knn_graph` finds the exact top-k cosine neighbours of every row of an
+embedding array. Similarities are computed in tiles of `block_size` x
+`block_size` rows, so memory is bounded by the tile size rather than N x N,
+and row blocks are processed by a thread pool (the matrix products release
+the GIL, and BLAS is limited to one thread per worker so the cores are not
+oversubscribed). The graph is a sparse CSR matrix where row i holds the cosine
+similarities of the k neighbours of document i, and can be saved with
+`save_knn_graph` and reused by reducers and clusterers (see
+`ai_genomics.utils.text_embedding.reduce` and `leiden_clusters`).
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple, Union
+from pathlib import Path
+
+import numpy as np
+import umap
+from numpy.typing import NDArray
+from scipy.sparse import csr_matrix, load_npz, save_npz
+from threadpoolctl import threadpool_limits
+
+from ai_genomics import logger
+
+
+def _normalise(embeddings: NDArray) -> NDArray:
+    """L2 normalises the rows of an array (as float32)"""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.clip(norms, 1e-12, None)
+
+
+def _block_top_k(
+    block: NDArray, offset: int, embeddings: NDArray, k: int, block_size: int
+) -> Tuple[NDArray, NDArray]:
+    """Exact top-k neighbours of a block of rows (starting at row `offset`),
+    scanning the embeddings one tile at a time and keeping a running top-k.
+    Each row is its own first neighbour: it is excluded from the search by
+    index (so identical rows do not displace it) and prepended.
+
+    Returns:
+        The column indices and similarities of the top-k neighbours of each
+        row, sorted by decreasing similarity
+    """
+    rows = np.arange(len(block))
+    best_idx = np.zeros((len(block), 0), dtype=np.int64)
+    best_sim = np.zeros((len(block), 0), dtype=np.float32)
+
+    for start in range(0, len(embeddings) if k > 1 else 0, block_size):
+        sims = block @ embeddings[start : start + block_size].T
+        self_cols = offset + rows - start
+        in_tile = (self_cols >= 0) & (self_cols < sims.shape[1])
+        sims[rows[in_tile], self_cols[in_tile]] = -np.inf
+        idx = np.broadcast_to(np.arange(start, start + sims.shape[1]), sims.shape)
+        cand_sim = np.concatenate([best_sim, sims], axis=1)
+        cand_idx = np.concatenate([best_idx, idx], axis=1)
+
+        keep = min(k - 1, cand_sim.shape[1])
+        top = np.argpartition(-cand_sim, kth=keep - 1, axis=1)[:, :keep]
+        best_sim = np.take_along_axis(cand_sim, top, axis=1)
+        best_idx = np.take_along_axis(cand_idx, top, axis=1)
+
+    order = np.argsort(-best_sim, axis=1, kind="stable")
+    return (
+        np.hstack([(offset + rows)[:, None], np.take_along_axis(best_idx, order, 1)]),
+        np.hstack(
+            [
+                np.ones((len(block), 1), dtype=np.float32),
+                np.take_along_axis(best_sim, order, axis=1),
+            ]
+        ),
+    )
+
+
+def knn_graph(
+    embeddings: NDArray,
+    k: int = 15,
+    block_size: int = 4_096,
+    n_threads: Optional[int] = None,
+) -> csr_matrix:
+    """Builds the exact top-k cosine nearest neighbour graph of a set of
+    embeddings. Each document is its own first neighbour (as expected by
+    UMAP), even if other documents have identical embeddings, so row i has
+    k entries starting with i itself.
+
+    Args:
+        embeddings: array with one embedding per row
+        k: number of neighbours per document (including itself)
+        block_size: number of rows (and columns) in each similarity tile.
+            Each thread holds a block_size x block_size array
+        n_threads: number of threads (each runs single-threaded BLAS).
+            Defaults to the number of cores
+
+    Returns:
+        An N x N sparse matrix with the cosine similarity of each document
+        to its k nearest neighbours
+    """
+    embeddings = _normalise(embeddings)
+    n_docs = len(embeddings)
+    if n_docs == 0:
+        return csr_matrix((0, 0), dtype=np.float32)
+    k = min(k, n_docs)
+    starts = range(0, n_docs, block_size)
+
+    logger.info(f"Building {k}-NN graph for {n_docs} documents")
+    with threadpool_limits(limits=1, user_api="blas"), ThreadPoolExecutor(
+        n_threads or os.cpu_count()
+    ) as pool:
+        blocks = list(
+            pool.map(
+                lambda start: _block_top_k(
+                    embeddings[start : start + block_size],
+                    start,
+                    embeddings,
+                    k,
+                    block_size,
+                ),
+                starts,
+            )
+        )
+
+    indices = np.concatenate([idx for idx, _ in blocks])
+    sims = np.concatenate([sim for _, sim in blocks])
+
+    return csr_matrix(
+        (sims.ravel(), indices.ravel(), np.arange(0, n_docs * k + 1, k)),
+        shape=(n_docs, n_docs),
+    )
+
+
+def knn_arrays(graph: csr_matrix) -> Tuple[NDArray, NDArray]:
+    """Converts a k-NN graph into (indices, distances) arrays of shape
+    N x k, sorted by increasing cosine distance, as used by UMAP's
+    `precomputed_knn`
+    """
+    k = np.diff(graph.indptr)
+    if len(k) > 0 and (k != k[0]).any():
+        raise ValueError("All documents must have the same number of neighbours")
+    k = int(k[0]) if len(k) > 0 else 0
+
+    indices = graph.indices.reshape(-1, k)
+    # Clipped before sorting so rounding does not put a duplicate before
+    # the document itself
+    dists = np.clip(1 - graph.data.reshape(-1, k), 0, None)
+    order = np.argsort(dists, axis=1, kind="stable")
+    return (
+        np.take_along_axis(indices, order, axis=1),
+        np.take_along_axis(dists, order, axis=1),
+    )
+
+
+def umap_reducer(knn: Optional[csr_matrix] = None, **kwargs) -> umap.UMAP:
+    """Creates a UMAP reducer that uses a precomputed k-NN graph (if given)
+    instead of searching for neighbours itself. kwargs are passed to UMAP.
+    """
+    if knn is None:
+        return umap.UMAP(**kwargs)
+
+    knn_indices, knn_dists = knn_arrays(knn)
+    return umap.UMAP(
+        n_neighbors=knn_indices.shape[1],
+        metric="cosine",
+        precomputed_knn=(knn_indices, knn_dists, None),
+        **kwargs,
+    )
+
+
+def leiden_clusters(
+    graph: csr_matrix, resolution: float = 1.0, random_state: int = 42
+) -> NDArray:
+    """Clusters documents by finding communities in their (symmetrised)
+    k-NN graph with the Leiden algorithm
+
+    Args:
+        graph: k-NN graph from `knn_graph`
+        resolution: higher values give more, smaller clusters
+        random_state: random seed
+
+    Returns:
+        The cluster label of each document
+    """
+    # Imported here so igraph is only needed for graph clustering
+    import igraph as ig
+    import leidenalg
+
+    sym = graph.maximum(graph.T).tocoo()
+    upper = sym.row < sym.col
+    g = ig.Graph(
+        n=graph.shape[0],
+        edges=list(zip(sym.row[upper], sym.col[upper])),
+        edge_attrs={"weight": np.clip(sym.data[upper], 0, None)},
+    )
+    partition = leidenalg.find_partition(
+        g,
+        leidenalg.RBConfigurationVertexPartition,
+        weights="weight",
+        resolution_parameter=resolution,
+        seed=random_state,
+    )
+    return np.array(partition.membership)
+
+
+def save_knn_graph(graph: csr_matrix, path: Union[str, Path]):
+    """Saves a k-NN graph as a compressed sparse npz file"""
+    save_npz(path, graph)
+
+
+def load_knn_graph(path: Union[str, Path]) -> csr_matrix:
+    """Loads a k-NN graph saved with `save_knn_graph`"""
+    return load_npz(path).tocsr()
@@ -0,0 +1,199 @@
+"""Batched and cached language identification using fastText.
+
+The `LanguageDetector` predicts the language of texts in batches, only sends
+each distinct text to the model once and persists its predictions so that
+repeated runs (and repeated titles across disciplines and years) are free.
+It can be used for any of our text sources, for example:
+
+    detector = LanguageDetector(cache_path=LID_CACHE_PATH)
+    langs = detector.predict(patents["abstract_text"])
+    detector.save_cache()
+"""
+import hashlib
+import json
+import logging
+import os
+from itertools import chain
+from multiprocessing import Pool
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import fasttext
+import numpy as np
+import pandas as pd
+from toolz import partition_all
+
+from ai_genomics import PROJECT_DIR
+
+LID_MODEL_PATH = f"{PROJECT_DIR}/inputs/models/lid.176.ftz"
+LID_CACHE_PATH = f"{PROJECT_DIR}/inputs/models/lid_cache.json"
+
+# Model used by worker processes, loaded once per worker by `_init_worker`
+_worker_model = None
+
+
+def normalise_text(text: str) -> str:
+    """Normalises a text before language prediction (fastText can't
+    handle newlines and the original pipeline lowercased titles)
+    """
+    return " ".join(text.lower().split())
+
+
+def text_hash(text: str) -> str:
+    """Hashes a normalised text to use as a cache key"""
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
+def _load_model(model_path: str):
+    """Loads a fastText language identification model"""
+    return fasttext.load_model(model_path)
+
+
+def _init_worker(model_path: str):
+    """Loads the fastText model in a worker process"""
+    global _worker_model
+    _worker_model = _load_model(model_path)
+
+
+def _predict_batch(texts: List[str], model=None) -> List[Tuple[str, float]]:
+    """Predicts the language of a batch of normalised texts
+
+    Args:
+        texts: normalised texts
+        model: a fastText model. If None, uses the model loaded in the
+            worker process
+
+    Returns:
+        A list of (language, probability) tuples
+    """
+    model = _worker_model if model is None else model
+    labels, probs = model.predict(list(texts), k=1)
+    return [
+        (label[0].split("__")[-1], float(prob[0])) for label, prob in zip(labels, probs)
+    ]
+
+
+class LanguageDetector:
+    """
+    Predicts the language of texts with a fastText model.
+
+    Texts are normalised and hashed; only hashes missing from the cache are
+    predicted, in batches and optionally over a pool of worker processes.
+
+    Attributes
+    --------
+    model_path: path to the fastText language identification model
+    cache_path: path to a json file where predictions are persisted. If None,
+        predictions are only cached in memory
+    batch_size: number of texts sent to the model in each call
+    n_workers: number of worker processes. If 1, predicts in this process
+
+    Methods
+    --------
+    predict(texts): predicts the language and probability of each text
+    save_cache(): persists the cache to `cache_path`
+    """
+
+    def __init__(
+        self,
+        model_path: str = LID_MODEL_PATH,
+        cache_path: Optional[str] = None,
+        batch_size: int = 10_000,
+        n_workers: int = 1,
+    ):
+        self.model_path = model_path
+        self.cache_path = cache_path
+        self.batch_size = batch_size
+        self.n_workers = n_workers
+        self._model = None
+        self.cache = self._read_cache()
+
+    def _read_cache(self) -> Dict[str, Tuple[str, float]]:
+        """Reads the persisted predictions if they exist"""
+        if self.cache_path is not None and os.path.exists(self.cache_path):
+            with open(self.cache_path, "r") as infile:
+                return {k: tuple(v) for k, v in json.load(infile).items()}
+        return dict()
+
+    def save_cache(self):
+        """Persists the predictions in the cache"""
+        if self.cache_path is None:
+            raise ValueError("LanguageDetector was created without a cache_path")
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        with open(self.cache_path, "w") as outfile:
+            json.dump(self.cache, outfile)
+
+    def _predict_missing(self, texts: Dict[str, str]):
+        """Predicts the language of texts (keyed by hash) and adds them
+        to the cache
+        """
+        hashes, norm_texts = list(texts.keys()), list(texts.values())
+        batches = partition_all(self.batch_size, norm_texts)
+
+        logging.info(f"Predicting language for {len(norm_texts)} new texts")
+        if self.n_workers > 1:
+            with Pool(
+                self.n_workers, initializer=_init_worker, initargs=(self.model_path,)
+            ) as pool:
+                preds = list(chain(*pool.imap(_predict_batch, batches)))
+        else:
+            if self._model is None:
+                self._model = _load_model(self.model_path)
+            preds = list(
+                chain(*[_predict_batch(batch, self._model) for batch in batches])
+            )
+
+        self.cache.update(zip(hashes, preds))
+
+    def predict(self, texts: Union[Sequence, pd.Series]) -> pd.DataFrame:
+        """Predicts the language of a sequence of texts
+
+        Args:
+            texts: texts to predict. Non-string values get missing predictions
+
+        Returns:
+            A df with `predicted_language` and `language_probability` columns,
+            with the same index as `texts` if it is a series
+        """
+        index = texts.index if isinstance(texts, pd.Series) else None
+        norm_texts = [
+            normalise_text(text) if isinstance(text, str) else None for text in texts
+        ]
+        hashes = [text_hash(text) if text is not None else None for text in norm_texts]
+
+        missing = {
+            _hash: text
+            for _hash, text in zip(hashes, norm_texts)
+            if (_hash is not None) and (_hash not in self.cache)
+        }
+        if len(missing) > 0:
+            self._predict_missing(missing)
+
+        return pd.DataFrame(
+            [
+                self.cache[_hash] if _hash is not None else (np.nan, np.nan)
+                for _hash in hashes
+            ],
+            columns=["predicted_language", "language_probability"],
+            index=index,
+        )
+
+
+def predict_languages(
+    texts: Iterable, cache_path: Optional[str] = LID_CACHE_PATH, **kwargs
+) -> pd.DataFrame:
+    """Predicts the language of texts with a `LanguageDetector` and persists
+    the updated cache
+
+    Args:
+        texts: texts to predict
+        cache_path: where to persist predictions
+        kwargs: passed to `LanguageDetector`
+
+    Returns:
+        A df with `predicted_language` and `language_probability` columns
+    """
+    detector = LanguageDetector(cache_path=cache_path, **kwargs)
+    preds = detector.predict(texts if isinstance(texts, pd.Series) else list(texts))
+    if cache_path is not None:
+        detector.save_cache()
+    return preds
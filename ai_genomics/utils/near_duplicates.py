@@ -0,0 +1,283 @@
+"""Near-duplicate detection across document sources.
+
+Documents are represented by MinHash signatures of their word shingles.
+Locality sensitive hashing (LSH) splits each signature into bands and only
+documents that share a band bucket are compared, so finding candidate pairs
+is near-linear in the number of documents. Candidates are kept if their
+estimated Jaccard similarity is above a threshold and grouped into
+duplicate clusters with union-find. Optionally, candidates can also be found
+with SimHash signatures of document embeddings.
+
+Each cluster is mapped to a canonical document ID, so downstream stages can
+reuse the results of the canonical document for its near-duplicates:
+
+    signatures = minhash_signatures(texts)
+    pairs = lsh_candidate_pairs(signatures)
+    pairs = pairs[estimated_jaccard(signatures, pairs) >= 0.8]
+    canonical = canonical_id_mapping(ids, duplicate_clusters(len(ids), pairs))
+"""
+import re
+import zlib
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from numpy.typing import NDArray
+
+from ai_genomics.utils import id_to_source
+
+MERSENNE_PRIME = (1 << 31) - 1
+# Signature value of texts without shingles (MinHash values are < MERSENNE_PRIME)
+EMPTY_SIGNATURE = np.iinfo(np.uint32).max
+# Sources in order of preference for the canonical ID of a cluster (IDs of
+# other sources come last)
+SOURCE_PRIORITY = {"oa": 0, "pat": 1, "gtr": 2, "cb": 3}
+
+
+def shingles(text: str, k: int = 3) -> NDArray:
+    """Hashes of the word k-grams of a lowercased text (a text with fewer
+    than k words is a single shingle, a text without words has none)
+    """
+    words = re.findall(r"\w+", str(text).lower())
+    if len(words) == 0:
+        return np.empty(0, dtype=np.uint64)
+    grams = {" ".join(words[i : i + k]) for i in range(max(len(words) - k + 1, 1))}
+    return np.array(
+        [zlib.crc32(gram.encode("utf-8")) for gram in grams], dtype=np.uint64
+    )
+
+
+def minhash_signatures(
+    texts: Sequence[str], n_perm: int = 128, k: int = 3, random_state: int = 42
+) -> NDArray:
+    """MinHash signatures of the shingles of each text
+
+    Args:
+        texts: documents
+        n_perm: number of hash functions (signature length)
+        k: number of words per shingle
+        random_state: seed for the hash functions
+
+    Returns:
+        An array of shape (number of texts, n_perm). Texts without any words
+        (e.g. empty or punctuation only) have every value set to
+        `EMPTY_SIGNATURE`
+    """
+    rng = np.random.default_rng(random_state)
+    a = rng.integers(1, MERSENNE_PRIME, n_perm, dtype=np.uint64)
+    b = rng.integers(0, MERSENNE_PRIME, n_perm, dtype=np.uint64)
+
+    signatures = np.full((len(texts), n_perm), EMPTY_SIGNATURE, dtype=np.uint32)
+    for n, text in enumerate(texts):
+        x = shingles(text, k) % MERSENNE_PRIME
+        if len(x) == 0:
+            continue
+        signatures[n] = ((np.outer(x, a) + b) % MERSENNE_PRIME).min(axis=0)
+    return signatures
+
+
+def simhash_signatures(
+    embeddings: NDArray, n_bits: int = 256, random_state: int = 42
+) -> NDArray:
+    """SimHash (random hyperplane) signatures of embeddings, where the share
+    of equal bits estimates the angle between two embeddings. Embeddings are
+    centred first, as most of them otherwise fall on the same side of every
+    hyperplane and share (too large) band buckets.
+
+    Returns:
+        A boolean array of shape (number of embeddings, n_bits)
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    rng = np.random.default_rng(random_state)
+    planes = rng.standard_normal((embeddings.shape[1], n_bits)).astype(np.float32)
+    return ((embeddings - embeddings.mean(axis=0)) @ planes) > 0
+
+
+def lsh_candidate_pairs(
+    signatures: NDArray,
+    n_bands: int = 32,
+    max_bucket_size: int = 1_000,
+    include: Optional[NDArray] = None,
+    max_pairs_per_doc: int = 100,
+) -> NDArray:
+    """Finds pairs of documents that share at least one band of their
+    signatures. With r rows per band, pairs with similarity s are found with
+    probability 1 - (1 - s^r)^n_bands.
+
+    Args:
+        signatures: MinHash or SimHash signatures (one row per document)
+        n_bands: number of bands the signatures are split into
+        max_bucket_size: buckets with more documents (typically boilerplate
+            texts) are skipped to keep the search near-linear
+        include: boolean mask of the documents to search (e.g. excluding
+            texts without words). Defaults to all documents
+        max_pairs_per_doc: scale check. If the bands yield more candidate
+            pairs per document, the bands are too short for the data (e.g. a
+            corpus with a lot of boilerplate) and the search would approach
+            all-pairs comparison
+
+    Returns:
+        An array of unique (i, j) pairs with i < j
+
+    Raises:
+        ValueError: if there are more than `max_pairs_per_doc` candidate
+            pairs per document
+    """
+    n_docs, n_cols = signatures.shape
+    rows_per_band = n_cols // n_bands
+    docs = np.arange(n_docs) if include is None else np.flatnonzero(include)
+    max_pairs = max_pairs_per_doc * max(len(docs), 1)
+    pairs, n_pairs = [], 0
+
+    for band in range(n_bands):
+        cols = signatures[docs, band * rows_per_band : (band + 1) * rows_per_band]
+        _, buckets = np.unique(cols, axis=0, return_inverse=True)
+        for _, members in pd.Series(docs).groupby(buckets.ravel()):
+            if 1 < len(members) <= max_bucket_size:
+                members = members.values
+                n_pairs += len(members) * (len(members) - 1) // 2
+                if n_pairs > max_pairs:
+                    raise ValueError(
+                        f"LSH bands yield more than {max_pairs} candidate pairs "
+                        f"for {len(docs)} documents: use more rows per band "
+                        "(fewer bands or longer signatures)"
+                    )
+                i, j = np.triu_indices(len(members), k=1)
+                pairs.append(np.stack([members[i], members[j]], axis=1))
+
+    if len(pairs) == 0:
+        return np.empty((0, 2), dtype=np.int64)
+    return np.unique(np.concatenate(pairs), axis=0)
+
+
+def estimated_jaccard(signatures: NDArray, pairs: NDArray) -> NDArray:
+    """Share of equal MinHash values (an estimate of the Jaccard similarity of
+    the shingles) for each pair of documents
+    """
+    return (signatures[pairs[:, 0]] == signatures[pairs[:, 1]]).mean(axis=1)
+
+
+def cosine_similarity_pairs(embeddings: NDArray, pairs: NDArray) -> NDArray:
+    """Cosine similarity of the embeddings of each pair of documents"""
+    x, y = embeddings[pairs[:, 0]], embeddings[pairs[:, 1]]
+    norms = np.linalg.norm(x, axis=1) * np.linalg.norm(y, axis=1)
+    return (x * y).sum(axis=1) / np.clip(norms, 1e-12, None)
+
+
+def duplicate_clusters(n_docs: int, pairs: NDArray) -> List[List[int]]:
+    """Groups documents connected by duplicate pairs with union-find
+
+    Returns:
+        A list of clusters (positions of documents), only including
+        clusters with more than one document
+    """
+    parent = np.arange(n_docs)
+
+    def find(i):
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    for i, j in pairs:
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    clusters = defaultdict(list)
+    for i in np.unique(pairs):
+        clusters[find(i)].append(int(i))
+    return [members for members in clusters.values() if len(members) > 1]
+
+
+def canonical_id_mapping(
+    ids: Sequence[str], clusters: List[List[int]]
+) -> Dict[str, str]:
+    """Maps every document in a duplicate cluster to the cluster's canonical
+    ID (from the preferred source, see `SOURCE_PRIORITY`, then the smallest
+    ID). Documents that are not duplicates are not included.
+    """
+    mapping = dict()
+    for members in clusters:
+        member_ids = [str(ids[i]) for i in members]
+        canonical = min(
+            member_ids,
+            key=lambda _id: (
+                SOURCE_PRIORITY.get(id_to_source(_id), len(SOURCE_PRIORITY)),
+                _id,
+            ),
+        )
+        mapping.update({_id: canonical for _id in member_ids})
+    return mapping
+
+
+def find_near_duplicates(
+    ids: Sequence[str],
+    texts: Sequence[str],
+    threshold: float = 0.8,
+    embeddings: Optional[NDArray] = None,
+    cosine_threshold: float = 0.97,
+    n_perm: int = 128,
+    n_bands: int = 32,
+    n_bits: int = 256,
+    n_simhash_bands: int = 16,
+) -> Dict[str, str]:
+    """Finds near-duplicate documents (across or within sources) and maps
+    each of them to a canonical ID
+
+    Args:
+        ids: document ids
+        texts: document texts (e.g. abstracts)
+        threshold: minimum estimated Jaccard similarity of the shingles of
+            two duplicates
+        embeddings: optional document embeddings. If given, pairs with a
+            cosine similarity above `cosine_threshold` found with SimHash
+            are also duplicates (catching reworded texts)
+        cosine_threshold: minimum cosine similarity of embedding duplicates
+        n_perm: MinHash signature length
+        n_bands: number of LSH bands of the MinHash signatures
+        n_bits: SimHash signature length
+        n_simhash_bands: number of LSH bands of the SimHash signatures (with
+            the defaults, 16 bits per band)
+
+    Returns:
+        A lookup between duplicate document IDs and their canonical ID.
+        Documents without any words are never duplicates.
+    """
+    signatures = minhash_signatures(texts, n_perm=n_perm)
+    has_words = (signatures != EMPTY_SIGNATURE).any(axis=1)
+    pairs = lsh_candidate_pairs(signatures, n_bands=n_bands, include=has_words)
+    pairs = pairs[estimated_jaccard(signatures, pairs) >= threshold]
+
+    if embeddings is not None:
+        emb_pairs = lsh_candidate_pairs(
+            simhash_signatures(embeddings, n_bits=n_bits),
+            n_bands=n_simhash_bands,
+            include=has_words,
+        )
+        emb_pairs = emb_pairs[
+            cosine_similarity_pairs(embeddings, emb_pairs) >= cosine_threshold
+        ]
+        pairs = np.concatenate([pairs, emb_pairs])
+
+    return canonical_id_mapping(ids, duplicate_clusters(len(ids), pairs))
+
+
+def canonical_positions(ids: Sequence[str], canonical: Dict[str, str]) -> NDArray:
+    """Position in `ids` of the canonical document of each document, so
+    documents whose canonical document is also in `ids` can reuse its
+    results (e.g. embeddings) instead of being processed. Documents that are
+    not duplicates, or whose canonical document is not in `ids`, map to
+    their own position.
+    """
+    positions = {str(_id): n for n, _id in enumerate(ids)}
+    return np.array(
+        [
+            positions.get(canonical.get(str(_id), str(_id)), n)
+            for n, _id in enumerate(ids)
+        ],
+        dtype=np.int64,
+    )
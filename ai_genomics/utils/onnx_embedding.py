@@ -0,0 +1,255 @@
+"""Quantised ONNX inference for sentence transformer models on CPU.
+
+A sentence transformer is exported once to an ONNX graph of its transformer
+module, dynamically quantised to int8 and saved with its tokenizer and
+pooling settings. `OnnxEncoder` then runs batched inference with
+onnxruntime and applies the same pooling (and normalisation) as the original
+model:
+
+    export_onnx("all-MiniLM-L6-v2")
+    embeddings = OnnxEncoder("all-MiniLM-L6-v2").encode(texts)
+
+Quantisation changes the embeddings slightly; `cosine_drift` compares them
+with the fp32 embeddings of the original model.
+"""
+import json
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Union
+
+import numpy as np
+import onnxruntime as ort
+import pandas as pd
+import torch
+from numpy.typing import NDArray
+from onnxruntime.quantization import QuantType, quantize_dynamic
+from sentence_transformers import SentenceTransformer
+from sentence_transformers.models import Normalize, Pooling
+from transformers import AutoTokenizer
+
+from ai_genomics import PROJECT_DIR, logger
+from ai_genomics.utils.text_embedding import (
+    TOKEN_BUDGET,
+    encode_bucketed,
+    get_model,
+    length_batches,
+    token_lengths,
+)
+
+ONNX_MODEL_DIR = PROJECT_DIR / "inputs/models/onnx"
+ONNX_OPSET = 14
+
+
+class _TransformerWrapper(torch.nn.Module):
+    """Returns only the token embeddings of a huggingface model so that it
+    can be traced with named inputs
+    """
+
+    def __init__(self, auto_model):
+        super().__init__()
+        self.auto_model = auto_model
+
+    def forward(self, input_ids, attention_mask, token_type_ids=None):
+        inputs = dict(input_ids=input_ids, attention_mask=attention_mask)
+        if token_type_ids is not None:
+            inputs["token_type_ids"] = token_type_ids
+        return self.auto_model(**inputs, return_dict=False)[0]
+
+
+def onnx_model_path(model: str, model_dir: Union[str, Path] = ONNX_MODEL_DIR) -> Path:
+    """Directory of the exported version of a model"""
+    return Path(model_dir) / model.replace("/", "__")
+
+
+def _pooling_config(st_model: SentenceTransformer) -> Dict:
+    """Pooling mode, normalisation and max sequence length of a sentence
+    transformer
+    """
+    pooling = [mod for mod in st_model if isinstance(mod, Pooling)]
+    if len(pooling) == 0:
+        raise ValueError("Only models with a pooling layer can be exported")
+    config = pooling[0].get_config_dict()
+
+    return {
+        "mode": (
+            "cls"
+            if config["pooling_mode_cls_token"]
+            else "max"
+            if config["pooling_mode_max_tokens"]
+            else "mean"
+        ),
+        "normalize": any(isinstance(mod, Normalize) for mod in st_model),
+        "max_seq_length": st_model.max_seq_length,
+    }
+
+
+def export_onnx(
+    model: str, model_dir: Union[str, Path] = ONNX_MODEL_DIR, quantise: bool = True
+) -> Path:
+    """Exports the transformer of a sentence transformer model to ONNX and
+    (optionally) quantises its weights to int8. Models that have already
+    been exported are not exported again.
+
+    Args:
+        model: name of a sentence transformer model
+        model_dir: directory where exported models are saved
+        quantise: whether to also save an int8 quantised graph
+
+    Returns:
+        The directory with the exported model
+    """
+    path = onnx_model_path(model, model_dir)
+    fp32_path, int8_path = path / "model.onnx", path / "model_int8.onnx"
+
+    if not fp32_path.exists():
+        logger.info(f"Exporting {model} to ONNX")
+        path.mkdir(parents=True, exist_ok=True)
+        st_model = get_model(model, device="cpu")
+        tokenizer = st_model.tokenizer
+
+        dummy = tokenizer(["An example text"], return_tensors="pt")
+        input_names = [
+            name
+            for name in ["input_ids", "attention_mask", "token_type_ids"]
+            if name in dummy
+        ]
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+        dynamic_axes["token_embeddings"] = {0: "batch", 1: "sequence"}
+
+        torch.onnx.export(
+            _TransformerWrapper(st_model[0].auto_model).eval(),
+            tuple(dummy[name] for name in input_names),
+            str(fp32_path),
+            input_names=input_names,
+            output_names=["token_embeddings"],
+            dynamic_axes=dynamic_axes,
+            opset_version=ONNX_OPSET,
+        )
+        tokenizer.save_pretrained(str(path))
+        with open(path / "pooling.json", "w") as outfile:
+            json.dump(_pooling_config(st_model), outfile)
+
+    if quantise and not int8_path.exists():
+        logger.info(f"Quantising {model} to int8")
+        quantize_dynamic(str(fp32_path), str(int8_path), weight_type=QuantType.QInt8)
+
+    return path
+
+
+class OnnxEncoder:
+    """
+    Sentence transformer inference with an exported ONNX graph.
+
+    Attributes
+    --------
+    model: name of the sentence transformer model
+    session: onnxruntime inference session
+    tokenizer: the model's tokenizer
+    pooling: pooling mode, normalisation and max sequence length
+
+    Methods
+    --------
+    encode(texts, token_budget): embeds a sequence of texts in
+        length-bucketed batches
+    """
+
+    def __init__(
+        self,
+        model: str,
+        model_dir: Union[str, Path] = ONNX_MODEL_DIR,
+        quantised: bool = True,
+        n_threads: int = 0,
+        max_seq_length: Optional[int] = None,
+    ):
+        self.model = model
+        path = export_onnx(model, model_dir, quantise=quantised)
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = n_threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            str(path / ("model_int8.onnx" if quantised else "model.onnx")),
+            options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = [inp.name for inp in self.session.get_inputs()]
+        self.tokenizer = AutoTokenizer.from_pretrained(str(path))
+        with open(path / "pooling.json", "r") as infile:
+            self.pooling = json.load(infile)
+        if max_seq_length is not None:
+            self.pooling["max_seq_length"] = max_seq_length
+
+    def _pool(self, token_embeddings: NDArray, attention_mask: NDArray) -> NDArray:
+        """Pools token embeddings into text embeddings"""
+        mask = attention_mask[..., None].astype(token_embeddings.dtype)
+        if self.pooling["mode"] == "cls":
+            pooled = token_embeddings[:, 0]
+        elif self.pooling["mode"] == "max":
+            pooled = np.where(mask > 0, token_embeddings, -np.inf).max(axis=1)
+        else:
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(
+                mask.sum(axis=1), 1e-9, None
+            )
+        if self.pooling["normalize"]:
+            pooled = pooled / np.linalg.norm(pooled, axis=1, keepdims=True)
+        return pooled
+
+    def encode(self, texts: Sequence[str], token_budget: int = TOKEN_BUDGET) -> NDArray:
+        """Embeds texts in batches of similar length with at most
+        `token_budget` padded tokens (see
+        `ai_genomics.utils.text_embedding.length_batches`)
+
+        Args:
+            texts: texts to embed
+            token_budget: maximum number of padded tokens per inference call
+
+        Returns:
+            A float32 array with one embedding per text, in the same order
+        """
+        texts = list(texts)
+        max_length = self.pooling["max_seq_length"]
+        lengths = token_lengths(self.tokenizer, texts, max_length)
+
+        out = None
+        for batch in length_batches(lengths, token_budget):
+            tokens = self.tokenizer(
+                [texts[i] for i in batch],
+                padding=True,
+                truncation=True,
+                max_length=max_length,
+                return_tensors="np",
+            )
+            inputs = {name: tokens[name].astype(np.int64) for name in self.input_names}
+            token_embeddings = self.session.run(None, inputs)[0]
+            pooled = self._pool(token_embeddings, tokens["attention_mask"])
+            if out is None:
+                out = np.empty((len(texts), pooled.shape[1]), dtype=np.float32)
+            out[batch] = pooled
+
+        return out if out is not None else np.empty((0, 0), dtype=np.float32)
+
+
+def cosine_drift(
+    texts: Sequence[str], model: str, model_dir: Union[str, Path] = ONNX_MODEL_DIR
+) -> pd.Series:
+    """Compares the quantised ONNX embeddings of a sample of texts with the
+    fp32 embeddings of the original sentence transformer
+
+    Args:
+        texts: a sample of texts
+        model: name of a sentence transformer model
+        model_dir: directory where exported models are saved
+
+    Returns:
+        Summary statistics of the cosine similarity between the fp32 and
+        int8 embedding of each text (1 means no drift)
+    """
+    fp32 = encode_bucketed(get_model(model, device="cpu"), texts)
+    int8 = OnnxEncoder(model, model_dir, quantised=True).encode(texts)
+
+    cosine = (fp32 * int8).sum(axis=1) / (
+        np.linalg.norm(fp32, axis=1) * np.linalg.norm(int8, axis=1)
+    )
+    drift = pd.Series(cosine).describe(percentiles=[0.01, 0.05, 0.5])
+    logger.info(f"Cosine similarity between fp32 and int8 {model}:\n{drift}")
+
+    return drift
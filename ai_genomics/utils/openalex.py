@@ -10,6 +10,7 @@ from toolz import pipe, partial
 
 
 from ai_genomics import config
+from ai_genomics.utils.text_cleaning import clean_word
 
 CONCEPT_THRES = config["concept_threshold"]
 
@@ -74,6 +75,31 @@ def deinvert_abstract(inverted_abstract: Dict[str, List]) -> Union[str, None]:
         return " ".join(abstr_empty)
 
 
+def tokens_from_inverted_index(inverted_abstract: Dict[str, List[int]]) -> List[str]:
+    """Creates a clean token stream directly from an inverted abstract,
+    without deinverting it and tokenising the text again.
+
+    Args:
+        inverted_abstract: a dict where the keys are words
+            and the values lists of positions
+
+    Returns:
+        The clean tokens in the order they appear in the abstract
+    """
+
+    if len(inverted_abstract) == 0:
+        return []
+
+    slots = (max(chain(*inverted_abstract.values())) + 1) * [()]
+    for word, positions in inverted_abstract.items():
+        toks = clean_word(word)
+        if len(toks) > 0:
+            for p in positions:
+                slots[p] = toks
+
+    return list(chain(*slots))
+
+
 def extract_obj_meta(oalex_object: Dict, meta_vars: List) -> Dict:
     """Extracts variables of interest from an OpenAlex object (eg work, insitution...)
 
@@ -275,6 +301,32 @@ def make_deinverted_abstracts(work_list: List) -> Dict:
     }
 
 
+def make_abstract_tokens(work_list: List) -> Dict:
+    """Dict with the clean abstract tokens of each work (where available),
+    extracted directly from the inverted abstracts
+    """
+
+    return {
+        doc["id"]: tokens_from_inverted_index(doc["abstract_inverted_index"])
+        if (type(doc["abstract_inverted_index"]) == dict)
+        else None
+        for doc in work_list
+    }
+
+
+def abstract_tokens_from_abstracts(abstracts: Dict) -> Dict:
+    """Dict with the clean abstract tokens of each work, from its deinverted
+    abstract (e.g. to backfill years saved before the tokens were)
+    """
+
+    return {
+        work_id: list(chain(*(clean_word(word) for word in abstract.split(" "))))
+        if abstract is not None
+        else None
+        for work_id, abstract in abstracts.items()
+    }
+
+
 if __name__ == "__main__":
     import logging
 
@@ -312,3 +364,6 @@ if __name__ == "__main__":
 
     logging.info("checking deinverted abstracts")
     logging.info(list(make_deinverted_abstracts(works).values())[0])
+
+    logging.info("checking abstract tokens")
+    logging.info(list(make_abstract_tokens(works).values())[0])
@@ -1,6 +1,7 @@
 import json
 import pathlib
-from typing import Union, Dict, List, Any
+from collections.abc import Mapping
+from typing import Union, Dict, List, Any, Iterator, Sequence
 import pandas as pd
 import boto3
 
@@ -33,3 +34,47 @@ def make_path_if_not_exist(path: Union[pathlib.Path, str]):
     path = _convert_str_to_pathlib_path(path)
     if not path.exists():
         path.mkdir(parents=True)
+
+
+class MergedMapping(Mapping):
+    """
+    Read-only view that merges a sequence of mappings (e.g. one dict of
+    abstracts per year) without copying them into a single dict.
+
+    Keys are resolved on access. As with `dict(a, **b)`, when a key is in more
+    than one mapping the value from the latest mapping in the sequence is used.
+    """
+
+    def __init__(self, mappings: Sequence[Mapping]):
+        self.mappings = list(mappings)
+
+    def __getitem__(self, key):
+        for mapping in reversed(self.mappings):
+            if key in mapping:
+                return mapping[key]
+        raise KeyError(key)
+
+    def __contains__(self, key) -> bool:
+        return any(key in mapping for mapping in self.mappings)
+
+    def _unique_keys(self, position: int) -> Iterator:
+        """Keys in a mapping that are not overridden by a later mapping"""
+        later = self.mappings[position + 1 :]
+        return (
+            key
+            for key in self.mappings[position]
+            if not any(key in mapping for mapping in later)
+        )
+
+    def __iter__(self) -> Iterator:
+        for position in range(len(self.mappings)):
+            yield from self._unique_keys(position)
+
+    def __len__(self) -> int:
+        return sum(
+            sum(1 for _ in self._unique_keys(position))
+            for position in range(len(self.mappings))
+        )
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({len(self.mappings)} mappings)"
@@ -0,0 +1,210 @@
+"""Cached dimensionality reduction of embeddings.
+
+`CachedReducer` reduces embeddings with an optional PCA / TruncatedSVD stage
+followed by UMAP, and persists every fitted reducer together with the
+reduced points, keyed on a fingerprint of its input. Reducing the same
+embeddings again loads the stored result. Reducing a set of embeddings that
+mostly overlaps a previous fit (e.g. the same entities plus one more year)
+reuses the stored coordinates and only projects the new points with the
+fitted reducer's `transform`, instead of refitting. Projections only store
+their reduced points and the key of the fit they were projected into, and
+are always made from an original fit (never from another projection), so
+the cache does not grow with a copy of the reducer per input and projected
+points do not drift. Once the share of new points passes a threshold, a new
+reducer is fitted:
+
+    reducer = CachedReducer(REDUCER_CACHE_DIR, pre_components=50)
+    reduced = reducer.reduce(embeddings)
+"""
+import hashlib
+import json
+import os
+import pickle
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import umap
+from numpy.typing import NDArray
+from sklearn.decomposition import PCA, TruncatedSVD
+from sklearn.pipeline import make_pipeline
+
+from ai_genomics import PROJECT_DIR, logger
+
+REDUCER_CACHE_DIR = PROJECT_DIR / "inputs/reducers"
+PRE_REDUCERS = {"pca": PCA, "svd": TruncatedSVD}
+
+
+def row_hashes(embeds: NDArray) -> List[str]:
+    """Hashes each row of an embedding array"""
+    embeds = np.ascontiguousarray(embeds, dtype=np.float32)
+    return [hashlib.sha1(row.tobytes()).hexdigest() for row in embeds]
+
+
+def fingerprint(hashes: List[str]) -> str:
+    """Fingerprint of an (ordered) set of rows"""
+    return hashlib.sha1("".join(hashes).encode()).hexdigest()
+
+
+class CachedReducer:
+    """
+    PCA / TruncatedSVD + UMAP reducer with a persistent cache of fits.
+
+    Attributes
+    --------
+    path: directory with the fits for this set of parameters
+    params: reduction parameters (part of the cache key)
+    max_new_fraction: maximum share of new points that are projected into
+        an existing fit instead of refitting
+
+    Methods
+    --------
+    reduce(embeds): reduces embeddings, loading or extending a cached fit
+        when possible
+    transform(embeds): projects new points with the latest fit
+    """
+
+    def __init__(
+        self,
+        cache_dir: Union[str, Path] = REDUCER_CACHE_DIR,
+        n_components: int = 2,
+        pre_components: Optional[int] = None,
+        pre_method: str = "pca",
+        max_new_fraction: float = 0.2,
+        random_state: int = 42,
+    ):
+        self.params = {
+            "n_components": n_components,
+            "pre_components": pre_components,
+            "pre_method": pre_method,
+            "random_state": random_state,
+        }
+        params_key = hashlib.sha1(
+            json.dumps(self.params, sort_keys=True).encode()
+        ).hexdigest()[:8]
+        self.path = Path(cache_dir) / params_key
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_new_fraction = max_new_fraction
+
+    def _make_reducer(self, n_dims: int):
+        """Creates an (unfitted) reduction pipeline"""
+        steps = []
+        pre_components = self.params["pre_components"]
+        if pre_components is not None and pre_components < n_dims:
+            steps.append(
+                PRE_REDUCERS[self.params["pre_method"]](
+                    n_components=pre_components,
+                    random_state=self.params["random_state"],
+                )
+            )
+        steps.append(
+            umap.UMAP(
+                n_components=self.params["n_components"],
+                random_state=self.params["random_state"],
+            )
+        )
+        return make_pipeline(*steps)
+
+    def _save(self, key: str, reducer, hashes: List[str], reduced: NDArray):
+        """Saves a fit (`{key}.pkl`) and the hashes of its rows
+        (`{key}.json`). The pickle is written last, so only complete fits
+        are found.
+        """
+        with open(self.path / f"{key}.json", "w") as outfile:
+            json.dump(hashes, outfile)
+        tmp_path = self.path / f"{key}.pkl.tmp"
+        with open(tmp_path, "wb") as outfile:
+            pickle.dump({"reducer": reducer, "reduced": reduced}, outfile)
+        os.replace(tmp_path, self.path / f"{key}.pkl")
+
+    def _save_projection(
+        self, key: str, fit_key: str, hashes: List[str], reduced: NDArray
+    ):
+        """Saves the reduced points of a projection into the fit `fit_key`
+        (`{key}.npz`, without the reducer)
+        """
+        tmp_path = self.path / f"{key}.npz.tmp"
+        with open(tmp_path, "wb") as outfile:
+            np.savez(
+                outfile, reduced=reduced, hashes=np.array(hashes), fit=np.array(fit_key)
+            )
+        os.replace(tmp_path, self.path / f"{key}.npz")
+
+    def _load(self, key: str) -> Dict:
+        """Loads a fitted reducer and its reduced points"""
+        with open(self.path / f"{key}.pkl", "rb") as infile:
+            return pickle.load(infile)
+
+    def _latest_keys(self) -> List[str]:
+        """Keys of the cached fits, most recent first"""
+        files = sorted(self.path.glob("*.pkl"), key=os.path.getmtime, reverse=True)
+        return [f.stem for f in files]
+
+    def _best_fit(self, hashes: List[str]) -> Optional[Tuple[str, List[str]]]:
+        """Key of the most recent cached fit that covers enough of the rows,
+        and the hashes of its rows
+        """
+        for key in self._latest_keys():
+            with open(self.path / f"{key}.json", "r") as infile:
+                fit_hashes = json.load(infile)
+            known = set(fit_hashes)
+            new = sum(h not in known for h in hashes)
+            if new <= self.max_new_fraction * len(hashes):
+                return key, fit_hashes
+        return None
+
+    def reduce(self, embeds: NDArray) -> NDArray:
+        """Reduces embeddings. If the same embeddings were reduced before,
+        the stored result is returned. If most of them (all but at most
+        `max_new_fraction`) were part of a previous fit, their stored
+        coordinates are reused and only the new points are projected.
+        Otherwise a new reducer is fitted.
+
+        Args:
+            embeds: array with one embedding per row
+
+        Returns:
+            The reduced embeddings
+        """
+        embeds = np.asarray(embeds, dtype=np.float32)
+        hashes = row_hashes(embeds)
+        key = fingerprint(hashes)
+
+        if (self.path / f"{key}.pkl").exists():
+            logger.info("Loading cached reduction")
+            return self._load(key)["reduced"]
+        if (self.path / f"{key}.npz").exists():
+            logger.info("Loading cached projection")
+            with np.load(self.path / f"{key}.npz") as projection:
+                return projection["reduced"]
+
+        best = self._best_fit(hashes)
+        if best is None:
+            logger.info(f"Fitting reducer on {embeds.shape} embeddings")
+            reducer = self._make_reducer(embeds.shape[1])
+            reduced = reducer.fit_transform(embeds).astype(np.float32)
+            self._save(key, reducer, hashes, reduced)
+            return reduced
+
+        fit_key, fit_hashes = best
+        fit = self._load(fit_key)
+        positions = {h: n for n, h in enumerate(fit_hashes)}
+        rows = np.array([positions.get(h, -1) for h in hashes])
+        new = rows < 0
+        logger.info(f"Projecting {new.sum()} new points into a cached reducer")
+
+        reduced = np.empty((len(embeds), self.params["n_components"]), np.float32)
+        reduced[~new] = fit["reduced"][rows[~new]]
+        if new.any():
+            reduced[new] = fit["reducer"].transform(embeds[new])
+
+        self._save_projection(key, fit_key, hashes, reduced)
+        return reduced
+
+    def transform(self, embeds: NDArray) -> NDArray:
+        """Projects new points with the most recently fitted reducer"""
+        keys = self._latest_keys()
+        if len(keys) == 0:
+            raise ValueError("No fitted reducer in the cache")
+        reducer = self._load(keys[0])["reducer"]
+        return reducer.transform(np.asarray(embeds, dtype=np.float32))
@@ -0,0 +1,200 @@
+"""Out-of-core K-means over document embeddings.
+
+`EmbeddingBatches` reads a subset of the rows of one or more embedding
+tables (e.g. reduced precision `QuantisedEmbeddings` or memory mapped `.npy`
+arrays) in float32 batches, so the full corpus is never held as one dense
+array. `minibatch_kmeans` seeds centroids with k-means++ on a random sample
+of rows, fits `MiniBatchKMeans` by streaming the batches, runs several
+restarts in parallel and keeps the one with the lowest inertia:
+
+    batches = EmbeddingBatches([(oa.ids, oa), (pat.ids, pat)], keep=ids)
+    km = minibatch_kmeans(batches, n_clusters=20, n_init=4)
+    labels = predict_labels(km, batches)
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from numpy.typing import NDArray
+from sklearn.cluster import MiniBatchKMeans, kmeans_plusplus
+
+from ai_genomics import logger
+
+
+def _read_rows(table, rows: NDArray) -> NDArray:
+    """Reads rows of a quantised table or (memory mapped) array as float32"""
+    if hasattr(table, "dequantise"):
+        return table.dequantise(rows)
+    return np.asarray(table[rows], dtype=np.float32)
+
+
+class EmbeddingBatches:
+    """
+    Rows of one or more embedding tables, read in batches.
+
+    Attributes
+    --------
+    tables: (table, rows) pairs, where rows are the positions of the
+        selected documents in each table
+    ids: ids of the selected documents, in the order they are read
+    batch_size: number of rows per batch
+
+    Methods
+    --------
+    __iter__(): yields float32 batches of embeddings
+    shuffled(random_state): yields the batches in a random order
+    sample(n): a random sample of the selected rows
+    """
+
+    def __init__(
+        self,
+        tables: Sequence[Tuple[Sequence[str], object]],
+        keep: Optional[Sequence[str]] = None,
+        batch_size: int = 10_000,
+    ):
+        """
+        Args:
+            tables: (ids, table) pairs, where table is a `QuantisedEmbeddings`
+                or an array (e.g. `np.load(path, mmap_mode="r")`) with one
+                row per id
+            keep: ids of the documents to include (all by default). Ids that
+                are not in any table are logged and skipped
+            batch_size: number of rows per batch
+
+        Raises:
+            ValueError: if no rows are selected
+        """
+        if keep is not None:
+            keep = pd.Index(np.asarray(list(keep)).astype(str)).unique()
+        self.tables, ids = [], []
+        for table_ids, table in tables:
+            table_ids = pd.Index(np.asarray(table_ids).astype(str))
+            if keep is None:
+                rows = np.arange(len(table_ids))
+            else:
+                rows = np.flatnonzero(table_ids.isin(keep))
+            self.tables.append((table, rows))
+            ids.append(table_ids.values[rows])
+        self.ids = np.concatenate(ids) if ids else np.empty(0, dtype=str)
+        self.batch_size = batch_size
+
+        if keep is not None:
+            n_missing = (~keep.isin(self.ids)).sum()
+            if n_missing > 0:
+                logger.warning(
+                    f"{n_missing} of {len(keep)} selected ids have no embedding"
+                )
+        if len(self.ids) == 0:
+            raise ValueError("None of the selected ids are in the embedding tables")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _spans(self) -> List[Tuple[object, NDArray]]:
+        """(table, rows) of each batch"""
+        return [
+            (table, rows[start : start + self.batch_size])
+            for table, rows in self.tables
+            for start in range(0, len(rows), self.batch_size)
+        ]
+
+    def __iter__(self) -> Iterator[NDArray]:
+        for table, rows in self._spans():
+            yield _read_rows(table, rows)
+
+    def shuffled(self, random_state: int) -> Iterator[NDArray]:
+        """Yields the batches in a random order"""
+        spans = self._spans()
+        for n in np.random.default_rng(random_state).permutation(len(spans)):
+            yield _read_rows(*spans[n])
+
+    def sample(self, n: int, random_state: int = 42) -> NDArray:
+        """Reads a random sample of n of the selected rows"""
+        rng = np.random.default_rng(random_state)
+        positions = np.sort(rng.choice(len(self), min(n, len(self)), replace=False))
+        samples, offset = [], 0
+        for table, rows in self.tables:
+            in_table = positions[
+                (positions >= offset) & (positions < offset + len(rows))
+            ]
+            if len(in_table) > 0:
+                samples.append(_read_rows(table, rows[in_table - offset]))
+            offset += len(rows)
+        return np.concatenate(samples)
+
+
+def _fit_restart(
+    batches: EmbeddingBatches,
+    n_clusters: int,
+    init_size: int,
+    n_epochs: int,
+    random_state: int,
+) -> Tuple[float, MiniBatchKMeans]:
+    """Fits one mini-batch K-means restart and computes its inertia over all
+    of the rows
+    """
+    sample = batches.sample(init_size, random_state)
+    centres, _ = kmeans_plusplus(sample, n_clusters, random_state=random_state)
+    km = MiniBatchKMeans(
+        n_clusters=n_clusters,
+        init=centres,
+        n_init=1,
+        batch_size=batches.batch_size,
+        random_state=random_state,
+    )
+    for epoch in range(n_epochs):
+        for batch in batches.shuffled(random_state + epoch):
+            km.partial_fit(batch)
+
+    inertia = -sum(km.score(batch) for batch in batches)
+    return inertia, km
+
+
+def minibatch_kmeans(
+    batches: EmbeddingBatches,
+    n_clusters: int,
+    n_init: int = 4,
+    n_epochs: int = 3,
+    init_size: Optional[int] = None,
+    n_jobs: Optional[int] = None,
+    random_state: int = 42,
+) -> MiniBatchKMeans:
+    """Clusters embeddings that are streamed in batches with mini-batch
+    K-means, keeping the best of several restarts
+
+    Args:
+        batches: the embeddings to cluster
+        n_clusters: number of clusters
+        n_init: number of restarts (each with its own k-means++ seeding)
+        n_epochs: number of passes over the batches per restart
+        init_size: number of rows sampled for k-means++ seeding. Defaults to
+            the larger of 3 x n_clusters and the batch size
+        n_jobs: number of restarts fitted at once (in threads, so the
+            tables are shared). Defaults to the number of cores
+        random_state: seed of the first restart
+
+    Returns:
+        The fitted model with the lowest inertia
+    """
+    init_size = init_size or max(3 * n_clusters, batches.batch_size)
+    logger.info(
+        f"Fitting {n_init} mini-batch K-means restarts on {len(batches)} documents"
+    )
+    seeds = range(random_state, random_state + n_init)
+    with ThreadPoolExecutor(min(n_jobs or os.cpu_count(), n_init)) as pool:
+        fits = list(
+            pool.map(
+                lambda s: _fit_restart(batches, n_clusters, init_size, n_epochs, s),
+                seeds,
+            )
+        )
+    inertia, km = min(fits, key=lambda fit: fit[0])
+    logger.info(f"Best restart inertia: {inertia:.4g}")
+    return km
+
+
+def predict_labels(km: MiniBatchKMeans, batches: EmbeddingBatches) -> List[int]:
+    """Cluster labels of every row, in the order of `batches.ids`"""
+    return [int(label) for batch in batches for label in km.predict(batch)]
@@ -0,0 +1,61 @@
+"""Dependency-free text cleaning helpers
+
+These are shared by the topic modelling utils (`text_modeling`) and the
+OpenAlex fetch utils, which should not need the topic modelling stack.
+"""
+
+import re
+import unicodedata
+from functools import lru_cache
+from string import punctuation, digits
+from typing import FrozenSet, Tuple
+
+PUNCT = "|\\".join([x for x in punctuation])
+DIGITS = "|".join([x for x in digits])
+
+
+def remove_digits(doc: str):
+    """Remove digits from a document"""
+
+    return re.sub(DIGITS, "", doc)
+
+
+def remove_symbols(doc: str):
+    """Remove symbols from a document"""
+
+    return re.sub("\n", " ", re.sub(PUNCT, "", doc.lower()))
+
+
+def is_punct(token: str) -> bool:
+    """Checks if all characters in a token are (unicode) punctuation"""
+
+    return all(unicodedata.category(c).startswith("P") for c in token)
+
+
+@lru_cache(maxsize=None)
+def stop_words() -> FrozenSet[str]:
+    """spaCy's English stop words (imported on first use)"""
+
+    from spacy.lang.en.stop_words import STOP_WORDS
+
+    return frozenset(STOP_WORDS)
+
+
+@lru_cache(maxsize=None)
+def clean_word(word: str) -> Tuple[str, ...]:
+    """Applies the symbol, digit, stop word, punctuation and short token
+    filters to a single word. Words repeat across documents so results
+    are cached.
+
+    Args:
+        word: a word (e.g. a key in an OpenAlex abstract inverted index)
+
+    Returns:
+        The clean tokens in the word (usually zero or one)
+    """
+
+    return tuple(
+        tok
+        for tok in remove_digits(remove_symbols(word)).split()
+        if (tok not in stop_words()) & (is_punct(tok) is False) & (len(tok) > 2)
+    )
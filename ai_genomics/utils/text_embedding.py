@@ -1,17 +1,202 @@
 import numpy as np
+import multiprocessing as mp
+import os
+import time
+from contextlib import ExitStack
+from functools import lru_cache, partial
+from numpy.lib.format import open_memmap
 from sentence_transformers import SentenceTransformer
 from toolz.itertoolz import partition_all
+from multiprocessing.pool import Pool
 
 from numpy.typing import NDArray
-from typing import Optional, Sequence
-import umap
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Union
+from scipy.sparse import csr_matrix
+from sklearn.decomposition import PCA
+import torch
+
+from ai_genomics import logger
+from ai_genomics.utils.embedding_cache import EmbeddingCache
+from ai_genomics.utils.knn_graph import umap_reducer
+from ai_genomics.utils.reduction import CachedReducer
+
+# Maximum number of (padded) tokens in a batch
+TOKEN_BUDGET = 16_384
+MAX_BATCH_SIZE = 512
+# Default number of CPU worker processes. Each loads its own copy of the
+# model, so memory (rather than cores) is the limit
+DEFAULT_CPU_WORKERS = 4
+
+
+@lru_cache(maxsize=None)
+def get_model(
+    model: str, max_seq_length: Optional[int] = None, device: Optional[str] = None
+) -> SentenceTransformer:
+    """Loads a sentence transformer once per process. Later calls with the
+    same arguments return the same model.
+
+    Args:
+        model (str): A text transformer model from https://www.sbert.net/.
+        max_seq_length (int): If specified, texts are truncated to this
+            number of tokens.
+        device (str): Device to load the model on. Defaults to a GPU if
+            one is available.
+
+    Returns:
+        SentenceTransformer: The model.
+    """
+    logger.info(f"Loading {model}")
+    st_model = SentenceTransformer(model, device=device)
+    if max_seq_length is not None:
+        st_model.max_seq_length = max_seq_length
+    return st_model
+
+
+@lru_cache(maxsize=None)
+def get_encoder(
+    model: str, backend: str = "torch", max_seq_length: Optional[int] = None
+) -> Callable[[Sequence[str]], NDArray]:
+    """Returns a function that embeds a sequence of texts with a model and
+    backend, loading the model once per process.
+    """
+    if backend not in ("torch", "onnx"):
+        raise ValueError(f"Unknown embedding backend {backend}")
+
+    if backend == "onnx":
+        # Imported here so onnxruntime is only needed for this backend
+        from ai_genomics.utils.onnx_embedding import OnnxEncoder
+
+        return OnnxEncoder(model, max_seq_length=max_seq_length).encode
+
+    return partial(encode_bucketed, get_model(model, max_seq_length))
+
+
+def token_lengths(tokenizer, texts: Sequence[str], max_seq_length: int) -> NDArray:
+    """Number of tokens (after truncation) of each text"""
+    tokens = tokenizer(
+        list(texts), truncation=True, max_length=max_seq_length, verbose=False
+    )["input_ids"]
+    return np.array([len(t) for t in tokens])
+
+
+def length_batches(lengths: NDArray, token_budget: int = TOKEN_BUDGET) -> List[NDArray]:
+    """Groups texts of similar length into batches with at most
+    `token_budget` padded tokens, so short texts are encoded in large batches
+    and little compute is spent on padding.
+
+    Args:
+        lengths (NDArray): The token length of each text.
+        token_budget (int): Maximum batch size times the length of the
+            longest text in the batch.
+
+    Returns:
+        List[NDArray]: The positions of the texts in each batch.
+    """
+    order = np.argsort(-lengths, kind="stable")
+    batches, start = [], 0
+    while start < len(order):
+        longest = max(lengths[order[start]], 1)
+        size = min(max(token_budget // longest, 1), MAX_BATCH_SIZE)
+        batches.append(order[start : start + size])
+        start += size
+    return batches
+
+
+def encode_bucketed(
+    model: SentenceTransformer,
+    texts: Sequence[str],
+    token_budget: int = TOKEN_BUDGET,
+) -> NDArray:
+    """Encodes texts with a sentence transformer in length-bucketed batches
+    chosen against a token budget. Embeddings are returned in the original
+    order of the texts. Texts are truncated to `model.max_seq_length` tokens
+    (see `get_model`).
+
+    Args:
+        model (SentenceTransformer): A sentence transformer model.
+        texts (Sequence[str]): A sequence of texts to embed.
+        token_budget (int): Maximum number of padded tokens per batch.
+
+    Returns:
+        NDArray: Embeddings of the texts.
+    """
+    texts = list(texts)
+    lengths = token_lengths(model.tokenizer, texts, model.max_seq_length)
+    out = np.empty((len(texts), model.get_sentence_embedding_dimension()), np.float32)
+    for batch in length_batches(lengths, token_budget):
+        out[batch] = model.encode([texts[i] for i in batch], batch_size=len(batch))
+    return out
+
+
+def cache_key(model: str, backend: str = "torch", max_seq_length: int = None) -> str:
+    """Name under which embeddings are cached. Quantised and truncated
+    embeddings are cached separately from the default ones.
+    """
+    key = model if backend == "torch" else f"{model}-onnx-int8"
+    return key if max_seq_length is None else f"{key}-len{max_seq_length}"
+
+
+def iter_embed(
+    texts: Sequence[str],
+    model: str,
+    chunk_size: Optional[int] = None,
+    cache_dir: Optional[Union[str, Path]] = None,
+    backend: str = "torch",
+    max_seq_length: Optional[int] = None,
+    n_workers: int = 1,
+) -> Iterator[NDArray]:
+    """Embeds consecutive chunks of texts, so that at most one chunk of
+    embeddings needs to be held in memory. See `embed` for the arguments.
+
+    Yields:
+        NDArray: Embeddings of consecutive chunks of texts.
+    """
+    chunk_size = chunk_size or max(len(texts), 1)
+
+    if cache_dir is not None:
+        cache = EmbeddingCache(cache_key(model, backend, max_seq_length), cache_dir)
+        with ExitStack() as stack:
+            if n_workers > 1 and backend == "torch":
+                # One pool (loading the model once per worker) for every chunk
+                pool = stack.enter_context(
+                    worker_pool(model, n_workers, max_seq_length)
+                )
+                encoder = partial(
+                    encode_parallel, pool, chunk_size=max(chunk_size // n_workers, 1)
+                )
+            else:
+                encoder = get_encoder(model, backend, max_seq_length)
+            for chunk in partition_all(chunk_size, texts):
+                yield cache.embed(list(chunk), encoder)
+
+    elif n_workers > 1 and backend == "torch":
+        yield from iter_embed_parallel(
+            texts,
+            model,
+            n_workers,
+            chunk_size=max(chunk_size // n_workers, 1),
+            max_seq_length=max_seq_length,
+        )
+
+    else:
+        encoder = get_encoder(model, backend, max_seq_length)
+        for chunk in partition_all(chunk_size, texts):
+            yield encoder(chunk)
 
 
 def embed(
-    texts: Sequence[str], model: str, chunk_size: Optional[int] = None,
+    texts: Sequence[str],
+    model: str,
+    chunk_size: Optional[int] = None,
+    cache_dir: Optional[Union[str, Path]] = None,
+    backend: str = "torch",
+    max_seq_length: Optional[int] = None,
+    n_workers: int = 1,
 ) -> NDArray:
     """Fetches a transformer model and applies it to a sequence of texts to
-    generate text embeddings.
+    generate text embeddings. Models are loaded once per process (see
+    `get_model`).
 
     Args:
         texts (Sequence[str]): A sequence of texts to embed.
@@ -19,17 +204,201 @@ def embed(
         chunk_size (int): If specified, the sequence of texts will be split
             into chunks of this size and embedded sequentially. Only needed
             if memory limits are an issue.
+        cache_dir (str, Path): If specified, embeddings are read from and
+            saved to a persistent embedding cache in this directory, so only
+            texts that have not been embedded before with this model are
+            encoded. See `ai_genomics.utils.embedding_cache`.
+        backend (str): "torch" to use the sentence transformer or "onnx" to
+            use an int8 quantised ONNX export of it, which is faster on CPU.
+            See `ai_genomics.utils.onnx_embedding`.
+        max_seq_length (int): If specified, texts are truncated to this
+            number of tokens. Texts are always encoded in length-bucketed
+            batches (see `encode_bucketed`).
+        n_workers (int): If more than 1, texts are embedded on CPU by a pool
+            of worker processes (see `iter_embed_parallel`).
 
     Returns:
         NDArray: Embeddings of the texts wher m is the number of texts and n is
         the dimension of a single embeddings, which will depend on the specific
         transformer used.
     """
-    model = SentenceTransformer(model)
-    return model.encode(texts)
+    chunks = list(
+        iter_embed(
+            texts, model, chunk_size, cache_dir, backend, max_seq_length, n_workers
+        )
+    )
+    if len(chunks) == 0:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.concatenate(chunks)
+
+
+def write_memmap(
+    chunks: Iterable[NDArray], path: Union[str, Path], n_rows: int
+) -> NDArray:
+    """Writes chunks of embeddings into a preallocated .npy file as they are
+    created, logging progress and throughput.
+
+    Args:
+        chunks (Iterable[NDArray]): Consecutive chunks of embeddings.
+        path (str, Path): Path of the .npy file.
+        n_rows (int): Total number of rows in the chunks.
+
+    Returns:
+        NDArray: The embeddings, memory-mapped from the file.
+    """
+    out, start, t0 = None, 0, time.perf_counter()
+    for chunk in chunks:
+        if out is None:
+            out = open_memmap(
+                path, mode="w+", dtype=chunk.dtype, shape=(n_rows, chunk.shape[1])
+            )
+        out[start : start + len(chunk)] = chunk
+        start += len(chunk)
+
+        elapsed = time.perf_counter() - t0
+        logger.info(
+            f"Embedded {start:,} / {n_rows:,} texts "
+            f"({start / max(elapsed, 1e-9):,.0f} texts/s)"
+        )
+    if out is not None:
+        out.flush()
+    return out
+
+
+def embed_to_memmap(
+    texts: Sequence[str],
+    model: str,
+    path: Union[str, Path],
+    chunk_size: int = 10_000,
+    **kwargs,
+) -> NDArray:
+    """Embeds texts chunk by chunk straight into a .npy file, so memory use
+    is bounded by the chunk size rather than the number of texts.
+
+    Args:
+        texts (Sequence[str]): A sequence of texts to embed.
+        model (str): A text transformer model from https://www.sbert.net/.
+        path (str, Path): Path of the .npy file.
+        chunk_size (int): Number of texts embedded at a time.
+        kwargs: cache_dir, backend, max_seq_length and n_workers (see `embed`)
+
+    Returns:
+        NDArray: The embeddings, memory-mapped from the file.
+    """
+    return write_memmap(
+        iter_embed(texts, model, chunk_size, **kwargs), path, n_rows=len(texts)
+    )
+
+
+def expand_memmap(
+    embeddings: NDArray,
+    rows: NDArray,
+    path: Union[str, Path],
+    chunk_size: int = 10_000,
+) -> NDArray:
+    """Writes `embeddings[rows]` into a .npy file chunk by chunk, e.g. to
+    give near-duplicate documents the embedding of their canonical document.
+
+    Args:
+        embeddings (NDArray): Embeddings (e.g. memory-mapped).
+        rows (NDArray): Row of `embeddings` for each row of the output.
+        path (str, Path): Path of the .npy file.
+        chunk_size (int): Number of rows copied at a time.
+
+    Returns:
+        NDArray: The expanded embeddings, memory-mapped from the file.
+    """
+    out = open_memmap(
+        path,
+        mode="w+",
+        dtype=embeddings.dtype,
+        shape=(len(rows), embeddings.shape[1]),
+    )
+    for start in range(0, len(rows), chunk_size):
+        out[start : start + chunk_size] = embeddings[rows[start : start + chunk_size]]
+    out.flush()
+    return out
+
+
+# Model used by worker processes, loaded once per worker by `_init_worker`
+_worker_model = None
+
+
+def _init_worker(model: str, n_threads: int, max_seq_length: Optional[int] = None):
+    """Loads a model in a CPU worker process and pins its thread count so
+    that workers do not compete for cores
+    """
+    global _worker_model
+    torch.set_num_threads(n_threads)
+    _worker_model = get_model(model, max_seq_length, device="cpu")
+
+
+def _encode_chunk(texts: List[str]) -> NDArray:
+    """Embeds a chunk of texts with the model loaded in the worker"""
+    return encode_bucketed(_worker_model, texts)
+
+
+def worker_pool(
+    model: str, n_workers: Optional[int] = None, max_seq_length: Optional[int] = None
+) -> Pool:
+    """Starts a pool of CPU worker processes, each with its own copy of the
+    model and an equal share of the cores. See `iter_embed_parallel` for the
+    arguments.
+    """
+    n_workers = n_workers or min(DEFAULT_CPU_WORKERS, os.cpu_count())
+    n_threads = max(os.cpu_count() // n_workers, 1)
+
+    # Spawn rather than fork so that workers do not inherit torch's state
+    return mp.get_context("spawn").Pool(
+        n_workers,
+        initializer=_init_worker,
+        initargs=(model, n_threads, max_seq_length),
+    )
+
+
+def encode_parallel(
+    pool: Pool, texts: Sequence[str], chunk_size: int = 1_000
+) -> NDArray:
+    """Embeds texts with a pool started by `worker_pool`, sending
+    `chunk_size` texts to a worker at a time
+    """
+    chunks = pool.imap(_encode_chunk, partition_all(chunk_size, texts))
+    return np.concatenate(list(chunks))
+
+
+def iter_embed_parallel(
+    texts: Sequence[str],
+    model: str,
+    n_workers: Optional[int] = None,
+    chunk_size: int = 1_000,
+    max_seq_length: Optional[int] = None,
+) -> Iterator[NDArray]:
+    """Embeds texts on CPU with a pool of worker processes, each with its
+    own copy of the model and an equal share of the cores.
+
+    Args:
+        texts (Sequence[str]): A sequence of texts to embed.
+        model (str): A text transformer model from https://www.sbert.net/.
+        n_workers (int): Number of worker processes. Defaults to
+            `DEFAULT_CPU_WORKERS` (or the number of cores if lower).
+        chunk_size (int): Number of texts sent to a worker at a time.
+        max_seq_length (int): If specified, texts are truncated to this
+            number of tokens.
+
+    Yields:
+        NDArray: Embeddings of consecutive chunks of texts, in the same order
+        as the texts.
+    """
+    with worker_pool(model, n_workers, max_seq_length) as pool:
+        yield from pool.imap(_encode_chunk, partition_all(chunk_size, texts))
 
 
-def reduce(embeds: NDArray) -> NDArray:
+def reduce(
+    embeds: NDArray,
+    knn: Optional[csr_matrix] = None,
+    pre_components: Optional[int] = None,
+    cache_dir: Optional[Union[str, Path]] = None,
+) -> NDArray:
     """Reduces text embeddings to 2-dimensions using a Uniform Manifold 
         Approximation and Projection algorithm.
 
@@ -37,9 +406,25 @@ def reduce(embeds: NDArray) -> NDArray:
         embeds (NDArray):  Embeddings of the texts wher m is the number of texts and n is
             the dimension of a single embeddings, which will depend on the specific
             transformer used.
+        knn (csr_matrix): Optional precomputed cosine k-NN graph of the
+            embeddings (see `ai_genomics.utils.knn_graph`). If given, UMAP
+            uses it instead of searching for neighbours itself.
+        pre_components (int): If specified, embeddings are first reduced to
+            this number of dimensions with PCA.
+        cache_dir (str, Path): If specified, fitted reducers are persisted
+            in this directory and reused for the same (or mostly the same)
+            embeddings, projecting only new points. See
+            `ai_genomics.utils.reduction.CachedReducer`.
     
     Returns:
         NDArray: Reduced embeddings of texts to 2-dimensions
     """
-    reducer = umap.UMAP()
+    if cache_dir is not None:
+        if knn is not None:
+            raise ValueError("Cached reducers can't use a precomputed k-NN graph")
+        return CachedReducer(cache_dir, pre_components=pre_components).reduce(embeds)
+
+    if pre_components is not None and pre_components < embeds.shape[1]:
+        embeds = PCA(n_components=pre_components, random_state=42).fit_transform(embeds)
+    reducer = umap_reducer(knn)
     return reducer.fit_transform(embeds)
@@ -1,4 +1,3 @@
-import re
 from typing import List, Optional, Dict, Any, Tuple
 
 import toolz.curried as t
@@ -8,30 +7,12 @@ from pandas import DataFrame
 import tomotopy as tp
 
 
-from string import punctuation, digits
-
-PUNCT = "|\\".join([x for x in punctuation])
-DIGITS = "|".join([x for x in digits])
-
-
-def remove_digits(doc: str):
-    """Remove digits from a document"""
-
-    return re.sub(DIGITS, "", doc)
-
-
 def remove_short_tokens(doc: str):
     """Remove short tokens"""
 
     return [d for d in doc if len(d) > 2]
 
 
-def remove_symbols(doc: str):
-    """Remove symbols from a document"""
-
-    return re.sub("\n", " ", re.sub(PUNCT, "", doc.lower()))
-
-
 def remove_stop_punct(doc):
     """Remove stop words and punctuation"""
 